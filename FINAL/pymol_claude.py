@@ -14,32 +14,1134 @@ import json
 import socket
 import threading
 import time
+import base64
+import bisect
+import contextlib
+import gzip
+import hashlib
+import queue
+import itertools
+import multiprocessing
+import pickle
+import re
+import sqlite3
+import tempfile
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from collections import OrderedDict, deque
 from io import StringIO
+from string import Template
+from multiprocessing import shared_memory
+
+import numpy as np
 
 # Import PyMOL modules
-from pymol import cmd
+from pymol import cmd, parser
 
 # MCP server settings
 DEFAULT_HOST = '127.0.0.1'
 DEFAULT_PORT = 8090
-BUFFER_SIZE = 4096
+BUFFER_SIZE = 65536
+MESSAGE_TERMINATOR = b"\n\n"
+
+# Local state (checkpoints and other persistent data)
+DEFAULT_STATE_DIR = os.environ.get(
+    "PYMOL_CLAUDE_STATE_DIR",
+    os.path.join(os.path.expanduser("~"), ".pymol", "claude_state")
+)
+
+# Shared-memory transport settings
+SHM_THRESHOLD = 1 << 20  # Arrays of at least 1 MiB go through shared memory
+SHM_LIFETIME = 60.0  # Seconds before an unreleased segment is reclaimed
+SHM_PREFIX = "pymol_claude_"
+
+# Trajectory streaming settings
+TRAJECTORY_WINDOW = 8  # Frames a client may have in flight before it blocks
+
+# Change notification settings
+EVENT_TYPES = (
+    "object_loaded", "object_deleted",
+    "selection_created", "selection_deleted",
+    "view_changed", "state_count_changed"
+)
+EVENT_INTERVAL = 0.5  # Default seconds between pushed event batches
+MIN_EVENT_INTERVAL = 0.05
+
+
+# Request lanes: name -> (concurrent workers, maximum queued requests)
+LANE_LIMITS = {
+    "control": (2, 64),
+    "interactive": (2, 32),
+    "bulk": (2, 16),
+    "render": (1, 8)
+}
+CONTROL_TYPES = (
+    "ping", "release_shared", "list_checkpoints", "trace",
+    "submit_job", "job_status", "list_jobs", "cancel_job", "resume_job",
+    "define_macro", "list_macros", "delete_macro"
+)
+BULK_TYPES = (
+    "get_pdb_content", "list_pdb_files", "edit_pdb", "rollback_pdb", "get_coords", "set_coords",
+    "neighbors", "contact_map", "rmsd_matrix", "index_sequences", "search_sequence"
+)
+RENDER_COMMANDS = ("ray", "png", "mpng", "draw", "movie.produce")
+
+# Request types that never call into PyMOL, or take the command lock
+# themselves only around their PyMOL calls
+LOCK_FREE_TYPES = (
+    "ping", "release_shared", "get_pdb_content", "list_pdb_files",
+    "checkpoint", "list_checkpoints", "trace",
+    "neighbors", "contact_map", "rmsd_matrix", "index_sequences", "search_sequence",
+    "submit_job", "job_status", "list_jobs", "cancel_job", "resume_job",
+    "define_macro", "list_macros", "delete_macro",
+    "animate_view"
+)
+
+# Commands that only move the camera or read state; anything else may
+# change objects and bumps their generation
+VIEW_ONLY_COMMANDS = (
+    "turn", "move", "zoom", "orient", "center", "clip", "reset", "view",
+    "set_view", "get_view", "count_atoms", "count_states", "get_names",
+    "select", "deselect", "ray", "png", "print", "ping"
+)
+# Commands that run Python and may change any object
+SCRIPT_COMMANDS = ("python", "embed", "run", "spawn")
+# Selection words that reach beyond the objects a command names
+WIDENING_WORDS = ("or", "not", "all", "enabled", "visible")
+
+# cmd functions callable with structured arguments ("call" requests):
+# name -> (accepted keyword arguments, whether objects may change)
+CMD_API = {
+    "load": (("filename", "object", "state", "format", "multiplex", "zoom"), True),
+    "fetch": (("code", "name", "state", "type", "path"), True),
+    "delete": (("name",), True),
+    "create": (("name", "selection", "source_state", "target_state"), True),
+    "remove": (("selection",), True),
+    "h_add": (("selection", "state"), True),
+    "select": (("name", "selection", "enable", "merge", "state"), False),
+    "color": (("color", "selection"), True),
+    "set_color": (("name", "rgb"), False),
+    "bg_color": (("color",), False),
+    "show": (("representation", "selection"), True),
+    "hide": (("representation", "selection"), True),
+    "cartoon": (("type", "selection"), True),
+    "label": (("selection", "expression"), True),
+    "set": (("name", "value", "selection", "state"), True),
+    "get": (("name", "selection", "state"), False),
+    "enable": (("name",), False),
+    "disable": (("name",), False),
+    "get_view": ((), False),
+    "set_view": (("view",), False),
+    "zoom": (("selection", "buffer", "state", "complete"), False),
+    "orient": (("selection", "state"), False),
+    "center": (("selection", "state"), False),
+    "turn": (("axis", "angle"), False),
+    "count_atoms": (("selection", "state"), False),
+    "count_states": (("selection",), False),
+    "get_names": (("type", "enabled_only", "selection"), False),
+    "get_object_list": (("selection",), False),
+    "get_chains": (("selection", "state"), False),
+    "get_extent": (("selection", "state"), False),
+    "get_fastastr": (("selection", "state"), False),
+    "align": (("mobile", "target", "cutoff", "cycles", "object", "mobile_state", "target_state"), True),
+    "super": (("mobile", "target", "cutoff", "cycles", "object", "mobile_state", "target_state"), True),
+    "rms_cur": (("mobile", "target", "mobile_state", "target_state"), False),
+    "distance": (("name", "selection1", "selection2", "cutoff", "mode"), True),
+    "get_distance": (("atom1", "atom2", "state"), False),
+    "get_angle": (("atom1", "atom2", "atom3", "state"), False),
+    "png": (("filename", "width", "height", "dpi", "ray"), False)
+}
+
+# Structure file settings
+STRUCTURE_EXTENSIONS = (".pdb", ".cif", ".pdb.gz", ".cif.gz")
+GZ_INDEX_SPAN = 1 << 20  # Uncompressed bytes between seek index points
+GZ_INDEX_CACHE = 8  # Seek indexes kept per plugin
+GZ_READ_CHUNK = 1 << 16
+FILE_HISTORY_KEEP = 10  # Versions kept per edited file
+
+# Sequence index settings
+SEQUENCE_KMER = 4  # Residues per indexed k-mer
+SEQUENCE_SEARCH_LIMIT = 100  # Hits returned by default
+SEQUENCE_POOL_MIN = 64  # Changed files before parsing moves to the process pool
+SEQUENCE_BATCH = 500  # Files written per index transaction
+# Residue names -> one-letter codes; HETATM residues in MODIFIED_RESIDUES count as polymer
+RESIDUE_CODES = {
+    "ALA": "A", "ARG": "R", "ASN": "N", "ASP": "D", "CYS": "C", "GLN": "Q", "GLU": "E",
+    "GLY": "G", "HIS": "H", "ILE": "I", "LEU": "L", "LYS": "K", "MET": "M", "PHE": "F",
+    "PRO": "P", "SER": "S", "THR": "T", "TRP": "W", "TYR": "Y", "VAL": "V",
+    "MSE": "M", "SEC": "U", "PYL": "O",
+    "A": "A", "C": "C", "G": "G", "U": "U", "I": "I",
+    "DA": "A", "DC": "C", "DG": "G", "DT": "T", "DU": "U", "DI": "I"
+}
+MODIFIED_RESIDUES = ("MSE", "SEC", "PYL")
+
+# Spatial index settings
+GRID_CELL_SIZE = 5.0  # Angstroms
+GRID_CACHE_SIZE = 16  # Indexes kept per plugin
+GRID_QUERY_CHUNK = 16384  # Query points expanded at once
+
+# Contact map settings
+CONTACT_MEMORY_LIMIT = 256 << 20  # Bytes of working memory per distance block
+
+# Checkpoint settings
+CHECKPOINT_INTERVAL = 60.0  # Seconds between checkpoints (0 disables them)
+CHECKPOINT_KEEP = 5  # Checkpoints kept in the rotation
+CHECKPOINT_IDLE_WAIT = 30.0  # Longest wait for idle lanes before checkpointing anyway
+
+# Object residency settings
+RESIDENCY_BUDGET = int(os.environ.get("PYMOL_CLAUDE_RESIDENCY_BUDGET", "20000000"))  # Footprint units (0 disables eviction)
+# Footprint per atom shown in a representation, on top of one unit per atom per state
+RESIDENCY_REP_WEIGHTS = {
+    "lines": 1, "sticks": 1, "spheres": 1, "nonbonded": 1, "nb_spheres": 1,
+    "cartoon": 1, "ribbon": 1, "labels": 1, "dots": 2, "mesh": 4, "surface": 4
+}
+# Request and call argument fields that can name objects to page in
+REFERENCE_FIELDS = (
+    "command", "commands", "object", "objects", "name", "selection", "selection1",
+    "selection2", "query", "target", "mobile", "atom1", "atom2", "atom3"
+)
+
+# View animation settings
+ANIMATION_FPS = 30.0  # Default frames per second
+
+# Batch job settings
+JOB_RETRY_DELAY = 2.0  # Seconds before a failed step is retried
+JOB_LOG_KEEP = 20  # Step outputs kept per job
+
+# Request tracing settings
+TRACE_KEEP = 1000  # Finished requests kept in the trace ring buffer
+TRACE_SLOW_MS = 100.0  # Default threshold for the trace request
+TRACE_MAX_SPANS = 200  # Spans recorded per request
+
+# RMSD matrix settings
+RMSD_BLOCK = 256  # Conformers per side of one block of pairs
+RMSD_WORKERS = max((os.cpu_count() or 2) - 1, 1)  # Processes in the RMSD pool
+
+# Per-client token bucket (control requests are exempt)
+RATE_LIMIT = 20.0  # Sustained requests per second
+RATE_BURST = 40  # Requests allowed in a burst
+
+
+class RequestInterrupted(Exception):
+    """Raised between commands when a request was cancelled or ran out of time"""
+
+
+class GzipSeekIndex:
+    """
+    Random access into a gzip file through saved decompressor states
+    
+    Built in one streaming pass: every `span` uncompressed bytes the
+    decompressor is copied (decompressobj.copy() keeps its 32 KiB window)
+    along with the compressed and uncompressed offsets. A read restarts
+    from the nearest saved point before the offset instead of from the
+    start of the file. Concatenated gzip members are followed.
+    """
+    
+    def __init__(self, path, span=GZ_INDEX_SPAN):
+        self.path = path
+        self.offsets = []  # Uncompressed offset of each point
+        self.points = []  # (compressed offset, decompressor) per point
+        self.size = 0
+        
+        decompressor = zlib.decompressobj(31)
+        self._add_point(0, 0, decompressor)
+        total_in = total_out = 0
+        next_point = span
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(GZ_READ_CHUNK), b""):
+                while True:
+                    # Output is capped at span so well-compressed chunks still get points
+                    data = decompressor.decompress(chunk, span)
+                    total_out += len(data)
+                    # Past the end of a member the leftover input is in unused_data
+                    rest = decompressor.unused_data if decompressor.eof else decompressor.unconsumed_tail
+                    total_in += len(chunk) - len(rest)
+                    pending = not decompressor.eof and (rest or len(data) == span)
+                    if not pending:
+                        rest, decompressor = self._next_member(decompressor)
+                        if decompressor is None:
+                            break
+                    if total_out >= next_point:
+                        self._add_point(total_out, total_in, decompressor)
+                        next_point = total_out + span
+                    if not rest and not pending:
+                        break
+                    chunk = rest
+                if decompressor is None:
+                    break
+        self.size = total_out
+    
+    def _add_point(self, total_out, total_in, decompressor):
+        self.offsets.append(total_out)
+        self.points.append((total_in, decompressor.copy()))
+    
+    @staticmethod
+    def _next_member(decompressor):
+        """Return input left over and the decompressor for what follows"""
+        if not decompressor.eof:
+            return b"", decompressor
+        rest = decompressor.unused_data
+        if rest and not rest.strip(b"\0"):
+            # Padding after the last member
+            return b"", None
+        # The next member may start in this chunk or the next one
+        return rest, zlib.decompressobj(31)
+    
+    def read(self, offset, length):
+        """Return `length` uncompressed bytes starting at `offset`"""
+        offset = min(max(int(offset), 0), self.size)
+        end = min(offset + int(length), self.size)
+        if end <= offset:
+            return b""
+        
+        point = bisect.bisect_right(self.offsets, offset) - 1
+        position = self.offsets[point]
+        total_in, saved = self.points[point]
+        decompressor = saved.copy()
+        
+        pieces = []
+        with open(self.path, 'rb') as f:
+            f.seek(total_in)
+            while position < end and decompressor is not None:
+                chunk = f.read(GZ_READ_CHUNK)
+                if not chunk:
+                    break
+                while chunk and position < end:
+                    data = decompressor.decompress(chunk)
+                    start, stop = max(offset - position, 0), min(end - position, len(data))
+                    if stop > start:
+                        pieces.append(data[start:stop])
+                    position += len(data)
+                    chunk, decompressor = self._next_member(decompressor)
+                    if decompressor is None:
+                        break
+        return b"".join(pieces)
+
+
+def structure_name_and_format(path):
+    """Return the object name and PyMOL format for a (possibly gzipped) structure file"""
+    base = os.path.basename(path)
+    if base.lower().endswith(".gz"):
+        base = base[:-3]
+    name, extension = os.path.splitext(base)
+    return name, ("cif" if extension.lower() == ".cif" else "pdb")
+
+
+def _pdb_residues(lines):
+    """Residues of the first model (chain -> [(label, code)]) and SEQRES codes (chain -> [code])"""
+    residues = {}
+    seqres = {}
+    last = None
+    for line in lines:
+        record = line[:6]
+        if record == "ATOM  " or (record == "HETATM" and line[17:20].strip() in MODIFIED_RESIDUES):
+            key = (line[21], line[22:27])
+            if key != last:
+                last = key
+                code = RESIDUE_CODES.get(line[17:20].strip(), "X")
+                residues.setdefault(line[21].strip(), []).append((line[22:27].strip(), code))
+        elif record == "SEQRES":
+            codes = seqres.setdefault(line[11].strip(), [])
+            codes.extend(RESIDUE_CODES.get(name, "X") for name in line[19:].split())
+        elif record == "ENDMDL":
+            break
+    return residues, seqres
+
+
+def _cif_residues(lines):
+    """Residues of the first model in an mmCIF _atom_site loop (chain -> [(label, code)])"""
+    residues = {}
+    columns = []
+    fields = None
+    first_model = None
+    last = None
+    for line in lines:
+        if line.startswith("_atom_site."):
+            columns.append(line[11:].split()[0])
+            continue
+        if not columns:
+            continue
+        if line.startswith(("#", "loop_", "_")):
+            break
+        values = line.split()
+        if len(values) != len(columns):
+            continue
+        if fields is None:
+            def column(*names):
+                return next((columns.index(name) for name in names if name in columns), None)
+            fields = (
+                column("group_PDB"), column("auth_comp_id", "label_comp_id"),
+                column("auth_asym_id", "label_asym_id"), column("auth_seq_id", "label_seq_id"),
+                column("pdbx_PDB_ins_code"), column("pdbx_PDB_model_num")
+            )
+        group, comp, chain, number, insertion, model = (
+            values[i] if i is not None else "?" for i in fields
+        )
+        if first_model is None:
+            first_model = model
+        elif model != first_model:
+            break
+        if group != "ATOM" and comp not in MODIFIED_RESIDUES:
+            continue
+        label = number if insertion in ("?", ".") else number + insertion
+        if (chain, label) != last:
+            last = (chain, label)
+            residues.setdefault(chain, []).append((label, RESIDUE_CODES.get(comp, "X")))
+    return residues
+
+
+def chain_sequences(path):
+    """
+    Per-chain sequences of a (possibly gzipped) PDB or mmCIF file
+    
+    Sequences are read from the first model's coordinates, one letter per
+    residue with its residue number as the label. PDB chains that only
+    have SEQRES records use those, labelled by 1-based position. Returns
+    a list of (chain, sequence, labels).
+    """
+    opener = gzip.open if path.lower().endswith(".gz") else open
+    with opener(path, 'rt', errors='replace') as f:
+        if structure_name_and_format(path)[1] == "cif":
+            residues, seqres = _cif_residues(f), {}
+        else:
+            residues, seqres = _pdb_residues(f)
+    
+    chains = [
+        (chain, "".join(code for _, code in items), [label for label, _ in items])
+        for chain, items in residues.items()
+    ]
+    for chain, codes in seqres.items():
+        if chain not in residues and codes:
+            chains.append((chain, "".join(codes), [str(i + 1) for i in range(len(codes))]))
+    return chains
+
+
+def _sequence_file_task(path):
+    """Process-pool task: a structure file's chain sequences, or the error reading it"""
+    try:
+        return path, chain_sequences(path), None
+    except Exception as e:
+        return path, None, str(e)
+
+
+def _motif_starts(sequence, motif, pieces, max_mismatches):
+    """
+    Offsets where motif occurs in sequence with at most max_mismatches substitutions
+    
+    By the pigeonhole principle one of the max_mismatches + 1 pieces matches
+    exactly, so only windows anchored on an exact piece hit are compared.
+    """
+    starts = {}
+    last_start = len(sequence) - len(motif)
+    for offset, length in pieces:
+        piece = motif[offset:offset + length]
+        position = sequence.find(piece)
+        while position != -1:
+            start = position - offset
+            if 0 <= start <= last_start and start not in starts:
+                window = sequence[start:start + len(motif)]
+                mismatches = sum(1 for a, b in zip(window, motif) if a != b)
+                if mismatches <= max_mismatches:
+                    starts[start] = mismatches
+            position = sequence.find(piece, position + 1)
+    return sorted(starts.items())
+
+
+class SequenceIndex:
+    """
+    Persistent k-mer inverted index over chain sequences (SQLite)
+    
+    Each indexed file keeps its mtime and size so an update only re-reads
+    files that changed. Every chain's distinct k-mers are posted as
+    (kmer, chain) rows; a search intersects the postings of a motif's
+    k-mers to find candidate chains and verifies them on the sequence.
+    """
+    
+    def __init__(self, path, k=SEQUENCE_KMER):
+        self.path = path
+        self.k = int(k)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with contextlib.closing(self.connect()) as db, db:
+            db.executescript("""
+                CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+                CREATE TABLE IF NOT EXISTS files (
+                    id INTEGER PRIMARY KEY, path TEXT UNIQUE, mtime REAL, size INTEGER);
+                CREATE TABLE IF NOT EXISTS chains (
+                    id INTEGER PRIMARY KEY, file_id INTEGER, chain TEXT, sequence TEXT, labels TEXT);
+                CREATE INDEX IF NOT EXISTS chains_file ON chains (file_id);
+                CREATE TABLE IF NOT EXISTS kmers (
+                    kmer TEXT, chain_id INTEGER, PRIMARY KEY (kmer, chain_id)) WITHOUT ROWID;
+            """)
+            row = db.execute("SELECT value FROM meta WHERE key = 'k'").fetchone()
+            if row is not None and int(row[0]) != self.k:
+                # Postings of another k-mer size are useless; start over
+                db.execute("DELETE FROM kmers")
+                db.execute("DELETE FROM chains")
+                db.execute("DELETE FROM files")
+            db.execute("INSERT OR REPLACE INTO meta VALUES ('k', ?)", (str(self.k),))
+    
+    def connect(self):
+        """Open a connection (one per call; SQLite connections stay on their thread)"""
+        db = sqlite3.connect(self.path, timeout=30.0)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute("PRAGMA cache_size=-65536")
+        return db
+    
+    def kmers(self, sequence):
+        """Distinct k-mers of a sequence"""
+        return {sequence[i:i + self.k] for i in range(len(sequence) - self.k + 1)}
+    
+    def files_under(self, directory):
+        """Indexed files below a directory: path -> (mtime, size)"""
+        prefix = os.path.join(directory, "")
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        with contextlib.closing(self.connect()) as db:
+            rows = db.execute(
+                "SELECT path, mtime, size FROM files WHERE path >= ? AND path < ?", (prefix, upper)
+            ).fetchall()
+        return {path: (mtime, size) for path, mtime, size in rows}
+    
+    def update(self, entries, removed=()):
+        """
+        Replace the chains of changed files and drop removed files
+        
+        entries are (path, mtime, size, chains) with chains as returned by
+        chain_sequences. Everything is written in one transaction.
+        """
+        with contextlib.closing(self.connect()) as db, db:
+            for path in list(removed) + [entry[0] for entry in entries]:
+                row = db.execute("SELECT id FROM files WHERE path = ?", (path,)).fetchone()
+                if row is None:
+                    continue
+                for chain_id, sequence in db.execute(
+                        "SELECT id, sequence FROM chains WHERE file_id = ?", (row[0],)).fetchall():
+                    db.executemany(
+                        "DELETE FROM kmers WHERE kmer = ? AND chain_id = ?",
+                        ((kmer, chain_id) for kmer in self.kmers(sequence))
+                    )
+                db.execute("DELETE FROM chains WHERE file_id = ?", (row[0],))
+                db.execute("DELETE FROM files WHERE id = ?", (row[0],))
+            
+            postings = []
+            for path, mtime, size, chains in entries:
+                file_id = db.execute(
+                    "INSERT INTO files (path, mtime, size) VALUES (?, ?, ?)", (path, mtime, size)
+                ).lastrowid
+                for chain, sequence, labels in chains:
+                    chain_id = db.execute(
+                        "INSERT INTO chains (file_id, chain, sequence, labels) VALUES (?, ?, ?, ?)",
+                        (file_id, chain, sequence, json.dumps(labels))
+                    ).lastrowid
+                    postings.extend((kmer, chain_id) for kmer in self.kmers(sequence))
+            # Inserting in key order keeps the B-tree writes local
+            postings.sort()
+            db.executemany("INSERT INTO kmers VALUES (?, ?)", postings)
+    
+    def stats(self):
+        """Number of indexed files and chains"""
+        with contextlib.closing(self.connect()) as db:
+            files = db.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+            chains = db.execute("SELECT COUNT(*) FROM chains").fetchone()[0]
+        return {"files": files, "chains": chains, "k": self.k}
+    
+    def search(self, motif, max_mismatches=0, limit=SEQUENCE_SEARCH_LIMIT):
+        """
+        Chains containing motif with at most max_mismatches substitutions
+        
+        The motif is split into max_mismatches + 1 pieces, one of which
+        must match exactly; chains holding every k-mer of some piece are
+        the candidates. Pieces shorter than k fall back to scanning all
+        chains. Returns (hits, total matches, chains scanned).
+        """
+        motif = motif.upper()
+        parts = max_mismatches + 1
+        size, extra = divmod(len(motif), parts)
+        pieces = []
+        offset = 0
+        for part in range(parts):
+            length = size + (1 if part < extra else 0)
+            pieces.append((offset, length))
+            offset += length
+        
+        select = ("SELECT chains.id, files.path, chains.chain, chains.sequence "
+                  "FROM chains JOIN files ON files.id = chains.file_id")
+        with contextlib.closing(self.connect()) as db:
+            if size >= self.k:
+                candidates = set()
+                for offset, length in pieces:
+                    piece = motif[offset:offset + length]
+                    # Non-overlapping k-mers (plus the last) pin the piece down
+                    kmers = sorted({piece[i:i + self.k] for i in
+                                    list(range(0, length - self.k + 1, self.k)) + [length - self.k]})
+                    query = " INTERSECT ".join(["SELECT chain_id FROM kmers WHERE kmer = ?"] * len(kmers))
+                    candidates.update(row[0] for row in db.execute(query, kmers))
+                candidates = sorted(candidates)
+                rows = []
+                for start in range(0, len(candidates), 500):
+                    chunk = candidates[start:start + 500]
+                    rows.extend(db.execute(
+                        f"{select} WHERE chains.id IN ({', '.join('?' * len(chunk))})", chunk
+                    ))
+            else:
+                rows = db.execute(select).fetchall()
+            
+            hits = []
+            total = 0
+            for chain_id, path, chain, sequence in rows:
+                matches = _motif_starts(sequence, motif, pieces, max_mismatches)
+                if not matches:
+                    continue
+                total += len(matches)
+                labels = json.loads(db.execute(
+                    "SELECT labels FROM chains WHERE id = ?", (chain_id,)).fetchone()[0])
+                for start, mismatches in matches:
+                    hits.append({
+                        "file": path,
+                        "chain": chain,
+                        "start": labels[start],
+                        "end": labels[start + len(motif) - 1],
+                        "offset": start,
+                        "match": sequence[start:start + len(motif)],
+                        "mismatches": mismatches
+                    })
+        
+        hits.sort(key=lambda hit: (hit["mismatches"], hit["file"], hit["chain"], hit["offset"]))
+        return hits[:limit], total, len(rows)
+
+
+class SpatialGrid:
+    """
+    Uniform cell grid over a point set for radius and k-nearest queries
+    
+    Points are binned into cubic cells and kept sorted by cell, so a query
+    only visits the cells overlapping its search sphere. Queries are
+    vectorized over all query points.
+    """
+    
+    def __init__(self, points, cell_size=GRID_CELL_SIZE):
+        self.points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        self.cell_size = float(cell_size)
+        
+        if len(self.points):
+            self.origin = self.points.min(axis=0)
+            cells = self._cells(self.points)
+            self.dims = cells.max(axis=0) + 1
+        else:
+            self.origin = np.zeros(3)
+            cells = np.zeros((0, 3), dtype=np.int64)
+            self.dims = np.ones(3, dtype=np.int64)
+        
+        keys = self._keys(cells)
+        self.order = np.argsort(keys, kind="stable")
+        self.cell_keys, self.cell_starts, self.cell_counts = np.unique(
+            keys[self.order], return_index=True, return_counts=True
+        )
+    
+    def _cells(self, points):
+        return np.floor((points - self.origin) / self.cell_size).astype(np.int64)
+    
+    def _keys(self, cells):
+        return (cells[:, 0] * self.dims[1] + cells[:, 1]) * self.dims[2] + cells[:, 2]
+    
+    def pairs_within(self, queries, radius):
+        """Return (query index, point index, distance) for all pairs within radius"""
+        queries = np.asarray(queries, dtype=np.float64).reshape(-1, 3)
+        empty = (np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros(0))
+        if not len(queries) or not len(self.points):
+            return empty
+        
+        reach = max(int(np.ceil(radius / self.cell_size)), 1)
+        span = np.arange(-reach, reach + 1)
+        offsets = np.stack(np.meshgrid(span, span, span, indexing="ij"), axis=-1).reshape(-1, 3)
+        
+        results = []
+        for chunk_start in range(0, len(queries), GRID_QUERY_CHUNK):
+            chunk = queries[chunk_start:chunk_start + GRID_QUERY_CHUNK]
+            query_cells = self._cells(chunk)
+            query_parts, point_parts = [], []
+            for offset in offsets:
+                cells = query_cells + offset
+                valid = np.all((cells >= 0) & (cells < self.dims), axis=1)
+                query_index = np.nonzero(valid)[0]
+                keys = self._keys(cells[valid])
+                
+                slot = np.minimum(np.searchsorted(self.cell_keys, keys), len(self.cell_keys) - 1)
+                found = self.cell_keys[slot] == keys
+                query_index, slot = query_index[found], slot[found]
+                
+                # Expand every (query, cell) hit into one candidate per point
+                counts = self.cell_counts[slot]
+                ends = np.cumsum(counts)
+                within = np.arange(ends[-1] if len(ends) else 0) - np.repeat(ends - counts, counts)
+                query_parts.append(np.repeat(query_index, counts))
+                point_parts.append(self.order[np.repeat(self.cell_starts[slot], counts) + within])
+            
+            query_index = np.concatenate(query_parts)
+            point_index = np.concatenate(point_parts)
+            distance = np.linalg.norm(chunk[query_index] - self.points[point_index], axis=1)
+            keep = distance <= radius
+            results.append((query_index[keep] + chunk_start, point_index[keep], distance[keep]))
+        
+        return tuple(np.concatenate(parts) for parts in zip(*results))
+    
+    def nearest(self, queries, k):
+        """Return (indices, distances) of the k nearest points per query, padded with -1/inf"""
+        queries = np.asarray(queries, dtype=np.float64).reshape(-1, 3)
+        indices = np.full((len(queries), k), -1, dtype=np.int64)
+        distances = np.full((len(queries), k), np.inf)
+        wanted = min(k, len(self.points))
+        if not wanted:
+            return indices, distances
+        
+        # Grow the search radius until every query has enough candidates;
+        # all points inside the radius are seen, so the nearest k are exact
+        extent = np.ptp(np.vstack([self.points, queries]), axis=0)
+        limit = float(np.linalg.norm(extent)) + self.cell_size
+        pending = np.arange(len(queries))
+        radius = self.cell_size
+        while len(pending):
+            query_index, point_index, distance = self.pairs_within(queries[pending], radius)
+            counts = np.bincount(query_index, minlength=len(pending))
+            done = (counts >= wanted) | (radius >= limit)
+            
+            keep = done[query_index]
+            query_index, point_index, distance = query_index[keep], point_index[keep], distance[keep]
+            order = np.lexsort((distance, query_index))
+            query_index, point_index, distance = query_index[order], point_index[order], distance[order]
+            rank = np.arange(len(query_index)) - np.searchsorted(query_index, query_index)
+            take = rank < k
+            rows = pending[query_index[take]]
+            indices[rows, rank[take]] = point_index[take]
+            distances[rows, rank[take]] = distance[take]
+            
+            pending = pending[~done]
+            radius *= 2
+        return indices, distances
+
+
+def _group_tiles(starts, max_points):
+    """Split consecutive groups into tiles of at most max_points points (at least one group each)"""
+    tiles = []
+    first = 0
+    n_groups = len(starts) - 1
+    while first < n_groups:
+        last = first + 1
+        while last < n_groups and starts[last + 1] - starts[first] <= max_points:
+            last += 1
+        tiles.append((first, last))
+        first = last
+    return tiles
+
+
+def iter_distance_blocks(rows, row_starts, cols, col_starts, memory_limit=CONTACT_MEMORY_LIMIT):
+    """
+    Yield (first row group, block) pieces of a group-reduced distance matrix
+    
+    Points are ordered by group and groups are given by start offsets (with
+    a final end offset). Each block holds the minimum point-point distance
+    for a band of row groups against all column groups. Row and column
+    tiles are sized so one tile of pairwise distances (and its temporaries)
+    stays within memory_limit bytes.
+    """
+    rows = np.asarray(rows, dtype=np.float64)
+    cols = np.asarray(cols, dtype=np.float64)
+    row_starts = np.asarray(row_starts, dtype=np.int64)
+    col_starts = np.asarray(col_starts, dtype=np.int64)
+    n_col_groups = len(col_starts) - 1
+    
+    # About three float64 temporaries per pairwise distance
+    budget = max(int(memory_limit) // 24, 1)
+    largest_row_group = int(np.diff(row_starts).max()) if len(row_starts) > 1 else 1
+    col_tiles = _group_tiles(col_starts, max(budget // largest_row_group, 1))
+    widest_tile = max((col_starts[last] - col_starts[first] for first, last in col_tiles), default=1)
+    # The output band itself also has to fit
+    row_tiles = _group_tiles(row_starts, max(budget // max(widest_tile + n_col_groups, 1), 1))
+    
+    col_norms = np.einsum("ij,ij->i", cols, cols)
+    for row_first, row_last in row_tiles:
+        row_points = rows[row_starts[row_first]:row_starts[row_last]]
+        row_offsets = row_starts[row_first:row_last] - row_starts[row_first]
+        row_norms = np.einsum("ij,ij->i", row_points, row_points)
+        block = np.empty((row_last - row_first, n_col_groups), dtype=np.float32)
+        
+        for col_first, col_last in col_tiles:
+            lo, hi = col_starts[col_first], col_starts[col_last]
+            squared = row_norms[:, None] + col_norms[None, lo:hi] - 2.0 * (row_points @ cols[lo:hi].T)
+            np.maximum(squared, 0.0, out=squared)
+            reduced = np.minimum.reduceat(squared, row_offsets, axis=0)
+            reduced = np.minimum.reduceat(reduced, col_starts[col_first:col_last] - lo, axis=1)
+            block[:, col_first:col_last] = np.sqrt(reduced)
+        
+        yield row_first, block
+
+
+def rmsd_block(rows, cols, fit=True):
+    """
+    RMSD between every conformer in rows and every conformer in cols
+    
+    Both arrays have shape (conformers, atoms, 3). With fit=True they must
+    already be centered, and each pair is superposed with the Kabsch
+    method: the optimal rotation comes from the singular values of the 3x3
+    covariance matrix, with the smallest one negated when the best fit
+    would be a reflection.
+    """
+    n_rows, n_atoms, _ = rows.shape
+    n_cols = cols.shape[0]
+    
+    # Covariance matrices of all pairs through a single matrix product
+    covariance = (
+        rows.transpose(0, 2, 1).reshape(n_rows * 3, n_atoms)
+        @ cols.transpose(1, 0, 2).reshape(n_atoms, n_cols * 3)
+    ).reshape(n_rows, 3, n_cols, 3).transpose(0, 2, 1, 3)
+    
+    row_norms = np.einsum("ijk,ijk->i", rows, rows)
+    col_norms = np.einsum("ijk,ijk->i", cols, cols)
+    if fit:
+        singular = np.linalg.svd(covariance, compute_uv=False)
+        singular[..., 2] *= np.sign(np.linalg.det(covariance))
+        overlap = singular.sum(axis=-1)
+    else:
+        overlap = np.trace(covariance, axis1=-2, axis2=-1)
+    
+    squared = (row_norms[:, None] + col_norms[None, :] - 2.0 * overlap) / n_atoms
+    return np.sqrt(np.maximum(squared, 0.0))
+
+
+def map_bounded(pool, function, arguments, limit):
+    """Submit function(*args) for each args to an executor, at most limit at a time; yield results as they finish"""
+    arguments = iter(arguments)
+    pending = set()
+    while True:
+        for args in itertools.islice(arguments, max(limit - len(pending), 0)):
+            pending.add(pool.submit(function, *args))
+        if not pending:
+            return
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield future.result()
+
+
+def _rmsd_shared_block(name, shape, fit, row_range, col_range):
+    """Process-pool task: one RMSD block from coordinates in shared memory"""
+    shm = _attach_shared_memory(name)
+    coords = None
+    try:
+        coords = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+        block = rmsd_block(coords[slice(*row_range)], coords[slice(*col_range)], fit)
+        return row_range, col_range, block
+    finally:
+        del coords
+        shm.close()
+
+
+def _matrix_to_quaternion(matrix):
+    """Unit quaternion (w, x, y, z) of a 3x3 rotation matrix"""
+    m = matrix
+    trace = m[0, 0] + m[1, 1] + m[2, 2]
+    if trace > 0:
+        s = 2.0 * np.sqrt(trace + 1.0)
+        q = [0.25 * s, (m[2, 1] - m[1, 2]) / s, (m[0, 2] - m[2, 0]) / s, (m[1, 0] - m[0, 1]) / s]
+    elif m[0, 0] > m[1, 1] and m[0, 0] > m[2, 2]:
+        s = 2.0 * np.sqrt(1.0 + m[0, 0] - m[1, 1] - m[2, 2])
+        q = [(m[2, 1] - m[1, 2]) / s, 0.25 * s, (m[0, 1] + m[1, 0]) / s, (m[0, 2] + m[2, 0]) / s]
+    elif m[1, 1] > m[2, 2]:
+        s = 2.0 * np.sqrt(1.0 + m[1, 1] - m[0, 0] - m[2, 2])
+        q = [(m[0, 2] - m[2, 0]) / s, (m[0, 1] + m[1, 0]) / s, 0.25 * s, (m[1, 2] + m[2, 1]) / s]
+    else:
+        s = 2.0 * np.sqrt(1.0 + m[2, 2] - m[0, 0] - m[1, 1])
+        q = [(m[1, 0] - m[0, 1]) / s, (m[0, 2] + m[2, 0]) / s, (m[1, 2] + m[2, 1]) / s, 0.25 * s]
+    q = np.array(q)
+    return q / np.linalg.norm(q)
+
+
+def _quaternion_to_matrix(q):
+    """3x3 rotation matrix of a unit quaternion (w, x, y, z)"""
+    w, x, y, z = q
+    return np.array([
+        [1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w)],
+        [2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w)],
+        [2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)]
+    ])
+
+
+def _slerp(q0, q1, t):
+    """Spherical interpolation between unit quaternions along the shorter arc"""
+    dot = float(np.dot(q0, q1))
+    if dot < 0.0:
+        q1, dot = -q1, -dot
+    if dot > 0.9995:
+        # Nearly identical: linear interpolation is exact enough and stable
+        q = q0 + t * (q1 - q0)
+        return q / np.linalg.norm(q)
+    theta = np.arccos(dot)
+    return (np.sin((1.0 - t) * theta) * q0 + np.sin(t * theta) * q1) / np.sin(theta)
+
+
+def interpolate_views(views, durations, fps, ease=True):
+    """
+    Frames of a camera path through keyframe views
+    
+    views are PyMOL 18-value views and durations[i] the seconds from view i
+    to view i+1. The rotation part (the first 9 values) is interpolated by
+    quaternion slerp, camera distance, origin and clipping planes linearly;
+    ease applies smoothstep within each segment. The first frame is the
+    first view and each segment ends exactly on its keyframe.
+    """
+    views = [np.asarray(view, dtype=np.float64) for view in views]
+    frames = [views[0].tolist()]
+    for start, end, duration in zip(views, views[1:], durations):
+        q0 = _matrix_to_quaternion(start[:9].reshape(3, 3))
+        q1 = _matrix_to_quaternion(end[:9].reshape(3, 3))
+        steps = max(int(round(duration * fps)), 1)
+        for step in range(1, steps + 1):
+            t = step / steps
+            if ease:
+                t = t * t * (3.0 - 2.0 * t)
+            rotation = _quaternion_to_matrix(_slerp(q0, q1, t))
+            rest = start[9:] + (end[9:] - start[9:]) * t
+            rest[-1] = end[-1] if step == steps else start[-1]  # Orthoscopic flag
+            frames.append(rotation.reshape(9).tolist() + rest.tolist())
+    return frames
+
+
+class _ThreadOutput:
+    """
+    Stand-in for sys.stdout that lets a thread capture only its own output
+    
+    Requests run on several lane workers at once, so swapping sys.stdout
+    for one of them would also capture everything the others print.
+    """
+    
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+    
+    def write(self, text):
+        buffer = getattr(self.local, "buffer", None)
+        return (buffer if buffer is not None else self.stream).write(text)
+    
+    def flush(self):
+        self.stream.flush()
+    
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+def split_command_steps(lines):
+    """
+    Split PyMOL command lines into steps, one per command
+    
+    Blank lines and comments are dropped; python/embed blocks stay whole as
+    one step. Raises ValueError for an unterminated block.
+    """
+    steps = []
+    block = None
+    for line in lines:
+        stripped = line.strip()
+        if block is not None:
+            block.append(line.rstrip("\n"))
+            if stripped in ("python end", "embed end"):
+                steps.append("\n".join(block))
+                block = None
+        elif stripped.startswith(("python", "embed")) and not stripped.endswith(" end"):
+            block = [line.rstrip("\n")]
+        elif stripped and not stripped.startswith("#"):
+            steps.append(stripped)
+    if block is not None:
+        raise ValueError("Unterminated python/embed block")
+    return steps
+
+
+def name_tokens(text):
+    """Words in a command or selection that may be object names"""
+    return set(re.findall(r"[\w.+-]+", text)) | set(re.findall(r"\w+", text))
+
+
+def _jsonable(value):
+    """Convert a cmd return value into JSON-serializable data"""
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(item) for item in value]
+    if isinstance(value, dict):
+        return {str(key): _jsonable(item) for key, item in value.items()}
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+
+def trace_summary(trace):
+    """Relative-time view of a recorded trace: offsets and durations in ms"""
+    start = trace["start"]
+    return {
+        "trace_id": trace["trace_id"],
+        "type": trace["type"],
+        "lane": trace.get("lane"),
+        "status": trace.get("status"),
+        "start": start,
+        "total_ms": round((trace["end"] - start) * 1000, 3),
+        "spans": [
+            {"name": name, "offset_ms": round((begin - start) * 1000, 3), "ms": round((end - begin) * 1000, 3)}
+            for name, begin, end in trace["spans"]
+        ]
+    }
+
+
+def trace_events(summaries, process):
+    """Chrome trace events (chrome://tracing, Perfetto) for trace summaries"""
+    events = []
+    for row, summary in enumerate(summaries):
+        start_us = summary["start"] * 1e6
+        args = {"trace_id": summary["trace_id"], "status": summary["status"]}
+        events.append({
+            "name": summary["type"], "ph": "X", "pid": process, "tid": row,
+            "ts": start_us, "dur": summary["total_ms"] * 1000, "args": args
+        })
+        for span in summary["spans"]:
+            events.append({
+                "name": span["name"], "ph": "X", "pid": process, "tid": row,
+                "ts": start_us + span["offset_ms"] * 1000, "dur": span["ms"] * 1000, "args": args
+            })
+    return events
+
+
+def _attach_shared_memory(name):
+    """Attach to an existing shared-memory segment without taking ownership"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 registers every attach with the resource tracker,
+        # which would unlink the segment when this process exits
+        shm = shared_memory.SharedMemory(name=name)
+        try:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, "shared_memory")
+        except Exception:
+            pass
+        return shm
 
 class ClaudePlugin:
     """
     Plugin class for PyMOL-Claude integration with MCP server functionality
     """
     
-    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, state_dir=None):
         """Initialize the plugin"""
         self.version = "0.1.0"
         self.author = "Andre Watson (@nanogenomic)"
         self.host = host
         self.port = port
+        self.state_dir = state_dir or DEFAULT_STATE_DIR
         
         # MCP server variables
         self.server_thread = None
         self.running = False
         self.server_socket = None
+        
+        # Shared-memory segments handed out to clients: name -> (shm, expires)
+        self.shm_threshold = SHM_THRESHOLD
+        self.shm_lifetime = SHM_LIFETIME
+        self.shared_segments = {}
+        self.shm_lock = threading.Lock()
+        
+        # Connections are served on their own threads; PyMOL calls are serialized
+        self.command_lock = threading.RLock()
+        self.trajectory_sessions = {}
+        
+        # One-shot requests are queued per lane for that lane's workers;
+        # requests maps request_id -> job
+        self.lanes = {
+            name: {
+                "queue": queue.Queue(maxsize=size),
+                "workers": workers,
+                "running": 0,
+                "service_time": 0.0,  # Moving average of seconds per request
+                "threads": []
+            }
+            for name, (workers, size) in LANE_LIMITS.items()
+        }
+        self.requests = {}
+        self.request_lock = threading.Lock()
+        self._job_context = threading.local()
+        # PyMOL command parsers, one per thread (they hold python-block state)
+        self._parsers = threading.local()
+        
+        # Finished request traces, oldest first
+        self.traces = deque(maxlen=TRACE_KEEP)
+        
+        # Object generations are bumped whenever an object may have changed;
+        # spatial indexes are cached per (object, state, generation, cell size)
+        self.object_generations = {}
+        self.generation_counter = itertools.count(1)
+        self.spatial_indexes = OrderedDict()
+        self.index_lock = threading.Lock()
+        
+        # edit_pdb history: path -> versions; contents stored by SHA-256
+        self.history_dir = os.path.join(self.state_dir, "history")
+        self.file_history = None
+        
+        # Sequence k-mer index, opened on first use (state_dir/sequence_index.sqlite)
+        self.sequence_index = None
+        self.sequence_lock = threading.Lock()
+        self.sequence_update_lock = threading.Lock()
+        
+        # Seek indexes of gzipped files: path -> (mtime, size, index)
+        self.gz_indexes = OrderedDict()
+        self.gz_lock = threading.Lock()
+        
+        # Background checkpoints: object -> generation last written
+        self.checkpoint_interval = CHECKPOINT_INTERVAL
+        self.checkpoint_dir = os.path.join(self.state_dir, "checkpoints")
+        self.checkpointed_generations = {}
+        self.checkpoint_lock = threading.Lock()
+        self.checkpoint_thread = None
+        
+        # Object residency: resident objects in LRU order (oldest first) and
+        # objects evicted to disk, both name -> footprint
+        self.residency_budget = RESIDENCY_BUDGET
+        self.evicted_dir = os.path.join(self.state_dir, "evicted")
+        self.residency = OrderedDict()
+        self.evicted = {}  # Persisted to evicted_dir/index.json
+        self.measured = {}  # name -> (generation, footprint) of the last measurement
+        self.residency_stats = {"evictions": 0, "reloads": 0}
+        self.residency_lock = threading.Lock()
+        
+        # Parameterized macros: name -> macro, persisted in state_dir/macros.json
+        self.macros = {}
+        self.macro_lock = threading.Lock()
+        
+        # Batch jobs: persisted under state_dir/jobs and run one at a time
+        self.jobs_dir = os.path.join(self.state_dir, "jobs")
+        self.batch_jobs = {}
+        self.batch_controls = {}  # job id -> interrupt state of the running job
+        self.batch_queue = queue.Queue()
+        self.batch_lock = threading.Lock()
+        self.batch_thread = None
+        
+        # Process pool for CPU-heavy analysis, created on first use
+        self.process_pool = None
+        self.pool_lock = threading.Lock()
+        
+        # Token buckets per client: client id -> (tokens, last refill time)
+        self.rate_limit = RATE_LIMIT
+        self.rate_burst = RATE_BURST
+        self.rate_buckets = {}
+        self.rate_pruned = time.time()
+        
+        # Request types served on a persistent connection
+        self.stream_handlers = {
+            "trajectory_open": self._serve_trajectory,
+            "subscribe": self._serve_subscription,
+            "contact_map": self._serve_contact_map
+        }
+        
+        # Change notification subscribers share one watcher thread
+        self.subscribers = {}
+        self.subscriber_lock = threading.Lock()
+        self.watcher_thread = None
     
     def __call__(self):
         """Called when the 'claude' command is executed in PyMOL"""
@@ -91,6 +1193,9 @@ class ClaudePlugin:
             else:
                 req_data = request
             
+            # Reclaim shared-memory segments whose lifetime has passed
+            self._cleanup_shared_arrays()
+            
             # Process different request types
             req_type = req_data.get("type", "execute_command")
             
@@ -122,7 +1227,16 @@ class ClaudePlugin:
                     "data": {
                         "version": self.version,
                         "pymol_version": cmd.get_version()[0],
-                        "author": self.author
+                        "author": self.author,
+                        "lanes": {
+                            name: {
+                                "queued": lane["queue"].qsize(),
+                                "running": lane["running"],
+                                "workers": lane["workers"],
+                                "service_time": round(lane["service_time"], 4)
+                            }
+                            for name, lane in self.lanes.items()
+                        }
                     }
                 }
             
@@ -138,11 +1252,36 @@ class ClaudePlugin:
                         "data": result
                     }
             
+            elif req_type == "rollback_pdb":
+                # Restore an earlier version of an edited file from local history
+                file_path = req_data.get("file", "")
+                if file_path:
+                    result = self._rollback_pdb_file(file_path, req_data.get("version"))
+                    return {
+                        "status": "success",
+                        "message": "PDB file rolled back",
+                        "data": result
+                    }
+            
+            elif req_type == "pdb_history":
+                file_path = req_data.get("file", "")
+                if file_path:
+                    result = self._pdb_history(file_path)
+                    return {
+                        "status": "success",
+                        "message": "PDB file history retrieved",
+                        "data": result
+                    }
+            
             elif req_type == "get_pdb_content":
                 # Get PDB file content
                 file_path = req_data.get("file", "")
                 if file_path:
-                    result = self._get_pdb_content(file_path)
+                    result = self._get_pdb_content(
+                        file_path,
+                        req_data.get("offset"),
+                        req_data.get("length")
+                    )
                     return {
                         "status": "success",
                         "message": "PDB content retrieved",
@@ -159,254 +1298,3313 @@ class ClaudePlugin:
                     "data": result
                 }
             
-            # Unknown request type
-            return {
-                "status": "error",
-                "message": f"Unknown request type: {req_type}",
-                "data": None
-            }
-            
-        except Exception as e:
-            # Handle any exceptions
-            return {
-                "status": "error",
-                "message": str(e),
-                "data": None
-            }
-    
-    def start_mcp_server(self):
-        """Start the MCP server in a separate thread"""
-        if self.running:
-            print(f"MCP server is already running on {self.host}:{self.port}")
-            return
-        
-        self.running = True
-        self.server_thread = threading.Thread(target=self._run_server)
-        self.server_thread.daemon = True
-        self.server_thread.start()
-        
-        print(f"MCP server started on {self.host}:{self.port}")
-        print("Claude can now connect to PyMOL")
-    
-    def stop_mcp_server(self):
-        """Stop the MCP server"""
-        if not self.running:
-            print("MCP server is not running")
-            return
-        
-        self.running = False
-        if self.server_socket:
-            try:
-                self.server_socket.close()
-            except:
-                pass
-        
-        print("MCP server stopped")
-    
-    def _run_server(self):
-        """Run the MCP server loop"""
-        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        
-        try:
-            self.server_socket.bind((self.host, self.port))
-            self.server_socket.listen(5)
-            self.server_socket.settimeout(1.0)  # 1 second timeout to check running flag
+            elif req_type == "get_coords":
+                # Get coordinates as a packed array (inline or shared memory)
+                selection = req_data.get("selection", "all")
+                result = self._get_coords(
+                    selection,
+                    req_data.get("state", 1),
+                    req_data.get("transport", "auto"),
+                    req_data.get("lifetime")
+                )
+                return {
+                    "status": "success",
+                    "message": "Coordinates retrieved",
+                    "data": result
+                }
             
-            print(f"MCP server listening on {self.host}:{self.port}")
+            elif req_type == "set_coords":
+                # Replace coordinates from a packed array descriptor
+                selection = req_data.get("selection", "")
+                coords = req_data.get("coords")
+                if selection and coords:
+                    result = self._set_coords(selection, coords, req_data.get("state", 1))
+                    return {
+                        "status": "success",
+                        "message": "Coordinates updated",
+                        "data": result
+                    }
+            
+            elif req_type == "neighbors":
+                # Radius, k-nearest and contact queries on a cached spatial index
+                if req_data.get("object"):
+                    result = self._neighbors(req_data)
+                    return {
+                        "status": "success",
+                        "message": "Neighbors computed",
+                        "data": result
+                    }
+            
+            elif req_type == "contact_map":
+                # Blockwise residue/atom distance or contact map
+                if req_data.get("selection"):
+                    result = self._contact_map(req_data)
+                    return {
+                        "status": "success",
+                        "message": "Contact map computed",
+                        "data": result
+                    }
+            
+            elif req_type == "rmsd_matrix":
+                # Pairwise RMSD over conformers (states or objects)
+                if req_data.get("object") or req_data.get("objects"):
+                    result = self._rmsd_matrix(req_data)
+                    return {
+                        "status": "success",
+                        "message": "RMSD matrix computed",
+                        "data": result
+                    }
+            
+            elif req_type == "checkpoint":
+                # Write a checkpoint of changed objects now
+                result = self._write_checkpoint()
+                return {
+                    "status": "success",
+                    "message": "Checkpoint written" if result.get("id") else "Nothing changed since the last checkpoint",
+                    "data": result
+                }
+            
+            elif req_type == "list_checkpoints":
+                result = self._list_checkpoints()
+                return {
+                    "status": "success",
+                    "message": "Checkpoints listed",
+                    "data": result
+                }
+            
+            elif req_type == "restore_checkpoint":
+                # Restore objects (and the view) from a checkpoint
+                result = self._restore_checkpoint(
+                    req_data.get("checkpoint"),
+                    req_data.get("objects"),
+                    req_data.get("view", True)
+                )
+                return {
+                    "status": "success",
+                    "message": "Checkpoint restored",
+                    "data": result
+                }
+            
+            elif req_type == "residency":
+                # Object footprints, LRU order and evictions; optionally a new budget
+                result = self._residency_report(req_data.get("budget"))
+                return {
+                    "status": "success",
+                    "message": "Residency retrieved",
+                    "data": result
+                }
+            
+            elif req_type == "index_sequences":
+                # Incrementally index chain sequences of a directory's structure files
+                result = self._index_sequences(req_data.get("directory"), req_data.get("recursive", True))
+                return {
+                    "status": "success",
+                    "message": "Sequence index updated",
+                    "data": result
+                }
+            
+            elif req_type == "search_sequence":
+                # Exact or approximate motif search over the sequence index
+                result = self._search_sequence(req_data)
+                return {
+                    "status": "success",
+                    "message": "Sequence search completed",
+                    "data": result
+                }
+            
+            elif req_type == "trace":
+                # Timed stages of recent (slow) requests
+                result = self._trace_report(req_data)
+                return {
+                    "status": "success",
+                    "message": "Traces retrieved",
+                    "data": result
+                }
+            
+            elif req_type == "call":
+                # Call a cmd function directly with structured arguments
+                function = req_data.get("function", "")
+                if function:
+                    result = self._call_cmd(function, req_data.get("args") or {})
+                    return {
+                        "status": "success",
+                        "message": f"Called cmd.{function}",
+                        "data": result
+                    }
+            
+            elif req_type == "animate_view":
+                # Interpolate between keyframe views; optionally render the frames
+                result = self._animate_view(req_data)
+                return {
+                    "status": "success",
+                    "message": "View animation finished" if "job_id" not in result else "View animation queued",
+                    "data": result
+                }
+            
+            elif req_type == "define_macro":
+                # Create or replace a named, parameterized command sequence
+                result = self._define_macro(req_data)
+                return {
+                    "status": "success",
+                    "message": "Macro defined",
+                    "data": result
+                }
+            
+            elif req_type == "run_macro":
+                name = req_data.get("name", "")
+                if name:
+                    result = self._run_macro(name, req_data.get("args"))
+                    return {
+                        "status": "success",
+                        "message": f"Macro {name} executed",
+                        "data": result
+                    }
+            
+            elif req_type == "list_macros":
+                result = self._list_macros(req_data.get("name"))
+                return {
+                    "status": "success",
+                    "message": "Macros listed",
+                    "data": result
+                }
+            
+            elif req_type == "delete_macro":
+                name = req_data.get("name", "")
+                if name:
+                    result = self._delete_macro(name)
+                    return {
+                        "status": "success",
+                        "message": "Macro deleted",
+                        "data": result
+                    }
+            
+            elif req_type == "submit_job":
+                # Queue a batch job; it runs in the background
+                result = self._submit_batch_job(req_data)
+                return {
+                    "status": "success",
+                    "message": "Job queued",
+                    "data": result
+                }
+            
+            elif req_type == "job_status":
+                job_id = req_data.get("job_id", "")
+                if job_id:
+                    result = self._get_batch_job(job_id)
+                    return {
+                        "status": "success",
+                        "message": "Job status retrieved",
+                        "data": result
+                    }
+            
+            elif req_type == "list_jobs":
+                result = self._list_batch_jobs()
+                return {
+                    "status": "success",
+                    "message": "Jobs listed",
+                    "data": result
+                }
+            
+            elif req_type == "cancel_job":
+                job_id = req_data.get("job_id", "")
+                if job_id:
+                    result = self._cancel_batch_job(job_id)
+                    return {
+                        "status": "success",
+                        "message": "Job cancelled",
+                        "data": result
+                    }
+            
+            elif req_type == "resume_job":
+                job_id = req_data.get("job_id", "")
+                if job_id:
+                    result = self._resume_batch_job(job_id)
+                    return {
+                        "status": "success",
+                        "message": "Job resumed",
+                        "data": result
+                    }
+            
+            elif req_type == "release_shared":
+                # Release a shared-memory segment once the client is done with it
+                name = req_data.get("name", "")
+                if name:
+                    released = self._release_shared_array(name)
+                    return {
+                        "status": "success",
+                        "message": "Shared segment released" if released else "Shared segment not found",
+                        "data": {"name": name, "released": released}
+                    }
+            
+            # Unknown request type
+            return {
+                "status": "error",
+                "message": f"Unknown request type: {req_type}",
+                "data": None
+            }
+            
+        except Exception as e:
+            # Handle any exceptions
+            return {
+                "status": "error",
+                "message": str(e),
+                "data": None
+            }
+    
+    def start_mcp_server(self):
+        """Start the MCP server in a separate thread"""
+        if self.running:
+            print(f"MCP server is already running on {self.host}:{self.port}")
+            return
+        
+        self.running = True
+        self.server_thread = threading.Thread(target=self._run_server)
+        self.server_thread.daemon = True
+        self.server_thread.start()
+        
+        for name, lane in self.lanes.items():
+            lane["threads"] = []
+            for _ in range(lane["workers"]):
+                worker = threading.Thread(target=self._run_lane_worker, args=(name,))
+                worker.daemon = True
+                worker.start()
+                lane["threads"].append(worker)
+        
+        self._load_macros()
+        self._load_batch_jobs()
+        self._load_evictions()
+        self.batch_thread = threading.Thread(target=self._run_batch_jobs)
+        self.batch_thread.daemon = True
+        self.batch_thread.start()
+        
+        if self.checkpoint_interval > 0:
+            self.checkpoint_thread = threading.Thread(target=self._run_checkpointer)
+            self.checkpoint_thread.daemon = True
+            self.checkpoint_thread.start()
+        
+        print(f"MCP server started on {self.host}:{self.port}")
+        print("Claude can now connect to PyMOL")
+    
+    def stop_mcp_server(self):
+        """Stop the MCP server"""
+        if not self.running:
+            print("MCP server is not running")
+            return
+        
+        self.running = False
+        if self.server_socket:
+            try:
+                self.server_socket.close()
+            except:
+                pass
+        
+        self._cleanup_shared_arrays(release_all=True)
+        
+        with self.pool_lock:
+            if self.process_pool is not None:
+                self.process_pool.shutdown(wait=False, cancel_futures=True)
+                self.process_pool = None
+        
+        print("MCP server stopped")
+    
+    def _run_server(self):
+        """Run the MCP server loop"""
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        
+        try:
+            self.server_socket.bind((self.host, self.port))
+            self.server_socket.listen(5)
+            self.server_socket.settimeout(1.0)  # 1 second timeout to check running flag
+            
+            print(f"MCP server listening on {self.host}:{self.port}")
+            
+            while self.running:
+                try:
+                    client, addr = self.server_socket.accept()
+                    # Serve each connection on its own thread so persistent
+                    # streaming sessions do not block other clients
+                    client_thread = threading.Thread(target=self._handle_client, args=(client, addr))
+                    client_thread.daemon = True
+                    client_thread.start()
+                except socket.timeout:
+                    # This is expected due to the timeout
+                    continue
+                except Exception as e:
+                    if self.running:
+                        print(f"Error accepting connection: {e}")
+        except Exception as e:
+            print(f"Server error: {e}")
+        finally:
+            if self.server_socket:
+                self.server_socket.close()
+    
+    def _handle_client(self, client_socket, addr=None):
+        """Handle a client connection"""
+        try:
+            # Receive data
+            received = time.time()
+            data, pending = self._read_message(client_socket)
+            if data is None:
+                return
+            
+            # Process the request
+            try:
+                # Parse JSON request
+                request_str = data.decode('utf-8').strip()
+                
+                try:
+                    req_data = json.loads(request_str)
+                except json.JSONDecodeError:
+                    # Plain text is treated as a direct command
+                    req_data = request_str
+                
+                # Streaming sessions keep the connection open for more messages
+                if self._is_stream_request(req_data):
+                    self.stream_handlers[req_data["type"]](client_socket, req_data, pending)
+                    return
+                
+                # Cancellation must not wait behind the request it cancels
+                trace = None
+                if isinstance(req_data, dict) and req_data.get("type") == "cancel":
+                    response = self._cancel_request(str(req_data.get("request_id", "")))
+                else:
+                    trace = self._start_trace(req_data, received)
+                    if trace is not None:
+                        trace["spans"].append(("read", received, time.time()))
+                    response = self._submit_request(req_data, addr[0] if addr else None, trace)
+                
+                # Send response
+                with self._span("serialize", trace):
+                    response_json = json.dumps(response).encode('utf-8')
+                with self._span("send", trace):
+                    client_socket.sendall(response_json)
+                if trace is not None:
+                    self._finish_trace(trace, response)
+                
+            except json.JSONDecodeError:
+                # Handle invalid JSON
+                error_response = {
+                    "status": "error",
+                    "message": "Invalid JSON request",
+                    "data": None
+                }
+                client_socket.sendall(json.dumps(error_response).encode('utf-8'))
+                
+        except Exception as e:
+            print(f"Error handling client connection: {e}")
+        finally:
+            client_socket.close()
+    
+    def _is_stream_request(self, req_data):
+        """Whether a request is served as a session on its own connection"""
+        if not isinstance(req_data, dict) or req_data.get("type") not in self.stream_handlers:
+            return False
+        # Contact maps are only streamed on request
+        return req_data["type"] != "contact_map" or bool(req_data.get("stream"))
+    
+    def _submit_request(self, req_data, peer=None, trace=None):
+        """
+        Queue a request on its lane and wait for its response
+        
+        Requests may carry a `request_id` (used by cancel) and a `timeout` in
+        seconds or an absolute `deadline` (epoch seconds). Once the deadline
+        passes the caller gets a "timeout" status, whether the request is
+        still queued (it is then dropped) or already running. Requests over
+        the client's rate limit or beyond a full lane queue are refused with
+        a "retry_after" hint instead of being queued. `trace` collects the
+        request's timed stages.
+        """
+        options = req_data if isinstance(req_data, dict) else {}
+        request_id = str(options.get("request_id") or os.urandom(8).hex())
+        lane_name = self._classify_request(req_data)
+        lane = self.lanes[lane_name]
+        
+        if lane_name != "control":
+            retry_after = self._take_rate_token(str(options.get("client") or peer or "anonymous"))
+            if retry_after:
+                return {
+                    "status": "rate_limited",
+                    "message": "Too many requests from this client",
+                    "data": {"request_id": request_id, "retry_after": retry_after}
+                }
+        
+        deadline = options.get("deadline")
+        if options.get("timeout") is not None:
+            deadline = time.time() + float(options["timeout"])
+        
+        job = {
+            "id": request_id,
+            "request": req_data,
+            "type": options.get("type", "execute_command"),
+            "lane": lane_name,
+            "deadline": float(deadline) if deadline is not None else None,
+            "state": "queued",
+            "submitted": time.time(),
+            "response": None,
+            "done": threading.Event(),
+            "trace": trace
+        }
+        if trace is not None:
+            trace["lane"] = lane_name
+        with self.request_lock:
+            if request_id in self.requests:
+                return {
+                    "status": "error",
+                    "message": f"Duplicate request id: {request_id}",
+                    "data": None
+                }
+            self.requests[request_id] = job
+        
+        try:
+            lane["queue"].put_nowait(job)
+        except queue.Full:
+            with self.request_lock:
+                self.requests.pop(request_id, None)
+            # Estimate when a slot frees up from the lane's recent service time
+            backlog = lane["queue"].qsize() + lane["running"]
+            retry_after = max(backlog * lane["service_time"] / lane["workers"], 0.1)
+            return {
+                "status": "busy",
+                "message": f"The {lane_name} queue is full",
+                "data": {"request_id": request_id, "lane": lane_name, "retry_after": round(retry_after, 3)}
+            }
+        
+        remaining = None if job["deadline"] is None else max(job["deadline"] - time.time(), 0)
+        job["done"].wait(remaining)
+        
+        with self.request_lock:
+            if job["response"] is None:
+                job["response"] = self._timeout_response(job)
+                # A queued request is skipped; a running one finishes unobserved
+                job["state"] = "expired" if job["state"] == "queued" else "abandoned"
+            self.requests.pop(request_id, None)
+        return job["response"]
+    
+    def _timeout_response(self, job):
+        """Build the response for a request whose deadline has passed"""
+        return {
+            "status": "timeout",
+            "message": f"Deadline exceeded while {job['state']}",
+            "data": {
+                "request_id": job["id"],
+                "state": job["state"],
+                "elapsed": round(time.time() - job["submitted"], 3)
+            }
+        }
+    
+    def _classify_request(self, req_data):
+        """Pick the lane a request is served on"""
+        if not isinstance(req_data, dict):
+            req_type, command = "execute_command", req_data
+        else:
+            req_type = req_data.get("type", "execute_command")
+            command = req_data.get("command", "") or req_data.get("text", "")
+        
+        if req_type in CONTROL_TYPES:
+            return "control"
+        if req_type in BULK_TYPES:
+            return "bulk"
+        if req_type in ("execute_command", "direct_input"):
+            for line in str(command).splitlines():
+                keyword = line.strip().split(" ", 1)[0].split(",", 1)[0].lower()
+                if keyword in RENDER_COMMANDS:
+                    return "render"
+        if req_type == "animate_view" and req_data.get("render") not in (None, False) and not req_data.get("background"):
+            return "render"
+        if req_type == "call" and req_data.get("function") in RENDER_COMMANDS:
+            return "render"
+        if req_type == "run_macro":
+            with self.macro_lock:
+                macro = self.macros.get(req_data.get("name"))
+            if macro and macro["render"]:
+                return "render"
+        return "interactive"
+    
+    def _take_rate_token(self, client_id):
+        """
+        Take a token from a client's bucket; returns seconds to wait if empty
+        
+        A bucket left alone for a full refill is as good as a new one, so
+        such buckets are dropped (at most once per refill window) to keep
+        one-off client ids from accumulating.
+        """
+        now = time.time()
+        refill = self.rate_burst / self.rate_limit
+        with self.request_lock:
+            if now - self.rate_pruned >= refill:
+                self.rate_buckets = {
+                    client: bucket for client, bucket in self.rate_buckets.items()
+                    if now - bucket[1] < refill
+                }
+                self.rate_pruned = now
+            tokens, last = self.rate_buckets.get(client_id, (self.rate_burst, now))
+            tokens = min(self.rate_burst, tokens + (now - last) * self.rate_limit)
+            if tokens < 1.0:
+                self.rate_buckets[client_id] = (tokens, now)
+                return round((1.0 - tokens) / self.rate_limit, 3)
+            self.rate_buckets[client_id] = (tokens - 1.0, now)
+            return 0.0
+    
+    def _run_lane_worker(self, lane_name):
+        """Execute queued requests from one lane"""
+        lane = self.lanes[lane_name]
+        while self.running:
+            try:
+                job = lane["queue"].get(timeout=1.0)
+            except queue.Empty:
+                continue
+            
+            with self.request_lock:
+                if job["state"] != "queued":
+                    # Cancelled or expired; the client already has its answer
+                    continue
+                if job["deadline"] is not None and time.time() >= job["deadline"]:
+                    job["response"] = self._timeout_response(job)
+                    job["state"] = "expired"
+                    job["done"].set()
+                    continue
+                job["state"] = "running"
+                lane["running"] += 1
+            
+            started = time.time()
+            lock_free = job["type"] in LOCK_FREE_TYPES
+            lock = contextlib.nullcontext() if lock_free else self.command_lock
+            track = job["type"] not in CONTROL_TYPES
+            trace = job["trace"]
+            if trace is not None:
+                trace["spans"].append(("queue", job["submitted"], started))
+            self._job_context.job = job
+            try:
+                with lock:
+                    if trace is not None and not lock_free:
+                        trace["spans"].append(("lock", started, time.time()))
+                    with self._span("page_in"):
+                        referenced = self._page_in(job["request"]) if track else set()
+                    with self._span("execute"):
+                        response = self.handle_mcp_request(job["request"])
+                if track:
+                    with self._span("residency"):
+                        self._enforce_residency(referenced)
+            except Exception as e:
+                response = {
+                    "status": "error",
+                    "message": str(e),
+                    "data": None
+                }
+            finally:
+                self._job_context.job = None
+            
+            with self.request_lock:
+                lane["running"] -= 1
+                lane["service_time"] = 0.8 * lane["service_time"] + 0.2 * (time.time() - started)
+                if job["state"] == "running":
+                    if job["deadline"] is not None and time.time() >= job["deadline"]:
+                        # Interrupted or finished past its deadline: report a timeout
+                        # whatever the handler returned, as the caller does
+                        response = self._timeout_response(job)
+                    job["state"] = "done"
+                    job["response"] = response
+                job["done"].set()
+    
+    def _cancel_request(self, request_id):
+        """Cancel a queued or running request by id"""
+        with self.request_lock:
+            job = self.requests.get(request_id)
+            previous = job["state"] if job else None
+            if previous in ("queued", "running"):
+                job["state"] = "cancelled"
+                job["response"] = {
+                    "status": "cancelled",
+                    "message": "Request cancelled",
+                    "data": {"request_id": request_id, "state": previous}
+                }
+                job["done"].set()
+        
+        if previous not in ("queued", "running"):
+            return {
+                "status": "error",
+                "message": f"No pending request with id: {request_id}",
+                "data": None
+            }
+        
+        return {
+            "status": "success",
+            "message": "Request cancelled" if previous == "queued"
+                       else "Request cancelled; its current PyMOL command will still finish",
+            "data": {"request_id": request_id, "state": previous}
+        }
+    
+    def _check_interrupted(self):
+        """Raise RequestInterrupted if the current request should stop"""
+        job = getattr(self._job_context, "job", None)
+        if job is None:
+            return
+        if job["state"] == "cancelled":
+            raise RequestInterrupted("Request cancelled")
+        if job["deadline"] is not None and time.time() >= job["deadline"]:
+            raise RequestInterrupted("Deadline exceeded")
+    
+    def _read_message(self, client_socket, pending=b""):
+        """
+        Read one message terminated by a blank line
+        
+        Returns the message and any bytes already received past it, or
+        (None, b"") once the connection closes without further data.
+        """
+        buffer = bytearray(pending)
+        start = 0
+        while True:
+            index = buffer.find(MESSAGE_TERMINATOR, start)
+            if index >= 0:
+                return bytes(buffer[:index]), bytes(buffer[index + len(MESSAGE_TERMINATOR):])
+            
+            # Only rescan the tail in case the terminator spans two chunks
+            start = max(len(buffer) - len(MESSAGE_TERMINATOR) + 1, 0)
+            chunk = client_socket.recv(BUFFER_SIZE)
+            if not chunk:
+                # A final unterminated message still counts
+                return (bytes(buffer) if buffer.strip() else None), b""
+            buffer += chunk
+    
+    def _send_message(self, client_socket, message):
+        """Send one message on a persistent connection"""
+        client_socket.sendall(json.dumps(message).encode('utf-8') + MESSAGE_TERMINATOR)
+    
+    def _serve_trajectory(self, client_socket, req_data, pending=b""):
+        """
+        Serve a trajectory streaming session on a persistent connection
+        
+        Frames are decoded on this connection thread and handed to an applier
+        thread through a bounded queue, which appends them as new states of
+        the object. Every frame is acknowledged once it has been appended or
+        skipped, so clients keep at most `window` frames in flight and block
+        when PyMOL falls behind.
+        """
+        object_name = req_data.get("object", "")
+        with self.command_lock:
+            if object_name not in cmd.get_names('objects'):
+                self._send_message(client_socket, {
+                    "status": "error",
+                    "message": f"Object not found: {object_name}",
+                    "data": None
+                })
+                return
+            n_atoms = cmd.count_atoms(object_name)
+            states = cmd.count_states(object_name)
+        
+        session = {
+            "id": os.urandom(8).hex(),
+            "object": object_name,
+            "n_atoms": n_atoms,
+            "stride": max(int(req_data.get("stride", 1)), 1),
+            "decimate": bool(req_data.get("decimate", False)),
+            "max_states": max(int(req_data.get("max_states", 0)), 0),
+            "window": max(int(req_data.get("window", TRAJECTORY_WINDOW)), 1),
+            "follow": bool(req_data.get("follow", True)),
+            "states": states,
+            "received": 0,
+            "applied": 0,
+            "skipped": 0,
+            "evicted": 0,
+            "error": None
+        }
+        self.trajectory_sessions[session["id"]] = session
+        
+        frames = queue.Queue(maxsize=session["window"])
+        applier = threading.Thread(
+            target=self._apply_trajectory_frames,
+            args=(client_socket, session, frames)
+        )
+        applier.daemon = True
+        
+        try:
+            self._send_message(client_socket, {
+                "status": "success",
+                "message": "Trajectory session opened",
+                "data": {key: session[key] for key in ("id", "object", "n_atoms", "states", "window")}
+            })
+            applier.start()
+            
+            while applier.is_alive():
+                data, pending = self._read_message(client_socket, pending)
+                if data is None:
+                    break
+                
+                message = json.loads(data.decode('utf-8'))
+                if message.get("type") == "trajectory_close":
+                    break
+                if message.get("type") != "trajectory_frame":
+                    continue
+                
+                session["received"] += 1
+                seq = message.get("seq", session["received"])
+                
+                # Striding drops frames before decoding them
+                coords = None
+                if (session["received"] - 1) % session["stride"] == 0:
+                    with self._import_array(message.get("coords", {})) as frame:
+                        if frame.size != n_atoms * 3:
+                            raise ValueError(
+                                f"Frame {seq} has {frame.size // 3} atoms, expected {n_atoms}"
+                            )
+                        # Copy out so the client may reuse its buffer after the ack
+                        coords = np.array(frame, dtype=np.float32).reshape(n_atoms, 3)
+                
+                # With decimation a full queue drops the frame instead of blocking
+                if coords is not None and session["decimate"] and frames.full():
+                    coords = None
+                
+                self._put_trajectory_frame(frames, applier, (seq, coords))
+        
+        except Exception as e:
+            session["error"] = str(e)
+        finally:
+            if applier.is_alive():
+                self._put_trajectory_frame(frames, applier, None)
+                applier.join()
+            self.trajectory_sessions.pop(session["id"], None)
+        
+        try:
+            self._send_message(client_socket, {
+                "status": "error" if session["error"] else "success",
+                "message": session["error"] or "Trajectory session closed",
+                "data": {key: value for key, value in session.items() if key != "error"}
+            })
+        except OSError:
+            pass
+    
+    def _serve_subscription(self, client_socket, req_data, pending=b""):
+        """
+        Push coalesced change events to a client on a persistent connection
+        
+        All subscribers share one watcher thread that takes a cheap snapshot
+        of only the subscribed categories per tick, so clients no longer need
+        to poll get_state. Events are batched per subscriber and sent at most
+        once per `interval` seconds.
+        """
+        events = req_data.get("events") or list(EVENT_TYPES)
+        unknown = [event for event in events if event not in EVENT_TYPES]
+        if unknown:
+            self._send_message(client_socket, {
+                "status": "error",
+                "message": f"Unknown event types: {', '.join(unknown)}",
+                "data": {"available": list(EVENT_TYPES)}
+            })
+            return
+        
+        subscriber = {
+            "id": os.urandom(8).hex(),
+            "socket": client_socket,
+            "events": set(events),
+            "interval": max(float(req_data.get("interval", EVENT_INTERVAL)), MIN_EVENT_INTERVAL),
+            "pending": {},
+            "last_sent": 0.0,
+            "send_lock": threading.Lock()
+        }
+        
+        with subscriber["send_lock"]:
+            self._send_message(client_socket, {
+                "status": "success",
+                "message": "Subscribed to PyMOL events",
+                "data": {
+                    "id": subscriber["id"],
+                    "events": sorted(subscriber["events"]),
+                    "interval": subscriber["interval"]
+                }
+            })
+        
+        with self.subscriber_lock:
+            self.subscribers[subscriber["id"]] = subscriber
+            if self.watcher_thread is None or not self.watcher_thread.is_alive():
+                self.watcher_thread = threading.Thread(target=self._watch_changes)
+                self.watcher_thread.daemon = True
+                self.watcher_thread.start()
+        
+        try:
+            # The connection stays open until the client unsubscribes or leaves
+            while True:
+                data, pending = self._read_message(client_socket, pending)
+                if data is None:
+                    break
+                if json.loads(data.decode('utf-8')).get("type") == "unsubscribe":
+                    break
+        except (OSError, ValueError):
+            pass
+        finally:
+            with self.subscriber_lock:
+                self.subscribers.pop(subscriber["id"], None)
+    
+    def _snapshot_changes(self, categories):
+        """Take a minimal snapshot of the PyMOL state needed for the given events"""
+        snapshot = {}
+        with self.command_lock:
+            if categories & {"object_loaded", "object_deleted", "state_count_changed"}:
+                snapshot["objects"] = set(cmd.get_names('objects'))
+            if categories & {"selection_created", "selection_deleted"}:
+                snapshot["selections"] = set(cmd.get_names('selections'))
+            if "view_changed" in categories:
+                # Rounded so floating-point noise does not count as a change
+                snapshot["view"] = tuple(round(value, 3) for value in cmd.get_view())
+            if "state_count_changed" in categories:
+                snapshot["states"] = {
+                    name: cmd.count_states(name) for name in snapshot["objects"]
+                }
+        return snapshot
+    
+    def _diff_snapshots(self, old, new):
+        """List the events that turn one snapshot into the next"""
+        events = []
+        if "objects" in old and "objects" in new:
+            events += [{"event": "object_loaded", "name": name} for name in sorted(new["objects"] - old["objects"])]
+            events += [{"event": "object_deleted", "name": name} for name in sorted(old["objects"] - new["objects"])]
+        if "selections" in old and "selections" in new:
+            events += [{"event": "selection_created", "name": name} for name in sorted(new["selections"] - old["selections"])]
+            events += [{"event": "selection_deleted", "name": name} for name in sorted(old["selections"] - new["selections"])]
+        if "view" in old and "view" in new and old["view"] != new["view"]:
+            events.append({"event": "view_changed", "name": None, "view": list(new["view"])})
+        if "states" in old and "states" in new:
+            for name, count in new["states"].items():
+                if name in old["states"] and old["states"][name] != count:
+                    events.append({
+                        "event": "state_count_changed",
+                        "name": name,
+                        "states": count,
+                        "previous": old["states"][name]
+                    })
+        return events
+    
+    def _queue_event(self, subscriber, event):
+        """Add an event to a subscriber's pending batch, coalescing by name"""
+        pending = subscriber["pending"]
+        name = event["name"]
+        
+        # Something created and removed again within one batch never happened
+        created = {"object_deleted": "object_loaded", "selection_deleted": "selection_created"}.get(event["event"])
+        if created and (created, name) in pending:
+            del pending[(created, name)]
+            pending.pop(("state_count_changed", name), None)
+            return
+        
+        key = (event["event"], name)
+        if key in pending and event["event"] == "state_count_changed":
+            event = dict(event, previous=pending[key]["previous"])
+        # Re-insert so the batch keeps the order of the latest occurrence
+        pending.pop(key, None)
+        pending[key] = event
+    
+    def _watch_changes(self):
+        """Detect changes for all subscribers and push debounced batches"""
+        snapshot = None
+        while self.running:
+            with self.subscriber_lock:
+                subscribers = list(self.subscribers.values())
+                if not subscribers:
+                    self.watcher_thread = None
+                    return
+            
+            tick = min(subscriber["interval"] for subscriber in subscribers)
+            wanted = set().union(*(subscriber["events"] for subscriber in subscribers))
+            try:
+                current = self._snapshot_changes(wanted)
+            except Exception as e:
+                print(f"Error watching PyMOL state: {e}")
+                time.sleep(tick)
+                continue
+            
+            # Categories without a baseline yet simply report nothing this tick
+            events = self._diff_snapshots(snapshot, current) if snapshot else []
+            snapshot = current
+            
+            now = time.time()
+            for subscriber in subscribers:
+                for event in events:
+                    if event["event"] in subscriber["events"]:
+                        self._queue_event(subscriber, event)
+                
+                if subscriber["pending"] and now - subscriber["last_sent"] >= subscriber["interval"]:
+                    batch = list(subscriber["pending"].values())
+                    subscriber["pending"] = {}
+                    subscriber["last_sent"] = now
+                    try:
+                        with subscriber["send_lock"]:
+                            self._send_message(subscriber["socket"], {
+                                "type": "events",
+                                "time": now,
+                                "events": batch
+                            })
+                    except OSError:
+                        with self.subscriber_lock:
+                            self.subscribers.pop(subscriber["id"], None)
+            
+            time.sleep(tick)
+    
+    def _put_trajectory_frame(self, frames, applier, item):
+        """Queue a frame for the applier, giving up if the applier has stopped"""
+        while applier.is_alive():
+            try:
+                frames.put(item, timeout=1.0)
+                return
+            except queue.Full:
+                continue
+    
+    def _apply_trajectory_frames(self, client_socket, session, frames):
+        """Append queued frames as new object states and acknowledge each one"""
+        object_name = session["object"]
+        while True:
+            item = frames.get()
+            if item is None:
+                return
+            
+            seq, coords = item
+            ack = {"type": "trajectory_ack", "seq": seq}
+            if coords is None:
+                session["skipped"] += 1
+                ack["skipped"] = True
+            else:
+                try:
+                    with self.command_lock:
+                        cmd.load_coordset(coords, object_name, state=0)
+                        self._bump_generations([object_name])
+                        states = cmd.count_states(object_name)
+                        
+                        # Evict the oldest states once the cap is exceeded
+                        excess = states - session["max_states"] if session["max_states"] else 0
+                        if excess > 0:
+                            cmd.delete_states(object_name, f"1-{excess}")
+                            states -= excess
+                            session["evicted"] += excess
+                        
+                        if session["follow"]:
+                            cmd.set("state", states)
+                    
+                    session["states"] = states
+                    session["applied"] += 1
+                except Exception as e:
+                    session["error"] = f"Error appending frame {seq}: {str(e)}"
+                    ack["error"] = session["error"]
+            
+            ack["states"] = session["states"]
+            try:
+                self._send_message(client_socket, ack)
+            except OSError:
+                session["error"] = session["error"] or "Client disconnected"
+            
+            if session["error"]:
+                return
+    
+    def _execute_pymol_command(self, command_str, lines=None):
+        """
+        Execute PyMOL commands and return their output
+        
+        `lines` runs already split steps (see split_command_steps) instead
+        of splitting command_str. "result" is True when every line ran.
+        """
+        ok, output = self._run_command_lines(command_str.splitlines() if lines is None else lines)
+        return {
+            "result": ok,
+            "output": output
+        }
+    
+    def _run_command_lines(self, lines):
+        """
+        Run PyMOL command lines on this thread and return (ok, output)
+        
+        Each line goes through PyMOL's parser, which executes it before
+        returning (cmd.do would only queue it), so deadlines and
+        cancellation are checked between finished lines and the render
+        lane stays busy while a ray trace runs. Python blocks are fed line
+        by line. Stops at the first line the parser reports as failed.
+        """
+        # Capture PyMOL output printed on this thread
+        if not isinstance(sys.stdout, _ThreadOutput):
+            sys.stdout = _ThreadOutput(sys.stdout)
+        capture = sys.stdout
+        capture.local.buffer = output = StringIO()
+        lines = [line for text in lines for line in text.splitlines()]
+        try:
+            command_parser = getattr(self._parsers, "parser", None)
+            if command_parser is None:
+                command_parser = self._parsers.parser = parser.Parser(cmd)
+            for line in lines:
+                self._check_interrupted()
+                printed = len(output.getvalue())
+                with self._span("parse"):
+                    ok = command_parser.parse(line) == 1
+                if not ok:
+                    if len(output.getvalue()) == printed:
+                        output.write(f"Error: command failed: {line.strip()}\n")
+                    return False, output.getvalue()
+            return True, output.getvalue()
+        except Exception as e:
+            # Do not leave the parser inside a half-read python block
+            self._parsers.parser = None
+            return False, f"{output.getvalue()}Error: {str(e)}"
+        finally:
+            self._note_command_changes(lines)
+            # Stop capturing
+            capture.local.buffer = None
+    
+    def _call_cmd(self, function, args):
+        """
+        Call a CMD_API function with keyword arguments and return its result
+        
+        Skips PyMOL's command parser; the return value comes back as JSON
+        (tuples and arrays as lists) instead of printed text.
+        """
+        try:
+            if function not in CMD_API:
+                return {"error": f"Function not available: {function}"}
+            accepted, changes_objects = CMD_API[function]
+            unknown = [key for key in args if key not in accepted]
+            if unknown:
+                return {"error": f"Unknown arguments for {function}: {', '.join(unknown)}"}
+            
+            self._check_interrupted()
+            try:
+                with self._span(f"cmd.{function}"):
+                    value = getattr(cmd, function)(**args)
+            finally:
+                if changes_objects:
+                    self._bump_generations(self._named_objects(
+                        [str(argument) for argument in args.values()]
+                    ))
+            
+            return {
+                "function": function,
+                "result": _jsonable(value)
+            }
+        except Exception as e:
+            return {
+                "error": f"Error calling {function}: {str(e)}"
+            }
+    
+    def _get_pymol_state(self):
+        """Get current PyMOL state information"""
+        try:
+            state_info = {
+                "loaded_objects": cmd.get_names('objects'),
+                "evicted_objects": sorted(self.evicted),
+                "current_view": cmd.get_view(),
+                "selections": cmd.get_names('selections')
+            }
+            return state_info
+        except Exception as e:
+            return {
+                "error": f"Error getting PyMOL state: {str(e)}"
+            }
+    
+    def _edit_pdb_file(self, pdb_file, pdb_content):
+        """
+        Edit a PDB file with the provided content
+        
+        Content identical to the file's (by SHA-256) is neither rewritten nor
+        reloaded. Otherwise the file is replaced atomically, and the old and
+        new versions are kept in the content-addressed history for
+        rollback_pdb.
+        """
+        try:
+            # Determine file path
+            if os.path.isabs(pdb_file):
+                # Absolute path provided
+                file_path = pdb_file
+            else:
+                # Use current working directory
+                cwd = os.getcwd()
+                file_path = os.path.join(cwd, pdb_file)
+            
+            data = pdb_content.encode('utf-8')
+            digest = hashlib.sha256(data).hexdigest()
+            if self._current_file_hash(file_path) == digest:
+                return {
+                    "path": file_path,
+                    "message": "Content unchanged; file not rewritten or reloaded",
+                    "hash": digest,
+                    "unchanged": True
+                }
+            
+            self._replace_structure_file(file_path, data, digest)
+            return {
+                "path": file_path,
+                "message": self._reload_structure_file(file_path),
+                "hash": digest
+            }
+        except Exception as e:
+            return {
+                "error": f"Error editing PDB file: {str(e)}"
+            }
+    
+    def _reload_structure_file(self, file_path):
+        """Reload a structure file's object if it is loaded; returns a message"""
+        file_name, file_format = structure_name_and_format(file_path)
+        if file_name in cmd.get_names('objects'):
+            cmd.load(file_path, file_name, format=file_format, state=1)
+            self._bump_generations([file_name])
+            return f"Reloaded PDB file '{file_name}'"
+        return "File edited but not reloaded (not currently loaded in PyMOL)"
+    
+    def _read_structure_bytes(self, file_path):
+        """Read a structure file's uncompressed bytes"""
+        with (gzip.open if file_path.lower().endswith(".gz") else open)(file_path, 'rb') as f:
+            return f.read()
+    
+    def _load_file_history(self):
+        """Return the edit history index, reading it on first use"""
+        if self.file_history is None:
+            try:
+                with open(os.path.join(self.history_dir, "index.json")) as f:
+                    self.file_history = json.load(f)
+            except (OSError, ValueError):
+                self.file_history = {}
+        return self.file_history
+    
+    def _current_file_hash(self, file_path):
+        """
+        Return the SHA-256 of a file's uncompressed content (None if missing)
+        
+        Files last written by edit_pdb and unchanged since (same mtime and
+        size) are not read again.
+        """
+        if not os.path.exists(file_path):
+            return None
+        entry = self._load_file_history().get(file_path)
+        stat = os.stat(file_path)
+        if entry and (entry["mtime"], entry["size"]) == (stat.st_mtime, stat.st_size):
+            return entry["versions"][entry.get("position", -1)]["hash"]
+        return hashlib.sha256(self._read_structure_bytes(file_path)).hexdigest()
+    
+    def _record_file_version(self, file_path, data, digest, when=None):
+        """
+        Store a version's content (once per hash) and append it to the path's history
+        
+        The path's position (the version the file holds) moves to the end.
+        """
+        blob_dir = os.path.join(self.history_dir, "blobs")
+        blob_path = os.path.join(blob_dir, f"{digest}.z")
+        if not os.path.exists(blob_path):
+            os.makedirs(blob_dir, exist_ok=True)
+            self._write_file_atomic(blob_path, zlib.compress(data, 6))
+        
+        entry = self._load_file_history().setdefault(
+            file_path, {"versions": [], "mtime": None, "size": None}
+        )
+        if not entry["versions"] or entry["versions"][-1]["hash"] != digest:
+            entry["versions"].append({
+                "hash": digest,
+                "time": when or time.time(),
+                "bytes": len(data)
+            })
+            entry["versions"] = entry["versions"][-FILE_HISTORY_KEEP:]
+        entry["position"] = len(entry["versions"]) - 1
+    
+    def _replace_structure_file(self, file_path, data, digest, position=None):
+        """
+        Atomically replace a structure file and record the change
+        
+        The content on disk before the change is recorded first unless
+        the history already has it, so the first edit can be rolled back.
+        With `position` the file is restored to that recorded version: the
+        history is not extended, only the path's position moves there.
+        """
+        history = self._load_file_history()
+        if os.path.exists(file_path):
+            stat = os.stat(file_path)
+            entry = history.get(file_path)
+            if not entry or (entry["mtime"], entry["size"]) != (stat.st_mtime, stat.st_size):
+                previous = self._read_structure_bytes(file_path)
+                self._record_file_version(
+                    file_path, previous, hashlib.sha256(previous).hexdigest(), stat.st_mtime
+                )
+        
+        payload = gzip.compress(data) if file_path.lower().endswith(".gz") else data
+        self._write_file_atomic(file_path, payload)
+        if position is None:
+            self._record_file_version(file_path, data, digest)
+        else:
+            history[file_path]["position"] = position
+        
+        stat = os.stat(file_path)
+        history[file_path].update(mtime=stat.st_mtime, size=stat.st_size)
+        self._write_file_atomic(
+            os.path.join(self.history_dir, "index.json"),
+            json.dumps(history).encode('utf-8')
+        )
+        
+        # Drop blobs that fell out of every path's history
+        referenced = {
+            f"{version['hash']}.z"
+            for entry in history.values() for version in entry["versions"]
+        }
+        blob_dir = os.path.join(self.history_dir, "blobs")
+        for blob in os.listdir(blob_dir):
+            if blob not in referenced:
+                try:
+                    os.remove(os.path.join(blob_dir, blob))
+                except OSError:
+                    pass
+    
+    def _pdb_history(self, pdb_file):
+        """List the recorded versions of a file, oldest first"""
+        try:
+            file_path = pdb_file if os.path.isabs(pdb_file) else os.path.join(os.getcwd(), pdb_file)
+            entry = self._load_file_history().get(file_path)
+            if not entry:
+                return {"error": f"No history for {file_path}"}
+            current = self._current_file_hash(file_path)
+            return {
+                "path": file_path,
+                "versions": [
+                    dict(version, current=version["hash"] == current)
+                    for version in entry["versions"]
+                ]
+            }
+        except Exception as e:
+            return {
+                "error": f"Error reading file history: {str(e)}"
+            }
+    
+    def _rollback_pdb_file(self, pdb_file, version=None):
+        """
+        Restore a file to an earlier version from the local history
+        
+        `version` is a hash (or unique prefix); by default the version
+        recorded before the one the file holds, so repeated rollbacks walk
+        back through the history. The content comes from the local store,
+        so nothing is re-sent.
+        """
+        try:
+            file_path = pdb_file if os.path.isabs(pdb_file) else os.path.join(os.getcwd(), pdb_file)
+            entry = self._load_file_history().get(file_path)
+            if not entry:
+                return {"error": f"No history for {file_path}"}
+            
+            current = self._current_file_hash(file_path)
+            hashes = [item["hash"] for item in entry["versions"]]
+            position = entry.get("position", len(hashes) - 1)
+            if hashes[position] != current:
+                # Changed outside edit_pdb: fall back to the latest occurrence of its content
+                position = len(hashes) - 1 - hashes[::-1].index(current) if current in hashes else len(hashes)
+            
+            if version:
+                matches = sorted({digest for digest in hashes if digest.startswith(version)})
+                if len(matches) != 1:
+                    return {"error": f"Version {version} matches {len(matches)} versions"}
+                digest = matches[0]
+                target = len(hashes) - 1 - hashes[::-1].index(digest)
+            else:
+                if position == 0:
+                    return {"error": f"No version before the current one for {file_path}"}
+                target = position - 1
+                digest = hashes[target]
+            
+            if digest == current:
+                return {
+                    "path": file_path,
+                    "message": "Already at that version",
+                    "hash": digest,
+                    "unchanged": True
+                }
+            
+            with open(os.path.join(self.history_dir, "blobs", f"{digest}.z"), 'rb') as f:
+                data = zlib.decompress(f.read())
+            self._replace_structure_file(file_path, data, digest, position=target)
+            return {
+                "path": file_path,
+                "message": self._reload_structure_file(file_path),
+                "hash": digest
+            }
+        except Exception as e:
+            return {
+                "error": f"Error rolling back file: {str(e)}"
+            }
+    
+    def _get_pdb_content(self, pdb_file, offset=None, length=None):
+        """
+        Get the content of a PDB file
+        
+        Gzipped files are decompressed while reading. With offset and/or
+        length only that range of the (uncompressed) content is returned;
+        for gzipped files a seek index is built on the first ranged read.
+        """
+        try:
+            # Determine file path
+            if os.path.isabs(pdb_file):
+                # Absolute path provided
+                file_path = pdb_file
+            else:
+                # Use current working directory
+                cwd = os.getcwd()
+                file_path = os.path.join(cwd, pdb_file)
+            
+            compressed = file_path.lower().endswith(".gz")
+            if offset is None and length is None:
+                # Read the file content
+                with (gzip.open if compressed else open)(file_path, 'rt') as f:
+                    content = f.read()
+                
+                return {
+                    "path": file_path,
+                    "content": content,
+                    "compressed": compressed
+                }
+            
+            offset = int(offset or 0)
+            if compressed:
+                index = self._get_gz_index(file_path)
+                total = index.size
+                data = index.read(offset, total if length is None else length)
+            else:
+                total = os.path.getsize(file_path)
+                with open(file_path, 'rb') as f:
+                    f.seek(offset)
+                    data = f.read(-1 if length is None else int(length))
+            
+            return {
+                "path": file_path,
+                "content": data.decode('utf-8', errors='replace'),
+                "compressed": compressed,
+                "offset": offset,
+                "length": len(data),
+                "total": total
+            }
+        except Exception as e:
+            return {
+                "error": f"Error reading PDB file: {str(e)}"
+            }
+    
+    def _get_gz_index(self, file_path):
+        """Return the cached seek index of a gzipped file, building it if needed"""
+        stat = os.stat(file_path)
+        with self.gz_lock:
+            cached = self.gz_indexes.get(file_path)
+            if cached and cached[:2] == (stat.st_mtime, stat.st_size):
+                self.gz_indexes.move_to_end(file_path)
+                return cached[2]
+        
+        index = GzipSeekIndex(file_path)
+        with self.gz_lock:
+            self.gz_indexes[file_path] = (stat.st_mtime, stat.st_size, index)
+            self.gz_indexes.move_to_end(file_path)
+            while len(self.gz_indexes) > GZ_INDEX_CACHE:
+                self.gz_indexes.popitem(last=False)
+        return index
+    
+    def _list_pdb_files(self, directory=None):
+        """List PDB files in the specified directory"""
+        try:
+            # Determine directory path
+            if directory:
+                if os.path.isabs(directory):
+                    dir_path = directory
+                else:
+                    cwd = os.getcwd()
+                    dir_path = os.path.join(cwd, directory)
+            else:
+                dir_path = os.getcwd()
+            
+            # List PDB files
+            pdb_files = []
+            for file in os.listdir(dir_path):
+                if file.lower().endswith(STRUCTURE_EXTENSIONS):
+                    file_path = os.path.join(dir_path, file)
+                    pdb_files.append({
+                        "name": file,
+                        "path": file_path,
+                        "size": os.path.getsize(file_path),
+                        "modified": os.path.getmtime(file_path),
+                        "compressed": file.lower().endswith(".gz")
+                    })
+            
+            return {
+                "directory": dir_path,
+                "files": pdb_files
+            }
+        except Exception as e:
+            return {
+                "error": f"Error listing PDB files: {str(e)}"
+            }
+    
+    def _export_array(self, array, transport="auto", lifetime=None):
+        """
+        Pack an array into a transport descriptor
+        
+        Arrays at or above the shared-memory threshold (or any array when
+        transport is "shm") are copied once into a named segment and only the
+        descriptor travels over the socket. Smaller arrays are sent inline as
+        base64. The segment stays alive until the client sends a
+        release_shared request or its lifetime expires.
+        """
+        array = np.ascontiguousarray(array)
+        descriptor = {
+            "dtype": array.dtype.str,
+            "shape": list(array.shape)
+        }
+        
+        use_shm = transport == "shm" or (
+            transport == "auto" and array.nbytes >= self.shm_threshold
+        )
+        if not use_shm or array.nbytes == 0:
+            descriptor["encoding"] = "base64"
+            descriptor["data"] = base64.b64encode(array.tobytes()).decode('ascii')
+            return descriptor
+        
+        lifetime = float(lifetime if lifetime is not None else self.shm_lifetime)
+        name = f"{SHM_PREFIX}{os.getpid()}_{os.urandom(6).hex()}"
+        shm = shared_memory.SharedMemory(name=name, create=True, size=array.nbytes)
+        np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+        
+        expires = time.time() + lifetime
+        with self.shm_lock:
+            self.shared_segments[name] = (shm, expires)
+        
+        descriptor.update({
+            "shm": name,
+            "nbytes": array.nbytes,
+            "expires": expires
+        })
+        return descriptor
+    
+    @contextlib.contextmanager
+    def _import_array(self, descriptor):
+        """
+        Yield the array described by a transport descriptor
+        
+        Shared-memory arrays are yielded as views on the client's segment,
+        so callers must copy anything they keep past the with block. The
+        segment is owned by the client and is only detached here.
+        """
+        dtype = np.dtype(descriptor.get("dtype", "<f4"))
+        shape = tuple(descriptor.get("shape", ()))
+        
+        if "shm" not in descriptor:
+            data = base64.b64decode(descriptor.get("data", ""))
+            yield np.frombuffer(data, dtype=dtype).reshape(shape)
+            return
+        
+        shm = _attach_shared_memory(descriptor["shm"])
+        array = None
+        try:
+            array = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+            yield array
+        finally:
+            # Drop our view before closing; if the caller still holds one the
+            # mapping is closed when the segment object is collected instead
+            del array
+            try:
+                shm.close()
+            except BufferError:
+                pass
+    
+    def _release_shared_array(self, name):
+        """Close and unlink a shared-memory segment created by the plugin"""
+        with self.shm_lock:
+            entry = self.shared_segments.pop(name, None)
+        if entry is None:
+            return False
+        
+        shm = entry[0]
+        try:
+            shm.close()
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+        return True
+    
+    def _cleanup_shared_arrays(self, release_all=False):
+        """Release expired shared-memory segments (or all of them)"""
+        now = time.time()
+        with self.shm_lock:
+            expired = [
+                name for name, (_, expires) in self.shared_segments.items()
+                if release_all or expires <= now
+            ]
+        for name in expired:
+            self._release_shared_array(name)
+    
+    def _get_coords(self, selection, state=1, transport="auto", lifetime=None):
+        """Get coordinates of a selection as a packed array descriptor"""
+        try:
+            state = int(state)
+            coords = cmd.get_coords(selection, state=state)
+            if coords is None:
+                return {
+                    "error": f"No coordinates for selection '{selection}'"
+                }
+            
+            # state=0 returns all states stacked; expose them as (states, atoms, 3)
+            n_atoms = cmd.count_atoms(selection)
+            if n_atoms:
+                coords = coords.reshape(-1, n_atoms, 3)
+            if state != 0:
+                coords = coords[0]
+            
+            return {
+                "selection": selection,
+                "state": state,
+                "n_atoms": n_atoms,
+                "coords": self._export_array(coords.astype(np.float32, copy=False), transport, lifetime)
+            }
+        except Exception as e:
+            return {
+                "error": f"Error getting coordinates: {str(e)}"
+            }
+    
+    def _set_coords(self, selection, descriptor, state=1):
+        """Load coordinates from a packed array descriptor into a selection"""
+        try:
+            with self._import_array(descriptor) as coords:
+                cmd.load_coords(coords.reshape(-1, 3), selection, state=int(state))
+                n_atoms = int(coords.size // 3)
+            self._bump_generations(cmd.get_object_list(selection))
+            
+            return {
+                "selection": selection,
+                "state": int(state),
+                "n_atoms": n_atoms
+            }
+        except Exception as e:
+            return {
+                "error": f"Error setting coordinates: {str(e)}"
+            }
+    
+    def _bump_generations(self, names=None):
+        """Mark objects (default: all loaded objects) as changed"""
+        if names is None:
+            names = cmd.get_names('objects')
+        names = set(names)
+        if not names:
+            return
+        
+        with self.index_lock:
+            for name in names:
+                self.object_generations[name] = next(self.generation_counter)
+            # Stale indexes can never be hit again, so free them now
+            for key in [key for key in self.spatial_indexes if key[0] in names]:
+                del self.spatial_indexes[key]
+    
+    def _named_objects(self, texts):
+        """
+        Objects a command's text names, or None if it may reach others
+        
+        None (meaning all objects) is returned when no object is named, or
+        when the text uses wildcards, named selections or words like "or"
+        and "all" that can extend it past the named objects. Must be called
+        with the command lock held.
+        """
+        tokens = set()
+        for text in texts:
+            if "*" in text or "|" in text or "!" in text:
+                return None
+            tokens.update(name_tokens(text))
+        if any(token.lower() in WIDENING_WORDS for token in tokens):
+            return None
+        if tokens & set(cmd.get_names('selections')):
+            return None
+        
+        known = set(cmd.get_names('objects'))
+        with self.index_lock:
+            known.update(self.object_generations)
+        return (tokens & known) or None
+    
+    def _note_command_changes(self, lines):
+        """
+        Bump generations after a command unless it only touched the view
+        
+        Only the objects the commands name are bumped (see _named_objects);
+        Python and commands that name no object bump every object.
+        """
+        changing = []
+        for line in lines:
+            stripped = line.strip()
+            keyword = stripped.split(" ", 1)[0].split(",", 1)[0].lower()
+            if not keyword or keyword in VIEW_ONLY_COMMANDS:
+                continue
+            if keyword in SCRIPT_COMMANDS or keyword.startswith(("@", "/")):
+                self._bump_generations()
+                return
+            changing.append(stripped)
+        if changing:
+            self._bump_generations(self._named_objects(changing))
+    
+    def _get_spatial_index(self, object_name, state, cell_size=GRID_CELL_SIZE):
+        """
+        Return the cached spatial index of an object state, building it if needed
+        
+        Must be called with the command lock held.
+        """
+        with self.index_lock:
+            key = (object_name, state, self.object_generations.get(object_name, 0), float(cell_size))
+            index = self.spatial_indexes.get(key)
+            if index is not None:
+                self.spatial_indexes.move_to_end(key)
+                return index
+        
+        atoms = []
+        cmd.iterate(
+            object_name,
+            "atoms.append((index, chain, resi, resn, name))",
+            space={"atoms": atoms}
+        )
+        coords = cmd.get_coords(object_name, state=state)
+        if coords is None:
+            raise ValueError(f"Object '{object_name}' has no state {state}")
+        
+        atom_ids = np.array([atom[0] for atom in atoms], dtype=np.int64)
+        index = {
+            "grid": SpatialGrid(coords, cell_size),
+            "atom_ids": atom_ids,
+            "id_order": np.argsort(atom_ids, kind="stable"),
+            "residues": [atom[1:4] for atom in atoms]
+        }
+        with self.index_lock:
+            self.spatial_indexes[key] = index
+            while len(self.spatial_indexes) > GRID_CACHE_SIZE:
+                self.spatial_indexes.popitem(last=False)
+        return index
+    
+    def _selection_positions(self, index, selection):
+        """Positions within an indexed object of the atoms in a selection"""
+        ids = np.array([atom_id for _, atom_id in cmd.index(selection)], dtype=np.int64)
+        order = index["id_order"]
+        if not len(ids) or not len(order):
+            return np.zeros(0, dtype=np.int64)
+        # Atom ids are not guaranteed to come in order; search them sorted
+        sorted_ids = index["atom_ids"][order]
+        slots = np.minimum(np.searchsorted(sorted_ids, ids), len(order) - 1)
+        return order[slots[sorted_ids[slots] == ids]]
+    
+    def _neighbors(self, req_data):
+        """
+        Answer neighbor queries against one object from a cached spatial index
+        
+        Modes: "radius" returns the object atoms within `radius` of any query
+        atom, "knn" the `k` nearest object atoms per query atom, and
+        "contacts" every (query atom, object atom) pair within `radius`.
+        Atoms are reported by PyMOL atom index as packed int32 arrays.
+        """
+        try:
+            object_name = req_data["object"]
+            state = int(req_data.get("state", 1))
+            mode = req_data.get("mode", "radius")
+            radius = float(req_data.get("radius", 5.0))
+            query = req_data.get("query")
+            target = req_data.get("target")
+            transport = req_data.get("transport", "auto")
+            if mode not in ("radius", "knn", "contacts"):
+                return {"error": f"Unknown neighbors mode: {mode}"}
+            
+            # Only coordinate extraction needs PyMOL; the search runs unlocked
+            with self.command_lock:
+                if object_name not in cmd.get_names('objects'):
+                    return {"error": f"Object not found: {object_name}"}
+                index = self._get_spatial_index(
+                    object_name, state, req_data.get("cell_size", GRID_CELL_SIZE)
+                )
+                
+                query_residues = None
+                exclude = None
+                if req_data.get("points"):
+                    with self._import_array(req_data["points"]) as points:
+                        query_coords = np.array(points, dtype=np.float64).reshape(-1, 3)
+                elif query:
+                    query_coords = cmd.get_coords(query, state=state)
+                    if query_coords is None:
+                        return {"error": f"No atoms in query selection '{query}'"}
+                    query_residues = []
+                    cmd.iterate(query, "residues.append((chain, resi, resn))", space={"residues": query_residues})
+                    if req_data.get("exclude_query", True):
+                        exclude = self._selection_positions(index, f"({query}) and ({object_name})")
+                else:
+                    return {"error": "neighbors requires a query selection or points"}
+                
+                allowed = None
+                if target:
+                    allowed = self._selection_positions(index, f"({object_name}) and ({target})")
+            
+            # Candidate mask over the object's atoms
+            grid = index["grid"]
+            mask = np.ones(len(grid.points), dtype=bool)
+            if allowed is not None:
+                mask[:] = False
+                mask[allowed] = True
+            if exclude is not None:
+                mask[exclude] = False
+            
+            result = {"object": object_name, "state": state, "mode": mode, "query_count": len(query_coords)}
+            
+            if mode == "knn":
+                k = int(req_data.get("k", 8))
+                # Over-fetch so masked-out atoms do not leave rows short
+                fetch = min(k + int((~mask).sum()), len(grid.points))
+                positions, distances = grid.nearest(query_coords, max(fetch, 1))
+                valid = positions >= 0
+                valid[valid] = mask[positions[valid]]
+                order = np.argsort(~valid, axis=1, kind="stable")[:, :k]
+                positions = np.take_along_axis(positions, order, axis=1)
+                distances = np.take_along_axis(distances, order, axis=1)
+                valid = np.take_along_axis(valid, order, axis=1)
+                if positions.shape[1] < k:
+                    pad = k - positions.shape[1]
+                    positions = np.pad(positions, ((0, 0), (0, pad)), constant_values=-1)
+                    distances = np.pad(distances, ((0, 0), (0, pad)), constant_values=np.inf)
+                    valid = np.pad(valid, ((0, 0), (0, pad)), constant_values=False)
+                
+                atom_ids = np.where(valid, index["atom_ids"][np.maximum(positions, 0)], -1)
+                result["atoms"] = self._export_array(atom_ids.astype(np.int32), transport)
+                result["distances"] = self._export_array(
+                    np.where(valid, distances, np.inf).astype(np.float32), transport
+                )
+                return result
+            
+            query_index, positions, distances = grid.pairs_within(query_coords, radius)
+            keep = mask[positions]
+            query_index, positions, distances = query_index[keep], positions[keep], distances[keep]
+            
+            if mode == "radius":
+                positions = np.unique(positions)
+                result["atoms"] = self._export_array(index["atom_ids"][positions].astype(np.int32), transport)
+                result["count"] = int(len(positions))
+            else:
+                order = np.lexsort((positions, query_index))
+                query_index, positions, distances = query_index[order], positions[order], distances[order]
+                result["query_atoms"] = self._export_array(query_index.astype(np.int32), transport)
+                result["atoms"] = self._export_array(index["atom_ids"][positions].astype(np.int32), transport)
+                result["distances"] = self._export_array(distances.astype(np.float32), transport)
+                result["count"] = int(len(positions))
+                
+                if req_data.get("by") == "residue" and query_residues is not None:
+                    pairs = sorted({
+                        query_residues[q] + index["residues"][p]
+                        for q, p in zip(query_index.tolist(), positions.tolist())
+                    })
+                    result["residue_pairs"] = [
+                        {"query": {"chain": q[0], "resi": q[1], "resn": q[2]},
+                         "target": {"chain": t[0], "resi": t[1], "resn": t[2]}}
+                        for q, t in ((pair[:3], pair[3:]) for pair in pairs)
+                    ]
+            
+            if req_data.get("by") == "residue":
+                seen = OrderedDict.fromkeys(index["residues"][p] for p in np.unique(positions).tolist())
+                result["residues"] = [
+                    {"chain": chain, "resi": resi, "resn": resn} for chain, resi, resn in seen
+                ]
+            return result
+        except Exception as e:
+            return {
+                "error": f"Error computing neighbors: {str(e)}"
+            }
+    
+    def _contact_map_points(self, selection, state, level, reduce):
+        """
+        Extract grouped points and labels for one side of a contact map
+        
+        Must be called with the command lock held. Returns the points
+        ordered by group, the group start offsets and one label per group.
+        """
+        coords = cmd.get_coords(selection, state=state)
+        if coords is None:
+            raise ValueError(f"No atoms in selection '{selection}' (state {state})")
+        
+        if level == "atom":
+            labels = [atom_id for _, atom_id in cmd.index(selection)]
+            return coords, np.arange(len(coords) + 1), labels
+        
+        atoms = []
+        cmd.iterate(selection, "atoms.append((segi, chain, resi, resn, name))", space={"atoms": atoms})
+        
+        # Atoms of a residue are contiguous in PyMOL's atom order
+        keys = [atom[:3] for atom in atoms]
+        starts = [0] + [i for i in range(1, len(keys)) if keys[i] != keys[i - 1]] + [len(keys)]
+        starts = np.array(starts, dtype=np.int64)
+        labels = [
+            {"segi": atoms[i][0], "chain": atoms[i][1], "resi": atoms[i][2], "resn": atoms[i][3]}
+            for i in starts[:-1]
+        ]
+        
+        if reduce == "ca":
+            picks = []
+            for first, last in zip(starts[:-1], starts[1:]):
+                names = [atoms[i][4] for i in range(first, last)]
+                picks.append(first + names.index("CA") if "CA" in names else first)
+            coords = coords[picks]
+            starts = np.arange(len(picks) + 1)
+        elif reduce == "centroid":
+            coords = np.add.reduceat(coords, starts[:-1], axis=0) / np.diff(starts)[:, None]
+            starts = np.arange(len(coords) + 1)
+        elif reduce != "min":
+            raise ValueError(f"Unknown reduction: {reduce}")
+        return coords, starts, labels
+    
+    def _contact_map_inputs(self, req_data):
+        """Extract both sides of a contact map under the command lock"""
+        state = int(req_data.get("state", 1))
+        level = req_data.get("level", "residue")
+        reduce = req_data.get("reduce", "min")
+        if level not in ("residue", "atom"):
+            raise ValueError(f"Unknown contact map level: {level}")
+        
+        with self.command_lock:
+            rows = self._contact_map_points(req_data["selection"], state, level, reduce)
+            symmetric = not req_data.get("selection2")
+            cols = rows if symmetric else self._contact_map_points(req_data["selection2"], state, level, reduce)
+        
+        cutoff = req_data.get("cutoff")
+        return {
+            "rows": rows,
+            "cols": cols,
+            "symmetric": symmetric,
+            "cutoff": float(cutoff) if cutoff is not None else None,
+            "memory_limit": int(req_data.get("memory_limit", CONTACT_MEMORY_LIMIT)),
+            "header": {
+                "selection": req_data["selection"],
+                "selection2": req_data.get("selection2") or req_data["selection"],
+                "state": state,
+                "level": level,
+                "reduce": reduce if level == "residue" else None,
+                "shape": [len(rows[2]), len(cols[2])],
+                "symmetric": symmetric,
+                "cutoff": cutoff,
+                "row_labels": rows[2],
+                "col_labels": cols[2] if not symmetric else None
+            }
+        }
+    
+    def _contact_map_chunks(self, inputs):
+        """Yield (first row, block) chunks, sparsified to (rows, cols, distances) with a cutoff"""
+        rows, cols = inputs["rows"], inputs["cols"]
+        for first, block in iter_distance_blocks(rows[0], rows[1], cols[0], cols[1], inputs["memory_limit"]):
+            if inputs["cutoff"] is None:
+                yield first, block
+                continue
+            
+            hit = block <= inputs["cutoff"]
+            if inputs["symmetric"]:
+                # Keep the upper triangle only; the lower one mirrors it
+                hit &= np.arange(block.shape[1])[None, :] > (first + np.arange(block.shape[0]))[:, None]
+            row_index, col_index = np.nonzero(hit)
+            yield first, (
+                (row_index + first).astype(np.int32),
+                col_index.astype(np.int32),
+                block[row_index, col_index]
+            )
+    
+    def _contact_map(self, req_data):
+        """
+        Compute a distance or contact map in one response
+        
+        Without a cutoff the dense float32 matrix is returned, provided it
+        fits within the memory limit; larger maps need a cutoff (sparse
+        output) or a streamed request.
+        """
+        try:
+            inputs = self._contact_map_inputs(req_data)
+            header = inputs["header"]
+            transport = req_data.get("transport", "auto")
+            n_rows, n_cols = header["shape"]
+            
+            if inputs["cutoff"] is None:
+                if n_rows * n_cols * 4 > inputs["memory_limit"]:
+                    return {
+                        "error": f"A dense {n_rows}x{n_cols} map exceeds the memory limit; "
+                                 "pass a cutoff for sparse output or stream the rows"
+                    }
+                matrix = np.empty((n_rows, n_cols), dtype=np.float32)
+                for first, block in self._contact_map_chunks(inputs):
+                    matrix[first:first + len(block)] = block
+                header["matrix"] = self._export_array(matrix, transport)
+                return header
+            
+            parts = [chunk for _, chunk in self._contact_map_chunks(inputs)]
+            row_index, col_index, distances = (np.concatenate(part) for part in zip(*parts))
+            header.update({
+                "count": int(len(distances)),
+                "rows": self._export_array(row_index, transport),
+                "cols": self._export_array(col_index, transport),
+                "distances": self._export_array(distances, transport)
+            })
+            return header
+        except Exception as e:
+            return {
+                "error": f"Error computing contact map: {str(e)}"
+            }
+    
+    def _serve_contact_map(self, client_socket, req_data, pending=b""):
+        """
+        Stream a contact map as row chunks on a persistent connection
+        
+        The header goes first, then one contact_rows message per block of
+        rows (dense rows, or sparse triplets with a cutoff), then a final
+        summary. Only one block is in memory at a time, so maps far larger
+        than RAM can be consumed row band by row band.
+        """
+        try:
+            inputs = self._contact_map_inputs(req_data)
+        except Exception as e:
+            self._send_message(client_socket, {
+                "status": "error",
+                "message": f"Error computing contact map: {str(e)}",
+                "data": None
+            })
+            return
+        
+        transport = req_data.get("transport", "auto")
+        self._send_message(client_socket, {
+            "status": "success",
+            "message": "Contact map stream started",
+            "data": inputs["header"]
+        })
+        
+        chunks = 0
+        count = 0
+        try:
+            for first, chunk in self._contact_map_chunks(inputs):
+                message = {"type": "contact_rows", "start": int(first)}
+                if inputs["cutoff"] is None:
+                    message["stop"] = int(first + len(chunk))
+                    message["matrix"] = self._export_array(chunk, transport)
+                else:
+                    message["count"] = int(len(chunk[2]))
+                    message["rows"] = self._export_array(chunk[0], transport)
+                    message["cols"] = self._export_array(chunk[1], transport)
+                    message["distances"] = self._export_array(chunk[2], transport)
+                    count += message["count"]
+                self._send_message(client_socket, message)
+                chunks += 1
+            
+            self._send_message(client_socket, {
+                "status": "success",
+                "message": "Contact map complete",
+                "data": {"chunks": chunks, "count": count if inputs["cutoff"] is not None else None}
+            })
+        except Exception as e:
+            try:
+                self._send_message(client_socket, {
+                    "status": "error",
+                    "message": f"Error streaming contact map: {str(e)}",
+                    "data": {"chunks": chunks}
+                })
+            except OSError:
+                pass
+    
+    def _get_process_pool(self):
+        """Return the shared process pool, starting it on first use"""
+        with self.pool_lock:
+            if self.process_pool is None:
+                # Forking a process that runs PyMOL's threads is unsafe
+                self.process_pool = ProcessPoolExecutor(
+                    max_workers=RMSD_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+            return self.process_pool
+    
+    def _rmsd_conformers(self, req_data):
+        """Extract conformer coordinates and labels under the command lock"""
+        selection = req_data.get("selection", "all")
+        with self.command_lock:
+            if req_data.get("objects"):
+                state = int(req_data.get("state", 1))
+                labels = list(req_data["objects"])
+                conformers = []
+                for name in labels:
+                    coords = cmd.get_coords(f"({name}) and ({selection})", state=state)
+                    if coords is None:
+                        raise ValueError(f"No atoms selected in '{name}'")
+                    conformers.append(coords)
+                if len({len(coords) for coords in conformers}) > 1:
+                    raise ValueError(
+                        "Objects have different atom counts for the selection: "
+                        + ", ".join(f"{name}={len(coords)}" for name, coords in zip(labels, conformers))
+                    )
+                return np.stack(conformers).astype(np.float64), labels
+            
+            object_name = req_data["object"]
+            atoms = f"({object_name}) and ({selection})"
+            n_atoms = cmd.count_atoms(atoms)
+            coords = cmd.get_coords(atoms, state=0)
+            if not n_atoms or coords is None:
+                raise ValueError(f"No atoms selected in '{object_name}'")
+            coords = coords.reshape(-1, n_atoms, 3).astype(np.float64)
+            return coords, list(range(1, len(coords) + 1))
+    
+    def _rmsd_matrix(self, req_data):
+        """
+        Compute all pairwise RMSDs between conformers
+        
+        Conformers are the states of `object` or the given `objects`,
+        restricted to `selection` (matched by PyMOL atom order). Coordinates
+        are extracted once and blocks of pairs are spread over a process
+        pool through shared memory. The result is the condensed upper
+        triangle (pair i < j at n*i - i*(i+1)/2 + j - i - 1), or the full
+        matrix with "format": "square".
+        """
+        segment = None
+        try:
+            fit = bool(req_data.get("fit", True))
+            output = req_data.get("format", "condensed")
+            if output not in ("condensed", "square"):
+                return {"error": f"Unknown RMSD matrix format: {output}"}
+            
+            coords, labels = self._rmsd_conformers(req_data)
+            if fit:
+                coords -= coords.mean(axis=1, keepdims=True)
+            n = len(coords)
+            
+            bounds = [(start, min(start + RMSD_BLOCK, n)) for start in range(0, n, RMSD_BLOCK)]
+            tasks = [(rows, cols) for i, rows in enumerate(bounds) for cols in bounds[i:]]
+            # Blocks in flight at once, up to the size of the shared pool
+            workers = min(max(int(req_data.get("workers", RMSD_WORKERS)), 0), RMSD_WORKERS)
+            
+            if workers > 0 and len(tasks) > 1:
+                segment = shared_memory.SharedMemory(create=True, size=coords.nbytes)
+                np.ndarray(coords.shape, dtype=np.float64, buffer=segment.buf)[...] = coords
+                blocks = map_bounded(
+                    self._get_process_pool(),
+                    _rmsd_shared_block,
+                    [(segment.name, coords.shape, fit, rows, cols) for rows, cols in tasks],
+                    workers
+                )
+            else:
+                blocks = (
+                    (rows, cols, rmsd_block(coords[slice(*rows)], coords[slice(*cols)], fit))
+                    for rows, cols in tasks
+                )
+            
+            if output == "square":
+                matrix = np.zeros((n, n), dtype=np.float32)
+                for rows, cols, block in blocks:
+                    matrix[slice(*rows), slice(*cols)] = block
+                    matrix[slice(*cols), slice(*rows)] = block.T
+            else:
+                matrix = np.zeros(n * (n - 1) // 2, dtype=np.float32)
+                for rows, cols, block in blocks:
+                    i = np.arange(*rows)[:, None]
+                    j = np.arange(*cols)[None, :]
+                    upper = np.broadcast_to(j > i, block.shape)
+                    positions = n * i - i * (i + 1) // 2 + j - i - 1
+                    matrix[np.broadcast_to(positions, block.shape)[upper]] = block[upper]
+            
+            return {
+                "conformers": n,
+                "atoms": int(coords.shape[1]),
+                "fit": fit,
+                "format": output,
+                "labels": labels,
+                "rmsd": self._export_array(matrix, req_data.get("transport", "auto"))
+            }
+        except Exception as e:
+            return {
+                "error": f"Error computing RMSD matrix: {str(e)}"
+            }
+        finally:
+            if segment is not None:
+                segment.close()
+                segment.unlink()
+    
+    def _lanes_idle(self):
+        """Whether no request is queued or running on any lane"""
+        return all(
+            lane["queue"].empty() and lane["running"] == 0
+            for lane in self.lanes.values()
+        )
+    
+    def _run_checkpointer(self):
+        """Write checkpoints on a fixed cadence, between queued requests"""
+        next_run = time.time() + self.checkpoint_interval
+        while self.running:
+            time.sleep(1.0)
+            if time.time() < next_run:
+                continue
+            
+            # Wait for a gap between requests, but do not starve forever
+            waited = 0.0
+            while self.running and not self._lanes_idle() and waited < CHECKPOINT_IDLE_WAIT:
+                time.sleep(0.1)
+                waited += 0.1
+            
+            try:
+                self._write_checkpoint(between_requests=True)
+            except Exception as e:
+                print(f"Error writing checkpoint: {e}")
+            next_run = time.time() + self.checkpoint_interval
+    
+    def _read_checkpoint_manifest(self):
+        """Load the checkpoint manifest (newest checkpoint last)"""
+        try:
+            with open(os.path.join(self.checkpoint_dir, "manifest.json"), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"checkpoints": []}
+    
+    def _write_file_atomic(self, path, data):
+        """
+        Write bytes to a file through a temporary file and rename
+        
+        The temporary file is flushed to disk before the rename, so after a
+        crash the path holds either the old or the new content in full. An
+        existing file keeps its permissions.
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        with tempfile.NamedTemporaryFile(
+            dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".tmp", delete=False
+        ) as f:
+            temp_path = f.name
+            try:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            except BaseException:
+                f.close()
+                os.remove(temp_path)
+                raise
+        try:
+            if os.path.exists(path):
+                os.chmod(temp_path, os.stat(path).st_mode & 0o7777)
+            os.replace(temp_path, path)
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+    
+    def _write_checkpoint(self, between_requests=False):
+        """
+        Checkpoint every object whose generation changed since the last one
+        
+        Each changed object is captured with a partial cmd.get_session under
+        the command lock, one object at a time (yielding to queued requests
+        in between when run in the background). Pickling, compression and
+        disk writes happen outside the lock. Unchanged objects point at
+        their file from an earlier checkpoint, and files no longer
+        referenced by the last CHECKPOINT_KEEP checkpoints are removed.
+        Evicted objects are recorded by hard-linking (or copying) their
+        eviction file, which holds the same kind of partial session.
+        """
+        with self.checkpoint_lock:
+            with self.command_lock:
+                names = cmd.get_names('objects')
+                view = list(cmd.get_view())
+            with self.residency_lock:
+                evicted = {
+                    name: entry["file"] for name, entry in self.evicted.items()
+                    if name not in names
+                }
+            
+            manifest = self._read_checkpoint_manifest()
+            previous = manifest["checkpoints"][-1]["objects"] if manifest["checkpoints"] else {}
+            with self.index_lock:
+                generations = {name: self.object_generations.get(name, 0) for name in names}
+            changed = [
+                name for name in names
+                if name not in previous or self.checkpointed_generations.get(name) != generations[name]
+            ]
+            linked = [name for name in evicted if previous.get(name) != evicted[name]]
+            if not changed and not linked and set(previous) == set(names) | set(evicted):
+                return {"written": [], "objects": len(previous)}
+            
+            object_dir = os.path.join(self.checkpoint_dir, "objects")
+            os.makedirs(object_dir, exist_ok=True)
+            checkpoint_id = (manifest["checkpoints"][-1]["id"] + 1) if manifest["checkpoints"] else 1
+            
+            files = {name: previous[name] for name in list(names) + list(evicted) if name in previous}
+            for name in linked:
+                source = os.path.join(self.evicted_dir, evicted[name])
+                target = os.path.join(object_dir, evicted[name])
+                try:
+                    try:
+                        os.link(source, target)
+                    except FileExistsError:
+                        pass
+                    except OSError:
+                        with open(source, 'rb') as f:
+                            self._write_file_atomic(target, f.read())
+                except OSError:
+                    # Reloaded meanwhile; the next checkpoint captures it as loaded
+                    continue
+                files[name] = evicted[name]
+            
+            written = []
+            # Yield between objects, but never hold the checkpoint lock past the idle wait
+            idle_deadline = time.time() + CHECKPOINT_IDLE_WAIT
+            for name in changed:
+                if between_requests:
+                    while self.running and not self._lanes_idle() and time.time() < idle_deadline:
+                        time.sleep(0.05)
+                with self.command_lock:
+                    if name not in cmd.get_names('objects'):
+                        continue
+                    session = cmd.get_session(name, partial=1)
+                
+                data = zlib.compress(pickle.dumps(session, protocol=pickle.HIGHEST_PROTOCOL), 6)
+                file_name = f"{re.sub(r'[^A-Za-z0-9_.-]', '_', name)}.{checkpoint_id}.pse.z"
+                self._write_file_atomic(os.path.join(object_dir, file_name), data)
+                files[name] = file_name
+                self.checkpointed_generations[name] = generations[name]
+                written.append({"object": name, "file": file_name, "bytes": len(data)})
+            
+            manifest["checkpoints"].append({
+                "id": checkpoint_id,
+                "time": time.time(),
+                "objects": files,
+                "view": view
+            })
+            manifest["checkpoints"] = manifest["checkpoints"][-CHECKPOINT_KEEP:]
+            self._write_file_atomic(
+                os.path.join(self.checkpoint_dir, "manifest.json"),
+                json.dumps(manifest).encode('utf-8')
+            )
+            
+            # Rotate out files no kept checkpoint refers to
+            referenced = {
+                file_name for checkpoint in manifest["checkpoints"]
+                for file_name in checkpoint["objects"].values()
+            }
+            for file_name in os.listdir(object_dir):
+                if file_name not in referenced:
+                    try:
+                        os.remove(os.path.join(object_dir, file_name))
+                    except OSError:
+                        pass
+            
+            return {"id": checkpoint_id, "written": written, "objects": len(files)}
+    
+    def _list_checkpoints(self):
+        """List kept checkpoints, newest first"""
+        manifest = self._read_checkpoint_manifest()
+        return {
+            "directory": self.checkpoint_dir,
+            "checkpoints": [
+                {"id": checkpoint["id"], "time": checkpoint["time"], "objects": sorted(checkpoint["objects"])}
+                for checkpoint in reversed(manifest["checkpoints"])
+            ]
+        }
+    
+    def _restore_checkpoint(self, checkpoint_id=None, objects=None, restore_view=True):
+        """Restore objects from a checkpoint (default: the latest), replacing current ones"""
+        try:
+            manifest = self._read_checkpoint_manifest()
+            checkpoints = manifest["checkpoints"]
+            if checkpoint_id is not None:
+                checkpoints = [c for c in checkpoints if c["id"] == int(checkpoint_id)]
+            if not checkpoints:
+                return {"error": f"Checkpoint not found: {checkpoint_id if checkpoint_id is not None else 'latest'}"}
+            checkpoint = checkpoints[-1]
+            
+            names = objects or list(checkpoint["objects"])
+            missing = [name for name in names if name not in checkpoint["objects"]]
+            if missing:
+                return {"error": f"Objects not in checkpoint {checkpoint['id']}: {', '.join(missing)}"}
             
-            while self.running:
+            # Decompress before taking the lock; only set_session needs PyMOL
+            sessions = []
+            for name in names:
+                path = os.path.join(self.checkpoint_dir, "objects", checkpoint["objects"][name])
+                with open(path, 'rb') as f:
+                    sessions.append((name, pickle.loads(zlib.decompress(f.read()))))
+            
+            with self.command_lock:
+                loaded = cmd.get_names('objects')
+                for name, session in sessions:
+                    if name in loaded:
+                        cmd.delete(name)
+                    cmd.set_session(session, partial=1)
+                if restore_view and not objects:
+                    cmd.set_view(checkpoint["view"])
+                self._bump_generations(names)
+            # Restored objects are loaded again, so any evicted copies are stale
+            for name in names:
+                self._drop_eviction(name)
+            
+            return {
+                "id": checkpoint["id"],
+                "time": checkpoint["time"],
+                "restored": names
+            }
+        except Exception as e:
+            return {
+                "error": f"Error restoring checkpoint: {str(e)}"
+            }
+    
+    def _load_batch_jobs(self):
+        """Load jobs from disk and queue the unfinished ones to resume"""
+        os.makedirs(self.jobs_dir, exist_ok=True)
+        with self.batch_lock:
+            for file_name in os.listdir(self.jobs_dir):
+                if not file_name.endswith(".job.json"):
+                    continue
+                job_id = file_name[:-len(".job.json")]
+                if job_id in self.batch_jobs:
+                    continue
                 try:
-                    client, addr = self.server_socket.accept()
-                    self._handle_client(client)
-                except socket.timeout:
-                    # This is expected due to the timeout
+                    with open(os.path.join(self.jobs_dir, file_name)) as f:
+                        self.batch_jobs[job_id] = json.load(f)
+                except (OSError, ValueError):
                     continue
-                except Exception as e:
-                    if self.running:
-                        print(f"Error accepting connection: {e}")
-        except Exception as e:
-            print(f"Server error: {e}")
-        finally:
-            if self.server_socket:
-                self.server_socket.close()
+            
+            pending = [
+                job for job in self.batch_jobs.values()
+                if job["state"] in ("queued", "running")
+            ]
+        for job in sorted(pending, key=lambda job: job["submitted"]):
+            if job["state"] == "running":
+                # Interrupted by a shutdown; carry on after the last completed step
+                job["state"] = "queued"
+                job["resumes"] += 1
+                self._save_batch_job(job)
+            self.batch_queue.put(job["id"])
     
-    def _handle_client(self, client_socket):
-        """Handle a client connection"""
+    def _save_batch_job(self, job):
+        self._write_file_atomic(
+            os.path.join(self.jobs_dir, f"{job['id']}.job.json"),
+            json.dumps(job).encode('utf-8')
+        )
+    
+    def _job_steps_from_script(self, path):
+        """
+        Split a script into job steps
+        
+        Python scripts are one step (run); in .pml scripts every command is
+        a step, except python/embed blocks, which stay whole.
+        """
+        if path.endswith(".py"):
+            return [f"run {path}"]
+        
+        with open(path) as f:
+            return split_command_steps(f.read().splitlines())
+    
+    def _submit_batch_job(self, req_data):
+        """
+        Queue a batch job of PyMOL commands or a script
+        
+        The steps are written to disk with the job, so a job survives the
+        MCP session that submitted it and resumes after a restart.
+        """
         try:
-            data = b""
+            commands = req_data.get("commands")
+            script = req_data.get("script")
+            if commands:
+                if isinstance(commands, str):
+                    commands = [commands]
+                # Command lines split like a .pml script; {"function", "args"} entries are one step each
+                steps = []
+                for is_call, items in itertools.groupby(commands, key=lambda item: isinstance(item, dict)):
+                    steps.extend(items if is_call else split_command_steps("\n".join(items).splitlines()))
+            elif script:
+                steps = self._job_steps_from_script(os.path.abspath(script))
+            else:
+                return {"error": "Either commands or script is required"}
+            if not steps:
+                return {"error": "The job has no commands"}
             
-            # Receive data
-            while True:
-                chunk = client_socket.recv(BUFFER_SIZE)
-                if not chunk:
-                    break
-                
-                data += chunk
-                
-                # End of message marker
-                if b"\n\n" in data:
-                    break
+            job_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.urandom(3).hex()}"
+            job = {
+                "id": job_id,
+                "name": req_data.get("name") or script or job_id,
+                "state": "queued",
+                "total": len(steps),
+                "completed": 0,
+                "retries": int(req_data.get("retries", 0)),
+                "attempts": 0,
+                "resumes": 0,
+                "reason": None,
+                "log": [],
+                "submitted": time.time(),
+                "started": None,
+                "finished": None
+            }
             
-            if not data:
-                return
+            os.makedirs(self.jobs_dir, exist_ok=True)
+            self._write_file_atomic(
+                os.path.join(self.jobs_dir, f"{job_id}.steps.json"),
+                json.dumps(steps).encode('utf-8')
+            )
+            self._save_batch_job(job)
+            with self.batch_lock:
+                self.batch_jobs[job_id] = job
+            self.batch_queue.put(job_id)
             
-            # Process the request
+            return self._job_summary(job)
+        except Exception as e:
+            return {
+                "error": f"Error submitting job: {str(e)}"
+            }
+    
+    def _job_summary(self, job, log=False):
+        summary = {key: value for key, value in job.items() if key != "log"}
+        if log:
+            summary["log"] = job["log"]
+        return summary
+    
+    def _get_batch_job(self, job_id):
+        with self.batch_lock:
+            job = self.batch_jobs.get(job_id)
+        if job is None:
+            return {"error": f"No job with id {job_id}"}
+        return self._job_summary(job, log=True)
+    
+    def _list_batch_jobs(self):
+        with self.batch_lock:
+            jobs = sorted(self.batch_jobs.values(), key=lambda job: job["submitted"])
+            return {"jobs": [self._job_summary(job) for job in jobs]}
+    
+    def _cancel_batch_job(self, job_id):
+        """Cancel a queued job, or stop a running one before its next step"""
+        with self.batch_lock:
+            job = self.batch_jobs.get(job_id)
+            if job is None:
+                return {"error": f"No job with id {job_id}"}
+            if job["state"] not in ("queued", "running"):
+                return {"error": f"Job {job_id} is already {job['state']}"}
+            
+            control = self.batch_controls.get(job_id)
+            if control is not None:
+                control["state"] = "cancelled"
+            else:
+                job["state"] = "cancelled"
+                job["finished"] = time.time()
+                self._save_batch_job(job)
+            return self._job_summary(job)
+    
+    def _resume_batch_job(self, job_id):
+        """Queue a failed or cancelled job again from its first unfinished step"""
+        with self.batch_lock:
+            job = self.batch_jobs.get(job_id)
+            if job is None:
+                return {"error": f"No job with id {job_id}"}
+            if job["state"] not in ("failed", "cancelled"):
+                return {"error": f"Job {job_id} is {job['state']}; only failed or cancelled jobs can be resumed"}
+            
+            job.update(state="queued", attempts=0, reason=None, finished=None)
+            job["resumes"] += 1
+            self._save_batch_job(job)
+        self.batch_queue.put(job_id)
+        return self._job_summary(job)
+    
+    def _run_job_step(self, step):
+        """
+        Run one job step and return (failed, output)
+        
+        Command steps run through _run_command_lines, so they have finished
+        when it returns and report failure through the parser's return
+        value. {"function", "args"} steps are CMD_API calls.
+        """
+        if isinstance(step, dict):
+            result = self._call_cmd(step.get("function"), step.get("args") or {})
+            if "error" in result:
+                return True, result["error"]
+            return False, json.dumps(result["result"])
+        
+        ok, output = self._run_command_lines([step])
+        return not ok, output
+    
+    def _run_batch_jobs(self):
+        """Run queued batch jobs one at a time"""
+        while self.running:
             try:
-                # Parse JSON request
-                request_str = data.decode('utf-8').strip()
-                response = self.handle_mcp_request(request_str)
+                job_id = self.batch_queue.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            try:
+                self._run_batch_job(job_id)
+            except Exception as e:
+                print(f"Error running job {job_id}: {e}")
+    
+    def _run_batch_job(self, job_id):
+        """
+        Run a job's steps from the first unfinished one
+        
+        The command lock is taken per step, so interactive requests run in
+        between. Progress is saved after every step; a failed step is retried
+        up to the job's retry count before the job fails.
+        """
+        with self.batch_lock:
+            job = self.batch_jobs.get(job_id)
+            if job is None or job["state"] != "queued":
+                return
+            control = {"state": "running", "deadline": None}
+            self.batch_controls[job_id] = control
+            job["state"] = "running"
+            job["started"] = job["started"] or time.time()
+        
+        try:
+            with open(os.path.join(self.jobs_dir, f"{job_id}.steps.json")) as f:
+                steps = json.load(f)
+            self._save_batch_job(job)
+            
+            while job["completed"] < len(steps):
+                if control["state"] == "cancelled" or not self.running:
+                    break
                 
-                # Send response
-                response_json = json.dumps(response)
-                client_socket.sendall(response_json.encode('utf-8'))
+                self._job_context.job = control
+                try:
+                    with self.command_lock:
+                        referenced = self._page_in(steps[job["completed"]])
+                        failed, output = self._run_job_step(steps[job["completed"]])
+                finally:
+                    self._job_context.job = None
+                self._enforce_residency(referenced)
                 
-            except json.JSONDecodeError:
-                # Handle invalid JSON
-                error_response = {
-                    "status": "error",
-                    "message": "Invalid JSON request",
-                    "data": None
-                }
-                client_socket.sendall(json.dumps(error_response).encode('utf-8'))
+                with self.batch_lock:
+                    job["log"] = (job["log"] + [{
+                        "step": job["completed"],
+                        "attempt": job["attempts"] + 1,
+                        "output": output
+                    }])[-JOB_LOG_KEEP:]
+                    if not failed:
+                        job["completed"] += 1
+                        job["attempts"] = 0
+                    elif control["state"] != "cancelled":
+                        job["attempts"] += 1
+                        if job["attempts"] > job["retries"]:
+                            job.update(state="failed", reason=output.rstrip().rsplit("\n", 1)[-1])
+                self._save_batch_job(job)
                 
+                if job["state"] == "failed":
+                    break
+                if failed and control["state"] != "cancelled":
+                    time.sleep(JOB_RETRY_DELAY)
+            
+            with self.batch_lock:
+                if control["state"] == "cancelled":
+                    job["state"] = "cancelled"
+                elif job["completed"] == len(steps):
+                    job["state"] = "completed"
+                elif job["state"] == "running":
+                    # Stopped by a shutdown; resumed when the server starts again
+                    return
+                job["finished"] = time.time()
         except Exception as e:
-            print(f"Error handling client connection: {e}")
+            with self.batch_lock:
+                job.update(state="failed", reason=f"Error running job: {str(e)}", finished=time.time())
         finally:
-            client_socket.close()
+            with self.batch_lock:
+                self.batch_controls.pop(job_id, None)
+            self._save_batch_job(job)
+    
+    def _reference_texts(self, request):
+        """Strings in a request's name fields (not file contents or options)"""
+        if not isinstance(request, dict):
+            return [request] if isinstance(request, str) else []
+        
+        if request.get("type") == "run_macro":
+            with self.macro_lock:
+                macro = self.macros.get(request.get("name"))
+                texts = list(macro["steps"]) if macro else []
+            args = request.get("args") or {}
+            return texts + [str(value) for value in args.values()]
+        
+        texts = []
+        for key in REFERENCE_FIELDS:
+            value = request.get(key)
+            for item in (value if isinstance(value, list) else [value]):
+                if isinstance(item, dict):
+                    # A {"function", "args"} job step
+                    texts.extend(self._reference_texts(item.get("args") or {}))
+                elif isinstance(item, str):
+                    texts.append(item)
+        if isinstance(request.get("args"), dict) and request.get("type") == "call":
+            texts.extend(self._reference_texts(request["args"]))
+        return texts
+    
+    def _referenced_objects(self, request):
+        """Return the tracked object names (resident or evicted) a request mentions"""
+        tokens = set()
+        for text in self._reference_texts(request):
+            tokens |= name_tokens(text)
+        
+        with self.residency_lock:
+            return {name for name in tokens if name in self.residency or name in self.evicted}
+    
+    def _page_in(self, request):
+        """
+        Reload evicted objects a request refers to before it runs
+        
+        Returns the referenced object names, which are protected from
+        eviction until the request has finished.
+        """
+        if self.residency_budget <= 0:
+            return set()
+        referenced = self._referenced_objects(request)
+        with self.residency_lock:
+            evicted = [name for name in referenced if name in self.evicted]
+        for name in evicted:
+            self._reload_object(name)
+        return referenced
     
-    def _execute_pymol_command(self, command_str):
-        """Execute a PyMOL command and return the result"""
+    def _save_evictions(self):
+        """Write the eviction index next to the eviction files"""
+        with self.residency_lock:
+            data = json.dumps(self.evicted).encode('utf-8')
+        os.makedirs(self.evicted_dir, exist_ok=True)
+        self._write_file_atomic(os.path.join(self.evicted_dir, "index.json"), data)
+    
+    def _load_evictions(self):
+        """
+        Load the eviction index left by an earlier run
+        
+        Objects evicted before a crash or restart stay evicted and are
+        reloaded on their next reference. Entries whose file is gone are
+        dropped, and files no entry refers to are removed.
+        """
+        if not os.path.isdir(self.evicted_dir):
+            return
+        try:
+            with open(os.path.join(self.evicted_dir, "index.json")) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {}
+        
+        with self.residency_lock:
+            for name, entry in index.items():
+                if name not in self.evicted and os.path.exists(os.path.join(self.evicted_dir, entry["file"])):
+                    self.evicted[name] = entry
+            current = {entry["file"] for entry in self.evicted.values()}
+        for file_name in os.listdir(self.evicted_dir):
+            if file_name != "index.json" and file_name not in current:
+                try:
+                    os.remove(os.path.join(self.evicted_dir, file_name))
+                except OSError:
+                    pass
+        self._save_evictions()
+    
+    def _drop_eviction(self, name):
+        """Forget an evicted copy of an object and remove its file"""
+        with self.residency_lock:
+            entry = self.evicted.pop(name, None)
+        if entry is None:
+            return
+        try:
+            os.remove(os.path.join(self.evicted_dir, entry["file"]))
+        except OSError:
+            pass
+        self._save_evictions()
+    
+    def _reload_object(self, name):
+        """Bring an evicted object back from disk"""
+        with self.residency_lock:
+            entry = self.evicted.get(name)
+        if entry is None:
+            return False
+        
+        path = os.path.join(self.evicted_dir, entry["file"])
+        with open(path, 'rb') as f:
+            session = pickle.loads(zlib.decompress(f.read()))
+        
+        with self.command_lock:
+            if name in cmd.get_names('objects'):
+                # A new object took the name while this one was on disk
+                cmd.delete(name)
+            cmd.set_session(session, partial=1)
+            self._bump_generations([name])
+        
+        with self.index_lock:
+            generation = self.object_generations.get(name, 0)
+        with self.residency_lock:
+            self.evicted.pop(name, None)
+            self.residency[name] = dict(entry["footprint"], last_access=time.time())
+            self.measured[name] = (generation, entry["footprint"])
+            self.residency_stats["reloads"] += 1
+        self._save_evictions()
         try:
-            # Capture PyMOL output
-            old_stdout = sys.stdout
-            sys.stdout = output = StringIO()
+            os.remove(path)
+        except OSError:
+            pass
+        return True
+    
+    def _measure_object(self, name):
+        """Return the footprint of a loaded object; must hold the command lock"""
+        selection = f"%{name}"
+        atoms = cmd.count_atoms(selection)
+        states = max(cmd.count_states(selection), 1)
+        reps = {}
+        if atoms:
+            for rep in RESIDENCY_REP_WEIGHTS:
+                count = cmd.count_atoms(f"{selection} and rep {rep}")
+                if count:
+                    reps[rep] = count
+        
+        return {
+            "atoms": atoms,
+            "states": states,
+            "reps": sorted(reps),
+            "footprint": atoms * states + sum(
+                count * RESIDENCY_REP_WEIGHTS[rep] for rep, count in reps.items()
+            )
+        }
+    
+    def _enforce_residency(self, referenced=()):
+        """
+        Update footprints after a request and evict past the budget
+        
+        New objects and the ones the request referenced are marked as just
+        used, and measured again only if their generation changed since the
+        last measurement; then least recently used objects are written to
+        disk and deleted until the total footprint fits the budget again. A
+        new object that takes the name of an evicted one replaces it.
+        """
+        if self.residency_budget <= 0:
+            return
+        
+        with self.command_lock:
+            names = cmd.get_names('objects')
+            with self.residency_lock:
+                for name in [name for name in self.residency if name not in names]:
+                    del self.residency[name]
+                    self.measured.pop(name, None)
+                touched = [
+                    name for name in names
+                    if name not in self.residency or name in referenced
+                ]
+                superseded = [name for name in names if name in self.evicted]
+            for name in superseded:
+                self._drop_eviction(name)
+            with self.index_lock:
+                generations = {name: self.object_generations.get(name, 0) for name in touched}
             
-            # Execute the command
-            result = cmd.do(command_str)
+            now = time.time()
+            for name in touched:
+                with self.residency_lock:
+                    measured = self.measured.get(name)
+                if measured is None or measured[0] != generations[name]:
+                    measured = (generations[name], self._measure_object(name))
+                with self.residency_lock:
+                    self.measured[name] = measured
+                    self.residency[name] = dict(measured[1], last_access=now)
+                    self.residency.move_to_end(name)
             
-            # Get the output
-            output_text = output.getvalue()
+            while True:
+                with self.residency_lock:
+                    used = sum(entry["footprint"] for entry in self.residency.values())
+                    if used <= self.residency_budget:
+                        break
+                    # Objects this request touched are never evicted by it
+                    victim = next((name for name in self.residency if name not in referenced), None)
+                if victim is None:
+                    break
+                self._evict_object(victim)
+    
+    def _evict_object(self, name):
+        """Write an object to disk and delete it from PyMOL"""
+        with self.command_lock:
+            session = cmd.get_session(name, partial=1)
+            data = zlib.compress(pickle.dumps(session, protocol=pickle.HIGHEST_PROTOCOL), 1)
+            file_name = f"{re.sub(r'[^A-Za-z0-9_.-]', '_', name)}.{os.urandom(4).hex()}.pse.z"
+            os.makedirs(self.evicted_dir, exist_ok=True)
+            self._write_file_atomic(os.path.join(self.evicted_dir, file_name), data)
             
-            # Restore stdout
-            sys.stdout = old_stdout
+            # Index the file before the object goes, so a crash cannot lose it
+            with self.residency_lock:
+                footprint = self.residency.pop(name)
+                footprint.pop("last_access", None)
+                self.measured.pop(name, None)
+                self.evicted[name] = {
+                    "file": file_name,
+                    "bytes": len(data),
+                    "evicted_at": time.time(),
+                    "footprint": footprint
+                }
+                self.residency_stats["evictions"] += 1
+            self._save_evictions()
+            cmd.delete(name)
+            self._bump_generations([name])
+    
+    def _residency_report(self, budget=None):
+        """Return residency stats, optionally setting a new budget first"""
+        try:
+            if budget is not None:
+                self.residency_budget = int(budget)
+                self._enforce_residency()
             
+            with self.residency_lock:
+                resident = [
+                    dict(entry, name=name) for name, entry in self.residency.items()
+                ]
+                evicted = [
+                    dict(entry["footprint"], name=name, bytes=entry["bytes"], evicted_at=entry["evicted_at"])
+                    for name, entry in self.evicted.items()
+                ]
+                return {
+                    "budget": self.residency_budget,
+                    "used": sum(entry["footprint"] for entry in resident),
+                    "resident": resident,  # Least recently used first
+                    "evicted": evicted,
+                    "evictions": self.residency_stats["evictions"],
+                    "reloads": self.residency_stats["reloads"]
+                }
+        except Exception as e:
             return {
-                "result": result,
-                "output": output_text
+                "error": f"Error getting residency: {str(e)}"
             }
+    
+    def _load_macros(self):
+        """Load the macro registry from the state directory"""
+        path = os.path.join(self.state_dir, "macros.json")
+        try:
+            with open(path) as f:
+                macros = json.load(f)
+        except (OSError, ValueError):
+            macros = {}
+        with self.macro_lock:
+            self.macros = macros
+    
+    def _save_macros(self):
+        """Write the macro registry; call with the macro lock held"""
+        os.makedirs(self.state_dir, exist_ok=True)
+        self._write_file_atomic(
+            os.path.join(self.state_dir, "macros.json"),
+            json.dumps(self.macros, indent=1).encode('utf-8')
+        )
+    
+    def _define_macro(self, req_data):
+        """
+        Create or replace a parameterized macro
+        
+        Commands are split into steps once, here; `$name` or `${name}`
+        placeholders become the macro's parameters. With validate (the
+        default) every step must start with a known PyMOL command.
+        """
+        try:
+            name = req_data.get("name", "")
+            if not re.match(r"^[A-Za-z_][\w-]*$", name):
+                return {"error": f"Invalid macro name: {name!r}"}
+            
+            commands = req_data.get("commands", "")
+            lines = commands.splitlines() if isinstance(commands, str) else list(commands)
+            steps = split_command_steps(lines)
+            if not steps:
+                return {"error": "The macro has no commands"}
+            
+            placeholders = []
+            for step in steps:
+                for match in Template.pattern.finditer(step):
+                    param = match.group("named") or match.group("braced")
+                    if param and param not in placeholders:
+                        placeholders.append(param)
+            params = req_data.get("params") or placeholders
+            undeclared = [param for param in placeholders if param not in params]
+            unused = [param for param in params if param not in placeholders]
+            if undeclared or unused:
+                return {"error": f"Parameters not declared: {undeclared}; declared but unused: {unused}"}
+            
+            defaults = {key: str(value) for key, value in (req_data.get("defaults") or {}).items()}
+            if any(key not in params for key in defaults):
+                return {"error": "Defaults given for unknown parameters"}
+            
+            keywords = [
+                step.split(" ", 1)[0].split(",", 1)[0].lower()
+                for step in steps
+                if not step.startswith(("python", "embed", "/"))
+            ]
+            if req_data.get("validate", True):
+                unknown = [
+                    keyword for keyword in keywords
+                    if "$" not in keyword and keyword not in cmd.keyword
+                ]
+                if unknown:
+                    return {"error": f"Unknown PyMOL commands: {', '.join(unknown)}"}
+            
+            with self.macro_lock:
+                previous = self.macros.get(name)
+                self.macros[name] = {
+                    "name": name,
+                    "description": req_data.get("description", ""),
+                    "steps": steps,
+                    "params": params,
+                    "defaults": defaults,
+                    "render": any(keyword in RENDER_COMMANDS for keyword in keywords),
+                    "created": previous["created"] if previous else time.time(),
+                    "updated": time.time(),
+                    "runs": previous["runs"] if previous else 0
+                }
+                self._save_macros()
+                return dict(self._macro_summary(self.macros[name]), replaced=previous is not None)
         except Exception as e:
             return {
-                "result": None,
-                "output": f"Error: {str(e)}"
+                "error": f"Error defining macro: {str(e)}"
             }
     
-    def _get_pymol_state(self):
-        """Get current PyMOL state information"""
+    def _macro_summary(self, macro, steps=False):
+        summary = {key: value for key, value in macro.items() if key != "steps"}
+        summary["step_count"] = len(macro["steps"])
+        if steps:
+            summary["steps"] = macro["steps"]
+        return summary
+    
+    def _list_macros(self, name=None):
+        with self.macro_lock:
+            if name:
+                macro = self.macros.get(name)
+                if macro is None:
+                    return {"error": f"No macro named {name}"}
+                return self._macro_summary(macro, steps=True)
+            return {"macros": [self._macro_summary(macro) for macro in self.macros.values()]}
+    
+    def _delete_macro(self, name):
+        with self.macro_lock:
+            if self.macros.pop(name, None) is None:
+                return {"error": f"No macro named {name}"}
+            self._save_macros()
+            return {"name": name, "deleted": True}
+    
+    def _run_macro(self, name, args=None):
+        """Substitute arguments into a macro's steps and run them"""
         try:
-            state_info = {
-                "loaded_objects": cmd.get_names('objects'),
-                "current_view": cmd.get_view(),
-                "selections": cmd.get_names('selections')
+            with self.macro_lock:
+                macro = self.macros.get(name)
+                if macro is None:
+                    return {"error": f"No macro named {name}"}
+                macro["runs"] += 1
+            
+            values = dict(macro["defaults"])
+            values.update({key: str(value) for key, value in (args or {}).items()})
+            unknown = [key for key in values if key not in macro["params"]]
+            missing = [param for param in macro["params"] if param not in values]
+            if unknown or missing:
+                return {"error": f"Missing arguments: {missing}; unknown arguments: {unknown}"}
+            
+            # A step is one command, so arguments must not add lines to it
+            multiline = [key for key, value in values.items() if "\n" in value or "\r" in value]
+            if multiline:
+                return {"error": f"Arguments cannot span lines: {multiline}"}
+            
+            steps = [Template(step).substitute(values) for step in macro["steps"]]
+            ok, output = self._run_command_lines(steps)
+            return {
+                "result": ok,
+                "output": output
             }
-            return state_info
         except Exception as e:
             return {
-                "error": f"Error getting PyMOL state: {str(e)}"
+                "error": f"Error running macro: {str(e)}"
             }
     
-    def _edit_pdb_file(self, pdb_file, pdb_content):
-        """Edit a PDB file with the provided content"""
+    def _animate_view(self, req_data):
+        """
+        Play or render a camera path through keyframes
+        
+        Keyframes are {"view": [18 values]} or {"scene": name} (only the
+        scene's view is recalled, to read it, and the user's view and current
+        scene are put back), each with the duration of the move from the
+        previous keyframe. Frames are set one at a time with the command
+        lock taken per frame. Without render they are paced to fps for
+        on-screen playback; with render (options, or true for the defaults)
+        every frame is saved as a PNG (by default in a new directory under
+        state_dir/frames), or queued as a batch job of set_view/png calls
+        when background is set.
+        """
         try:
-            # Check if file is already loaded in PyMOL
-            loaded_objects = cmd.get_names('objects')
-            file_base = os.path.basename(pdb_file)
-            file_name = os.path.splitext(file_base)[0]
+            keyframes = req_data.get("keyframes") or []
+            if len(keyframes) < 2:
+                return {"error": "At least two keyframes are required"}
+            fps = float(req_data.get("fps", ANIMATION_FPS))
             
-            # Determine file path
-            if os.path.isabs(pdb_file):
-                # Absolute path provided
-                file_path = pdb_file
-            else:
-                # Use current working directory
-                cwd = os.getcwd()
-                file_path = os.path.join(cwd, pdb_file)
+            views = []
+            with self.command_lock:
+                saved_view = cmd.get_view()
+                saved_scene = cmd.get("scene_current_name")
+                try:
+                    for keyframe in keyframes:
+                        if keyframe.get("scene"):
+                            cmd.scene(
+                                keyframe["scene"], "recall", animate=0,
+                                view=1, color=0, active=0, rep=0, frame=0
+                            )
+                            views.append(list(cmd.get_view()))
+                        elif len(keyframe.get("view") or []) == 18:
+                            views.append(keyframe["view"])
+                        else:
+                            return {"error": "Each keyframe needs an 18-value view or a scene"}
+                finally:
+                    cmd.set_view(saved_view)
+                    cmd.set("scene_current_name", saved_scene)
+            durations = [float(keyframe.get("duration", 1.0)) for keyframe in keyframes[1:]]
+            frames = interpolate_views(views, durations, fps, req_data.get("ease", True))
+            
+            render = req_data.get("render")
+            if isinstance(render, bool) or render is None:
+                render = {} if render else None
+            elif not isinstance(render, dict):
+                return {"error": "render must be true or an object of render options"}
+            if render is None:
+                started = time.time()
+                for number, view in enumerate(frames):
+                    self._check_interrupted()
+                    with self.command_lock:
+                        cmd.set_view(view)
+                    delay = started + (number + 1) / fps - time.time()
+                    if delay > 0:
+                        time.sleep(delay)
+                return {
+                    "frames": len(frames),
+                    "duration": round(time.time() - started, 3)
+                }
             
-            # Write the new content to the file
-            with open(file_path, 'w') as f:
-                f.write(pdb_content)
+            directory = render.get("directory") or os.path.join(
+                self.state_dir, "frames", f"{time.strftime('%Y%m%d-%H%M%S')}-{os.urandom(3).hex()}"
+            )
+            directory = os.path.abspath(directory)
+            os.makedirs(directory, exist_ok=True)
+            prefix = render.get("prefix", "frame")
+            width = int(render.get("width", 0))
+            height = int(render.get("height", 0))
+            ray = 1 if render.get("ray", True) else 0
+            paths = [os.path.join(directory, f"{prefix}{number:04d}.png") for number in range(len(frames))]
             
-            # If the object was loaded, reload it
-            if file_name in loaded_objects:
-                cmd.load(file_path, file_name, format='pdb', state=1)
-                reload_message = f"Reloaded PDB file '{file_name}'"
-            else:
-                reload_message = "File edited but not reloaded (not currently loaded in PyMOL)"
+            if req_data.get("background"):
+                # Call steps, so paths are never parsed as PyMOL command text
+                steps = []
+                for view, path in zip(frames, paths):
+                    steps.append({"function": "set_view", "args": {"view": view}})
+                    steps.append({
+                        "function": "png",
+                        "args": {"filename": path, "width": width, "height": height, "ray": ray}
+                    })
+                job = self._submit_batch_job({"commands": steps, "name": f"animate_view {directory}"})
+                if "error" in job:
+                    return job
+                return {
+                    "frames": len(frames),
+                    "directory": directory,
+                    "job_id": job["id"]
+                }
             
+            for view, path in zip(frames, paths):
+                self._check_interrupted()
+                with self.command_lock:
+                    cmd.set_view(view)
+                    cmd.png(path, width=width, height=height, ray=ray)
             return {
-                "path": file_path,
-                "message": reload_message
+                "frames": len(frames),
+                "directory": directory,
+                "files": [paths[0], paths[-1]]
             }
         except Exception as e:
             return {
-                "error": f"Error editing PDB file: {str(e)}"
+                "error": f"Error animating view: {str(e)}"
             }
     
-    def _get_pdb_content(self, pdb_file):
-        """Get the content of a PDB file"""
+    def _start_trace(self, req_data, received):
+        """
+        Begin the trace of a one-shot request
+        
+        The trace id comes from the request (the bridge derives it from the
+        JSON-RPC id) and falls back to the request id. Trace requests
+        themselves are not traced.
+        """
+        options = req_data if isinstance(req_data, dict) else {}
+        req_type = options.get("type", "execute_command")
+        if req_type == "trace":
+            return None
+        return {
+            "trace_id": str(options.get("trace_id") or options.get("request_id") or os.urandom(8).hex()),
+            "type": req_type,
+            "start": received,
+            "spans": []
+        }
+    
+    @contextlib.contextmanager
+    def _span(self, name, trace=None):
+        """Time a stage into a trace (by default the current request's)"""
+        if trace is None:
+            job = getattr(self._job_context, "job", None)
+            trace = job.get("trace") if job else None
+        if trace is None or len(trace["spans"]) >= TRACE_MAX_SPANS:
+            yield
+            return
+        start = time.time()
         try:
-            # Determine file path
-            if os.path.isabs(pdb_file):
-                # Absolute path provided
-                file_path = pdb_file
-            else:
-                # Use current working directory
-                cwd = os.getcwd()
-                file_path = os.path.join(cwd, pdb_file)
+            yield
+        finally:
+            trace["spans"].append((name, start, time.time()))
+    
+    def _finish_trace(self, trace, response):
+        """Close a trace and keep it in the ring buffer"""
+        trace["end"] = time.time()
+        trace["status"] = response.get("status") if isinstance(response, dict) else None
+        self.traces.append(trace)
+    
+    def _trace_report(self, req_data):
+        """
+        Recent request traces, newest first
+        
+        Selects by trace_id / trace_ids, or else traces of at least min_ms;
+        export writes the selection as a Chrome trace file.
+        """
+        try:
+            ids = req_data.get("trace_ids") or ([req_data["trace_id"]] if req_data.get("trace_id") else None)
+            min_ms = float(req_data.get("min_ms", 0.0 if ids else TRACE_SLOW_MS))
+            limit = int(req_data.get("limit") or (TRACE_KEEP if ids else 20))
             
-            # Read the file content
-            with open(file_path, 'r') as f:
-                content = f.read()
+            selected = []
+            for trace in reversed(list(self.traces)):
+                if ids and trace["trace_id"] not in ids:
+                    continue
+                if (trace["end"] - trace["start"]) * 1000 < min_ms:
+                    continue
+                selected.append(trace_summary(trace))
+                if len(selected) >= limit:
+                    break
             
-            return {
-                "path": file_path,
-                "content": content
-            }
+            result = {"traces": selected, "recorded": len(self.traces)}
+            if req_data.get("export"):
+                path = os.path.abspath(req_data["export"])
+                events = trace_events(selected, "pymol")
+                self._write_file_atomic(path, json.dumps({"traceEvents": events}).encode('utf-8'))
+                result["export"] = path
+            return result
         except Exception as e:
             return {
-                "error": f"Error reading PDB file: {str(e)}"
+                "error": f"Error reading traces: {str(e)}"
             }
     
-    def _list_pdb_files(self, directory=None):
-        """List PDB files in the specified directory"""
+    def _get_sequence_index(self):
+        """Return the sequence index, opening it on first use"""
+        with self.sequence_lock:
+            if self.sequence_index is None:
+                self.sequence_index = SequenceIndex(os.path.join(self.state_dir, "sequence_index.sqlite"))
+            return self.sequence_index
+    
+    def _index_sequences(self, directory=None, recursive=True):
+        """
+        Bring the sequence index up to date with a directory's structure files
+        
+        Only files that are new or whose mtime or size changed are read
+        (in the process pool when there are many); indexed files that
+        disappeared are dropped.
+        """
         try:
-            # Determine directory path
+            started = time.time()
             if directory:
-                if os.path.isabs(directory):
-                    dir_path = directory
-                else:
-                    cwd = os.getcwd()
-                    dir_path = os.path.join(cwd, directory)
+                dir_path = directory if os.path.isabs(directory) else os.path.join(os.getcwd(), directory)
             else:
                 dir_path = os.getcwd()
+            dir_path = os.path.abspath(dir_path)
+            if not os.path.isdir(dir_path):
+                return {"error": f"Directory not found: {dir_path}"}
             
-            # List PDB files
-            pdb_files = []
-            for file in os.listdir(dir_path):
-                if file.lower().endswith(('.pdb', '.cif')):
-                    file_path = os.path.join(dir_path, file)
-                    pdb_files.append({
-                        "name": file,
-                        "path": file_path,
-                        "size": os.path.getsize(file_path),
-                        "modified": os.path.getmtime(file_path)
-                    })
+            found = {}
+            for root, subdirs, files in os.walk(dir_path):
+                for file in files:
+                    if file.lower().endswith(STRUCTURE_EXTENSIONS):
+                        path = os.path.join(root, file)
+                        stat = os.stat(path)
+                        found[path] = (stat.st_mtime, stat.st_size)
+                if not recursive:
+                    break
+            
+            index = self._get_sequence_index()
+            with self.sequence_update_lock:
+                known = index.files_under(dir_path)
+                if not recursive:
+                    known = {path: stamp for path, stamp in known.items() if os.path.dirname(path) == dir_path}
+                changed = sorted(path for path, stamp in found.items() if known.get(path) != stamp)
+                removed = [path for path in known if path not in found]
+                
+                if len(changed) >= SEQUENCE_POOL_MIN:
+                    parsed = self._get_process_pool().map(_sequence_file_task, changed, chunksize=16)
+                else:
+                    parsed = map(_sequence_file_task, changed)
+                
+                failed = []
+                entries = []
+                for path, chains, error in parsed:
+                    if error is not None:
+                        failed.append({"path": path, "error": error})
+                        continue
+                    entries.append((path, found[path][0], found[path][1], chains))
+                    if len(entries) >= SEQUENCE_BATCH:
+                        self._check_interrupted()
+                        index.update(entries)
+                        entries = []
+                index.update(entries, removed)
             
             return {
                 "directory": dir_path,
-                "files": pdb_files
+                "files": len(found),
+                "indexed": len(changed) - len(failed),
+                "removed": len(removed),
+                "failed": failed[:20],
+                "index": index.stats(),
+                "elapsed": round(time.time() - started, 3)
             }
         except Exception as e:
             return {
-                "error": f"Error listing PDB files: {str(e)}"
-            }
\ No newline at end of file
+                "error": f"Error indexing sequences: {str(e)}"
+            }
+    
+    def _search_sequence(self, req_data):
+        """
+        Find a motif in the indexed chain sequences
+        
+        With directory, that directory is brought up to date first.
+        """
+        try:
+            motif = re.sub(r"\s+", "", str(req_data.get("sequence", ""))).upper()
+            max_mismatches = int(req_data.get("max_mismatches", 0))
+            if not motif:
+                return {"error": "No sequence specified"}
+            if not 0 <= max_mismatches < len(motif):
+                return {"error": "max_mismatches must be at least 0 and less than the sequence length"}
+            
+            result = {}
+            if req_data.get("directory"):
+                update = self._index_sequences(req_data["directory"], req_data.get("recursive", True))
+                if "error" in update:
+                    return update
+                result["update"] = update
+            
+            started = time.time()
+            hits, total, scanned = self._get_sequence_index().search(
+                motif, max_mismatches, int(req_data.get("limit", SEQUENCE_SEARCH_LIMIT))
+            )
+            result.update({
+                "sequence": motif,
+                "max_mismatches": max_mismatches,
+                "hits": hits,
+                "total": total,
+                "chains_scanned": scanned,
+                "elapsed": round(time.time() - started, 4)
+            })
+            return result
+        except Exception as e:
+            return {
+                "error": f"Error searching sequences: {str(e)}"
+            }
+
+
+def main(argv=None):
+    """
+    Run the MCP server in a headless PyMOL until it stops
+    
+    Used by the bridge's worker pool; each worker gets its own port and
+    state directory.
+    """
+    import argparse
+    
+    arg_parser = argparse.ArgumentParser(description="Headless PyMOL with the Claude MCP server")
+    arg_parser.add_argument("--host", default=DEFAULT_HOST)
+    arg_parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    arg_parser.add_argument("--state-dir", default=None)
+    args = arg_parser.parse_args(argv)
+    
+    import pymol
+    pymol.finish_launching(['pymol', '-cq'])
+    
+    plugin = ClaudePlugin(args.host, args.port, state_dir=args.state_dir)
+    plugin.start_mcp_server()
+    failed = False
+    try:
+        while plugin.running and plugin.server_thread.is_alive():
+            time.sleep(0.5)
+        # The accept loop exits on its own only when the port could not be bound
+        failed = plugin.running
+    except KeyboardInterrupt:
+        pass
+    
+    if plugin.running:
+        plugin.stop_mcp_server()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
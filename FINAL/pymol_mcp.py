@@ -9,44 +9,1637 @@ import socket
 import json
 import os
 import subprocess
+import base64
+import contextlib
+import threading
+import time
+import atexit
+from collections import deque
+from multiprocessing import shared_memory
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 # PyMOL server settings
 PYMOL_HOST = '127.0.0.1'
 PYMOL_PORT = 8090  # PyMOL's existing server port
+BUFFER_SIZE = 65536
+CONNECT_TIMEOUT = 5.0
+DEFAULT_TIMEOUT = float(os.environ.get("PYMOL_TIMEOUT", "300"))  # Per-command deadline in seconds
+RESPONSE_GRACE = 2.0  # Extra seconds to wait for PyMOL's own timeout response
+CLIENT_ID = f"mcp-bridge-{os.getpid()}"  # Identifies this bridge for PyMOL's rate limiting
+MESSAGE_TERMINATOR = b"\n\n"
+SHM_THRESHOLD = 1 << 20  # Frames of at least 1 MiB are pushed through shared memory
+TRACE_KEEP = 1000  # Finished requests kept in the trace ring buffer
+TRACE_SLOW_MS = 100.0  # Default threshold for the trace tool
+LOG_FLUSH_INTERVAL = 0.5  # Seconds between stderr log flushes
+TOOLS_RETRY_INTERVAL = 30.0  # Seconds between attempts to list macros while PyMOL is unreachable
+EVENT_TYPES = (
+    "object_loaded", "object_deleted",
+    "selection_created", "selection_deleted",
+    "view_changed", "state_count_changed"
+)
+
+# Responses and relayed notifications are written from several threads
+_stdout_lock = threading.Lock()
+_subscription = {"client": None, "thread": None}
+
+# JSON-RPC id -> (plugin request id, port) for tool calls still running in PyMOL
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+# Request traces: finished traces (oldest first) and the trace of the
+# message each thread is processing
+_traces = deque(maxlen=TRACE_KEEP)
+_trace_context = threading.local()
+
+# Log lines waiting to be written to stderr
+_log_lines = []
+_log_lock = threading.Lock()
+
+# JSON-RPC error code for tool calls that ran out of time in PyMOL
+TIMEOUT_ERROR = -32001
+
+# Headless worker pool settings
+WORKER_COUNT = max(1, int(os.environ.get("PYMOL_WORKERS", "2")))
+WORKER_BASE_PORT = int(os.environ.get("PYMOL_WORKER_BASE_PORT", "8100"))
+WORKER_PYTHON = os.environ.get("PYMOL_WORKER_PYTHON", sys.executable)
+WORKER_SCRIPT = os.environ.get(
+    "PYMOL_WORKER_SCRIPT",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "claude_plugin", "pymol_claude.py")
+)
+WORKER_STATE_DIR = os.environ.get(
+    "PYMOL_WORKER_STATE_DIR",
+    os.path.join(os.path.expanduser("~"), ".pymol", "claude_workers")
+)
+WORKER_START_TIMEOUT = 60.0  # Seconds a new worker has to answer its first ping
+WORKER_START_ATTEMPTS = 3  # Failed starts in a row before a worker is given up on
+WORKER_READY_WAIT = 30.0  # Seconds a request waits for a worker that is still starting
+HEALTH_INTERVAL = 5.0  # Seconds between health-check pings
+HEALTH_FAILURES = 3  # Consecutive failed pings before a worker is restarted
+
+# Struct formats used to view shared arrays when NumPy is not installed
+_DTYPE_FORMATS = {
+    "<f4": "f", "<f8": "d", "<i4": "i", "<i8": "q",
+    "<u4": "I", "<u8": "Q", "|u1": "B", "|i1": "b"
+}
+
+def log(line):
+    """Queue a line for stderr; lines are written in batches by flush_log"""
+    with _log_lock:
+        _log_lines.append(line + "\n")
+
+def flush_log():
+    """Write queued log lines to stderr"""
+    with _log_lock:
+        if not _log_lines:
+            return
+        text = "".join(_log_lines)
+        _log_lines.clear()
+    try:
+        sys.stderr.write(text)
+        sys.stderr.flush()
+    except (OSError, ValueError):
+        pass
+
+def _flush_log_periodically():
+    """Flush the stderr log every LOG_FLUSH_INTERVAL seconds"""
+    while True:
+        time.sleep(LOG_FLUSH_INTERVAL)
+        flush_log()
+
+def start_trace(message, received):
+    """
+    Begin the trace of a JSON-RPC request
+    
+    The trace id is minted from the JSON-RPC id and travels with every
+    request sent to PyMOL while the message is processed, so both sides'
+    spans can be matched up. Notifications and trace calls are not traced.
+    """
+    if message.get("id") is None:
+        return None
+    name = message.get("method")
+    if name in ("tools/call", "tools/execute"):
+        name = (message.get("params") or {}).get("name") or name
+    if name == "trace":
+        return None
+    trace = {
+        "trace_id": f"{CLIENT_ID}-{message['id']}",
+        "type": name,
+        "start": received,
+        "spans": []
+    }
+    record_span("stdin", received, time.time(), trace)
+    return trace
+
+def record_span(name, begin, end, trace=None):
+    """Add a timed stage to a trace (by default the current thread's)"""
+    trace = trace or getattr(_trace_context, "trace", None)
+    if trace is not None:
+        trace["spans"].append((name, begin, end))
+
+@contextlib.contextmanager
+def span(name):
+    """Time a stage of the current thread's trace"""
+    if getattr(_trace_context, "trace", None) is None:
+        yield
+        return
+    begin = time.time()
+    try:
+        yield
+    finally:
+        record_span(name, begin, time.time())
+
+def finish_trace(trace, response):
+    """Close a trace and keep it in the ring buffer"""
+    trace["end"] = time.time()
+    if not response:
+        trace["status"] = None
+    elif "error" in response:
+        trace["status"] = "error"
+    else:
+        result = response.get("result")
+        trace["status"] = result.get("status", "success") if isinstance(result, dict) else "success"
+    _traces.append(trace)
+
+def trace_summary(trace):
+    """Relative-time view of a recorded trace: offsets and durations in ms"""
+    start = trace["start"]
+    return {
+        "trace_id": trace["trace_id"],
+        "type": trace["type"],
+        "status": trace["status"],
+        "start": start,
+        "total_ms": round((trace["end"] - start) * 1000, 3),
+        "spans": [
+            {"name": name, "offset_ms": round((begin - start) * 1000, 3), "ms": round((end - begin) * 1000, 3)}
+            for name, begin, end in trace["spans"]
+        ]
+    }
+
+def trace_events(summaries, process, rows):
+    """Chrome trace events for trace summaries, one row per trace id"""
+    events = []
+    for summary in summaries:
+        start_us = summary["start"] * 1e6
+        common = {
+            "ph": "X", "pid": process, "tid": rows.get(summary["trace_id"], 0),
+            "args": {"trace_id": summary["trace_id"], "status": summary["status"]}
+        }
+        events.append(dict(common, name=summary["type"], ts=start_us, dur=summary["total_ms"] * 1000))
+        for item in summary["spans"]:
+            events.append(dict(common, name=item["name"], ts=start_us + item["offset_ms"] * 1000, dur=item["ms"] * 1000))
+    return events
+
+def get_traces(trace_id=None, min_ms=None, limit=20, export=None):
+    """
+    Recent request traces, newest first, with PyMOL's side attached
+    
+    Bridge spans cover stdin parsing, socket connect, send, wait and
+    decode, and the reply; the spans PyMOL recorded under the same trace
+    id (lane queue, command lock, cmd.do, serialization) are listed under
+    "pymol". export writes both processes to one Chrome trace file.
+    """
+    if min_ms is None:
+        min_ms = 0.0 if trace_id else TRACE_SLOW_MS
+    selected = []
+    for trace in reversed(list(_traces)):
+        if trace_id and trace["trace_id"] != trace_id:
+            continue
+        if (trace["end"] - trace["start"]) * 1000 < float(min_ms):
+            continue
+        selected.append(trace_summary(trace))
+        if len(selected) >= int(limit):
+            break
+    
+    pymol_traces = []
+    if selected:
+        response = send_request_to_pymol(
+            {"type": "trace", "trace_ids": [summary["trace_id"] for summary in selected]},
+            timeout=CONNECT_TIMEOUT
+        )
+        if response.get("status") == "success":
+            pymol_traces = (response.get("data") or {}).get("traces", [])
+    for summary in selected:
+        summary["pymol"] = [item for item in pymol_traces if item["trace_id"] == summary["trace_id"]]
+    
+    result = {
+        "status": "success",
+        "message": f"{len(selected)} traces of {len(_traces)} recorded",
+        "traces": selected
+    }
+    if export:
+        rows = {summary["trace_id"]: row for row, summary in enumerate(selected)}
+        events = trace_events(selected, "bridge", rows) + trace_events(pymol_traces, "pymol", rows)
+        path = os.path.abspath(export)
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events}, f)
+        result["export"] = path
+    return result
 
-def send_command_to_pymol(command):
-    """Send a command to PyMOL's socket server"""
+def send_request_to_pymol(payload, timeout=30.0, port=None):
+    """
+    Send a request to PyMOL's socket server and return its response
+    
+    If no response arrives within `timeout` seconds the request is cancelled
+    in PyMOL (when it carries a request_id) and a "timeout" status returned.
+    `port` selects a pool worker instead of the interactive PyMOL.
+    """
     try:
-        # Create socket connection to PyMOL
         client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        client.settimeout(5.0)  # 5 second timeout for connection
-        client.connect((PYMOL_HOST, PYMOL_PORT))
+        client.settimeout(CONNECT_TIMEOUT)
+        with span("connect"):
+            client.connect((PYMOL_HOST, port or PYMOL_PORT))
+        client.settimeout(timeout)
         
-        # Create request payload
-        payload = {
-            "type": "execute_command",
-            "command": command
-        }
+        try:
+            payload.setdefault("client", CLIENT_ID)
+            trace = getattr(_trace_context, "trace", None)
+            if trace is not None:
+                payload.setdefault("trace_id", trace["trace_id"])
+            with span("send"):
+                request_str = json.dumps(payload) + "\n\n"
+                client.sendall(request_str.encode('utf-8'))
+            
+            # The plugin closes the connection after writing the response
+            waiting = first = time.time()
+            chunks = []
+            while True:
+                chunk = client.recv(BUFFER_SIZE)
+                if not chunks:
+                    first = time.time()
+                if not chunk:
+                    break
+                chunks.append(chunk)
+            record_span("wait", waiting, first)
+            record_span("receive", first, time.time())
+        finally:
+            client.close()
         
-        # Send the request
-        request_str = json.dumps(payload) + "\n\n"
-        client.sendall(request_str.encode('utf-8'))
+        with span("decode"):
+            return json.loads(b"".join(chunks).decode('utf-8'))
+    
+    except socket.timeout:
+        if payload.get("request_id") and payload.get("type") != "cancel":
+            cancel_pymol_request(payload["request_id"], port)
+        return {
+            "status": "timeout",
+            "message": f"No response from PyMOL within {timeout} seconds",
+            "data": {"request_id": payload.get("request_id")}
+        }
         
-        # PyMOL doesn't respond properly, so we'll close immediately
+    except Exception as e:
+        return {
+            "status": "error",
+            "message": f"Error sending request to PyMOL: {str(e)}",
+            "data": None
+        }
+
+def read_message(client, pending=b""):
+    """Read one message from a persistent PyMOL connection"""
+    while MESSAGE_TERMINATOR not in pending:
+        chunk = client.recv(BUFFER_SIZE)
+        if not chunk:
+            return None, b""
+        pending += chunk
+    data, _, pending = pending.partition(MESSAGE_TERMINATOR)
+    return json.loads(data.decode('utf-8')), pending
+
+def write_message(message):
+    """Write one JSON-RPC message to stdout"""
+    with _stdout_lock:
+        sys.stdout.write(json.dumps(message) + '\n')
+        sys.stdout.flush()
+
+def subscribe_to_pymol_events(events=None, interval=0.5):
+    """
+    Subscribe to PyMOL change events and relay them as MCP notifications
+    
+    Replaces any existing subscription. Events arrive in debounced batches
+    and are written to stdout as notifications/pymol/events messages.
+    """
+    unsubscribe_from_pymol_events()
+    
+    client = socket.create_connection((PYMOL_HOST, PYMOL_PORT), timeout=5.0)
+    request = {"type": "subscribe", "interval": interval}
+    if events:
+        request["events"] = events
+    client.sendall(json.dumps(request).encode('utf-8') + MESSAGE_TERMINATOR)
+    
+    response, pending = read_message(client)
+    if response is None or response.get("status") != "success":
         client.close()
+        return response or {
+            "status": "error",
+            "message": "PyMOL closed the subscription connection",
+            "data": None
+        }
+    
+    # Event batches may be far apart, so only the handshake has a timeout
+    client.settimeout(None)
+    thread = threading.Thread(target=_relay_events, args=(client, pending))
+    thread.daemon = True
+    _subscription.update(client=client, thread=thread)
+    thread.start()
+    return response
+
+def unsubscribe_from_pymol_events():
+    """Close the current event subscription, if any"""
+    client = _subscription.get("client")
+    _subscription.update(client=None, thread=None)
+    if client is None:
+        return False
+    try:
+        client.sendall(json.dumps({"type": "unsubscribe"}).encode('utf-8') + MESSAGE_TERMINATOR)
+    except OSError:
+        pass
+    client.close()
+    return True
+
+def _relay_events(client, pending):
+    """Forward event batches from PyMOL to the MCP client"""
+    try:
+        while True:
+            message, pending = read_message(client, pending)
+            if message is None:
+                break
+            if message.get("type") == "events":
+                write_message({
+                    "jsonrpc": "2.0",
+                    "method": "notifications/pymol/events",
+                    "params": {
+                        "time": message.get("time"),
+                        "events": message.get("events", [])
+                    }
+                })
+    except (OSError, ValueError):
+        pass
+    finally:
+        if _subscription.get("client") is client:
+            _subscription.update(client=None, thread=None)
+        log("PyMOL event subscription closed")
+
+def _attach_shared_memory(name):
+    """Attach to an existing shared-memory segment without taking ownership"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 registers every attach with the resource tracker,
+        # which would unlink the segment when this process exits
+        shm = shared_memory.SharedMemory(name=name)
+        try:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, "shared_memory")
+        except Exception:
+            pass
+        return shm
+
+@contextlib.contextmanager
+def shared_array(descriptor, release=True):
+    """
+    Yield the array behind a descriptor returned by the PyMOL plugin
+    
+    Shared-memory arrays are yielded as zero-copy views (a NumPy array, or a
+    flat memoryview when NumPy is not installed) and must be copied if kept
+    past the with block. With release=True the plugin is told to unlink the
+    segment afterwards instead of waiting for its lifetime to expire.
+    """
+    dtype = descriptor.get("dtype", "<f4")
+    shape = tuple(descriptor.get("shape", ()))
+    
+    if "shm" not in descriptor:
+        data = base64.b64decode(descriptor.get("data", ""))
+        if np is not None:
+            yield np.frombuffer(data, dtype=dtype).reshape(shape)
+        else:
+            yield memoryview(data).cast(_DTYPE_FORMATS[dtype])
+        return
+    
+    shm = _attach_shared_memory(descriptor["shm"])
+    view = None
+    try:
+        if np is not None:
+            view = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        else:
+            view = shm.buf[:descriptor.get("nbytes", shm.size)].cast(_DTYPE_FORMATS[dtype])
+        yield view
+    finally:
+        if isinstance(view, memoryview):
+            view.release()
+        del view
+        try:
+            shm.close()
+        except BufferError:
+            pass
+        if release:
+            send_request_to_pymol({"type": "release_shared", "name": descriptor["shm"]})
+
+def share_array(buffer, dtype, shape):
+    """
+    Copy a buffer into a new shared-memory segment for the PyMOL plugin
+    
+    Returns the descriptor to send and the segment itself. The caller owns
+    the segment and must close() and unlink() it once PyMOL has answered.
+    """
+    data = memoryview(buffer).cast("B")
+    shm = shared_memory.SharedMemory(create=True, size=max(data.nbytes, 1))
+    shm.buf[:data.nbytes] = data
+    
+    descriptor = {
+        "dtype": dtype,
+        "shape": list(shape),
+        "shm": shm.name,
+        "nbytes": data.nbytes
+    }
+    return descriptor, shm
+
+def send_request_with_deadline(payload, timeout=None, request_id=None, port=None):
+    """
+    Send a request carrying a request_id and deadline to PyMOL
+    
+    The deadline travels with the request, so PyMOL drops it if it is still
+    queued when time runs out, and the request_id lets it be cancelled. A
+    busy or rate-limited PyMOL is retried while the deadline allows.
+    """
+    timeout = DEFAULT_TIMEOUT if timeout is None else float(timeout)
+    deadline = time.time() + timeout
+    payload = dict(payload, request_id=request_id or os.urandom(8).hex())
+    
+    while True:
+        remaining = max(deadline - time.time(), 0.0)
+        payload["timeout"] = remaining
+        response = send_request_to_pymol(payload, timeout=remaining + RESPONSE_GRACE, port=port)
         
+        # PyMOL refused the request for now; retry while the deadline allows
+        retry_after = (response.get("data") or {}).get("retry_after")
+        if response.get("status") not in ("busy", "rate_limited") or retry_after is None:
+            return response
+        if time.time() + retry_after >= deadline:
+            return response
+        time.sleep(retry_after)
+
+def send_command_to_pymol(command, timeout=None, request_id=None, port=None):
+    """
+    Send a command to PyMOL's socket server and wait for its output
+    
+    The status is "timeout" or "cancelled" (rather than "error") when the
+    command did not finish for those reasons.
+    """
+    response = send_request_with_deadline(
+        {"type": "execute_command", "command": command},
+        timeout,
+        request_id,
+        port
+    )
+    
+    status = response.get("status", "error")
+    data = response.get("data") or {}
+    
+    if status == "success":
         return {
             "status": "success",
-            "message": f"Command sent to PyMOL: {command}",
-            "output": "Command executed successfully"
+            "message": f"Command executed in PyMOL: {command}",
+            "output": data.get("output", "")
+        }
+    
+    result = {
+        "status": status,
+        "message": response.get("message", ""),
+        "output": data.get("output", f"Error: {response.get('message', '')}")
+    }
+    if "retry_after" in data:
+        result["retry_after"] = data["retry_after"]
+    return result
+
+def cancel_pymol_request(request_id, port=None):
+    """Ask PyMOL to cancel a queued or running request"""
+    return send_request_to_pymol(
+        {"type": "cancel", "request_id": request_id},
+        timeout=CONNECT_TIMEOUT,
+        port=port
+    )
+
+class TrajectoryStream:
+    """
+    Push coordinate frames into an existing PyMOL object as new states
+    
+    Opens a persistent trajectory session with the plugin. Every push()
+    blocks while `window` frames are still unacknowledged, so a producer
+    never runs further ahead of PyMOL than that.
+    
+    Example:
+        with TrajectoryStream("md", max_states=500, stride=2) as stream:
+            for frame in frames:
+                stream.push(frame)
+    """
+    
+    def __init__(self, object_name, stride=1, max_states=0, window=8,
+                 decimate=False, follow=True, timeout=30.0):
+        self.object_name = object_name
+        self.options = {
+            "stride": stride,
+            "max_states": max_states,
+            "window": window,
+            "decimate": decimate,
+            "follow": follow
         }
+        self.timeout = timeout
+        self.client = None
+        self.session = None
+        self.summary = None
+        self.seq = 0
+        self.in_flight = {}  # seq -> shared segment (or None for inline frames)
+        self._pending = b""
+    
+    def __enter__(self):
+        self.open()
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+    
+    def open(self):
+        """Open the session; raises RuntimeError if PyMOL refuses it"""
+        self.client = socket.create_connection((PYMOL_HOST, PYMOL_PORT), timeout=self.timeout)
+        self._send(dict(self.options, type="trajectory_open", object=self.object_name))
+        response = self._receive()
+        if response is None or response.get("status") != "success":
+            message = response.get("message") if response else "connection closed"
+            self.client.close()
+            raise RuntimeError(f"Could not open trajectory session: {message}")
+        self.session = response["data"]
+        self.options["window"] = self.session["window"]
+        return self.session
+    
+    def push(self, buffer, dtype="<f4"):
+        """Send one (n_atoms, 3) frame, waiting for room in the window first"""
+        while len(self.in_flight) >= self.options["window"]:
+            self._wait_for_ack()
         
-    except Exception as e:
+        self.seq += 1
+        shape = (self.session["n_atoms"], 3)
+        data = memoryview(buffer).cast("B")
+        segment = None
+        if data.nbytes >= SHM_THRESHOLD:
+            descriptor, segment = share_array(data, dtype, shape)
+        else:
+            descriptor = {
+                "dtype": dtype,
+                "shape": list(shape),
+                "encoding": "base64",
+                "data": base64.b64encode(data).decode('ascii')
+            }
+        
+        self.in_flight[self.seq] = segment
+        self._send({"type": "trajectory_frame", "seq": self.seq, "coords": descriptor})
+        return self.seq
+    
+    def close(self):
+        """Drain outstanding acknowledgements and close the session"""
+        if self.client is None:
+            return self.summary
+        try:
+            while self.in_flight:
+                self._wait_for_ack()
+            self._send({"type": "trajectory_close"})
+            while True:
+                message = self._receive()
+                if message is None or "status" in message:
+                    self.summary = message
+                    break
+        finally:
+            self.client.close()
+            self.client = None
+            for seq in list(self.in_flight):
+                self._release(seq)
+        return self.summary
+    
+    def _wait_for_ack(self):
+        message = self._receive()
+        if message is None:
+            raise RuntimeError("Trajectory session closed by PyMOL")
+        if "status" in message:
+            # Final summary sent early because the session failed
+            self.summary = message
+            raise RuntimeError(message.get("message", "Trajectory session failed"))
+        self._release(message.get("seq"))
+        if message.get("error"):
+            raise RuntimeError(message["error"])
+    
+    def _release(self, seq):
+        segment = self.in_flight.pop(seq, None)
+        if segment is not None:
+            segment.close()
+            segment.unlink()
+    
+    def _send(self, message):
+        self.client.sendall(json.dumps(message).encode('utf-8') + MESSAGE_TERMINATOR)
+    
+    def _receive(self):
+        message, self._pending = read_message(self.client, self._pending)
+        return message
+
+def stream_contact_map(selection, selection2=None, **options):
+    """
+    Yield a streamed contact map: the header first, then each row chunk
+    
+    Chunks are contact_rows messages holding array descriptors (a dense
+    `matrix` band, or `rows`/`cols`/`distances` with a cutoff); read them
+    with shared_array(). Raises RuntimeError if PyMOL reports an error.
+    """
+    request = dict(options, type="contact_map", selection=selection, stream=True)
+    if selection2:
+        request["selection2"] = selection2
+    
+    client = socket.create_connection((PYMOL_HOST, PYMOL_PORT), timeout=CONNECT_TIMEOUT)
+    try:
+        client.settimeout(None)
+        client.sendall(json.dumps(request).encode('utf-8') + MESSAGE_TERMINATOR)
+        pending = b""
+        while True:
+            message, pending = read_message(client, pending)
+            if message is None:
+                raise RuntimeError("Contact map stream closed by PyMOL")
+            if message.get("status") == "error":
+                raise RuntimeError(message.get("message", "Contact map failed"))
+            if message.get("message") == "Contact map complete":
+                return
+            yield message.get("data") if "status" in message else message
+    finally:
+        client.close()
+
+class PyMOLWorkerPool:
+    """
+    Headless PyMOL processes, each running the plugin server on its own port
+    
+    Stateless work goes to the least busy healthy worker; work tagged with a
+    session always goes to the worker that session was first assigned to, so
+    objects it loaded are still there. Workers start in the background; a
+    monitor thread pings every worker and restarts those that exited or
+    stopped answering, until one fails to start WORKER_START_ATTEMPTS times
+    in a row (its port is taken, say) and is given up on.
+    
+    Example:
+        pool = PyMOLWorkerPool(4)
+        pool.start()
+        with pool.acquire(session="poses") as lease:
+            send_command_to_pymol("load poses.sdf", port=lease["port"])
+    """
+    
+    def __init__(self, size=WORKER_COUNT, base_port=WORKER_BASE_PORT, state_dir=WORKER_STATE_DIR):
+        self.state_dir = state_dir
+        self.workers = [
+            {
+                "index": i,
+                "port": base_port + i,
+                "process": None,
+                "log": None,
+                "healthy": False,
+                "failures": 0,
+                "active": 0,
+                "restarts": 0,
+                "generation": 0,
+                "starting": False,
+                "start_failures": 0,
+                "given_up": False,
+                "ping_ms": None
+            }
+            for i in range(size)
+        ]
+        self.sessions = {}  # session -> (worker index, worker generation)
+        self.condition = threading.Condition()
+        self.running = False
+        self.monitor_thread = None
+    
+    def start(self):
+        """Start every worker in the background; acquire() waits for them"""
+        if self.running:
+            return
+        self.running = True
+        for worker in self.workers:
+            worker["starting"] = True
+            threading.Thread(target=self._launch, args=(worker,), daemon=True).start()
+        
+        self.monitor_thread = threading.Thread(target=self._monitor)
+        self.monitor_thread.daemon = True
+        self.monitor_thread.start()
+    
+    def stop(self):
+        """Terminate every worker"""
+        self.running = False
+        for worker in self.workers:
+            self._terminate(worker)
+    
+    @contextlib.contextmanager
+    def acquire(self, session=None, wait=WORKER_READY_WAIT):
+        """
+        Yield a lease on a worker: {"port", "worker", "restarted"}
+        
+        Waits up to `wait` seconds for a worker that is still starting.
+        "restarted" is True when the session's worker was restarted since
+        the session last used it, or was unhealthy so the session moved to
+        another worker; either way anything it loaded there is gone.
+        """
+        deadline = time.time() + wait
+        with self.condition:
+            while True:
+                healthy = [worker for worker in self.workers if worker["healthy"]]
+                if healthy:
+                    break
+                if all(worker["given_up"] for worker in self.workers):
+                    raise RuntimeError(
+                        f"No PyMOL worker could be started after {WORKER_START_ATTEMPTS} attempts each; "
+                        f"see worker.log under {self.state_dir}"
+                    )
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise RuntimeError("No healthy PyMOL workers")
+                self.condition.wait(remaining)
+            
+            restarted = False
+            bound_worker = None
+            if session is not None and session in self.sessions:
+                index, generation = self.sessions[session]
+                bound_worker = self.workers[index]
+                restarted = generation != bound_worker["generation"] or not bound_worker["healthy"]
+            
+            if bound_worker is not None and bound_worker["healthy"]:
+                worker = bound_worker
+            else:
+                # Idle workers first, then the one with the fewest sessions
+                bound = {}
+                for index, _ in self.sessions.values():
+                    bound[index] = bound.get(index, 0) + 1
+                worker = min(healthy, key=lambda w: (w["active"], bound.get(w["index"], 0), w["index"]))
+            
+            if session is not None:
+                self.sessions[session] = (worker["index"], worker["generation"])
+            worker["active"] += 1
+        
+        try:
+            yield {"port": worker["port"], "worker": worker["index"], "restarted": restarted}
+        finally:
+            with self.condition:
+                worker["active"] -= 1
+                self.condition.notify_all()
+    
+    def release_session(self, session):
+        """Forget a session's worker binding; returns False if it had none"""
+        with self.condition:
+            return self.sessions.pop(session, None) is not None
+    
+    def status(self):
+        """Return a summary of every worker"""
+        with self.condition:
+            sessions = {}
+            for session, (index, _) in self.sessions.items():
+                sessions.setdefault(index, []).append(session)
+            return [
+                {
+                    "worker": worker["index"],
+                    "port": worker["port"],
+                    "pid": worker["process"].pid if worker["process"] else None,
+                    "healthy": worker["healthy"],
+                    "starting": worker["starting"],
+                    "given_up": worker["given_up"],
+                    "active": worker["active"],
+                    "sessions": sorted(sessions.get(worker["index"], [])),
+                    "restarts": worker["restarts"],
+                    "ping_ms": worker["ping_ms"]
+                }
+                for worker in self.workers
+            ]
+    
+    def _spawn(self, worker):
+        state_dir = os.path.join(self.state_dir, f"worker-{worker['index']}")
+        os.makedirs(state_dir, exist_ok=True)
+        # Worker output must never reach stdout, which carries the MCP protocol
+        worker["log"] = open(os.path.join(state_dir, "worker.log"), "ab")
+        worker["process"] = subprocess.Popen(
+            [WORKER_PYTHON, WORKER_SCRIPT, "--port", str(worker["port"]), "--state-dir", state_dir],
+            stdin=subprocess.DEVNULL,
+            stdout=worker["log"],
+            stderr=subprocess.STDOUT
+        )
+        worker["failures"] = 0
+    
+    def _wait_ready(self, worker):
+        deadline = time.time() + WORKER_START_TIMEOUT
+        while self.running and time.time() < deadline:
+            if worker["process"].poll() is not None:
+                break
+            if self._ping(worker):
+                return True
+            time.sleep(0.25)
+        log(f"PyMOL worker {worker['index']} on port {worker['port']} did not start")
+        return False
+    
+    def _ping(self, worker):
+        started = time.time()
+        response = send_request_to_pymol({"type": "ping"}, timeout=CONNECT_TIMEOUT, port=worker["port"])
+        ok = response.get("status") == "success"
+        with self.condition:
+            worker["healthy"] = ok
+            worker["ping_ms"] = round((time.time() - started) * 1000, 1) if ok else None
+            self.condition.notify_all()
+        return ok
+    
+    def _terminate(self, worker):
+        process = worker["process"]
+        with self.condition:
+            worker["healthy"] = False
+        if process is not None and process.poll() is None:
+            process.terminate()
+            try:
+                process.wait(timeout=5.0)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+        if worker["log"] is not None:
+            worker["log"].close()
+            worker["log"] = None
+    
+    def _launch(self, worker):
+        """Spawn a worker and wait for it, giving up after repeated failed starts"""
+        if not self.running:
+            return False
+        try:
+            self._spawn(worker)
+            ready = self._wait_ready(worker)
+        except OSError as e:
+            log(f"PyMOL worker {worker['index']} could not be spawned: {e}")
+            ready = False
+        with self.condition:
+            worker["starting"] = False
+            worker["start_failures"] = 0 if ready else worker["start_failures"] + 1
+            if worker["start_failures"] >= WORKER_START_ATTEMPTS:
+                worker["given_up"] = True
+                log(f"Giving up on PyMOL worker {worker['index']} after {worker['start_failures']} failed starts")
+            self.condition.notify_all()
+        return ready
+    
+    def _restart(self, worker, reason):
+        log(f"Restarting PyMOL worker {worker['index']}: {reason}")
+        self._terminate(worker)
+        with self.condition:
+            worker["restarts"] += 1
+            worker["generation"] += 1
+            worker["starting"] = True
+        self._launch(worker)
+    
+    def _monitor(self):
+        while self.running:
+            time.sleep(HEALTH_INTERVAL)
+            restarts = []
+            for worker in self.workers:
+                if not self.running:
+                    break
+                if worker["starting"] or worker["given_up"]:
+                    continue
+                if worker["process"] is None or worker["process"].poll() is not None:
+                    code = worker["process"].returncode if worker["process"] else None
+                    restarts.append((worker, f"exited with code {code}"))
+                elif self._ping(worker):
+                    worker["failures"] = 0
+                else:
+                    worker["failures"] += 1
+                    if worker["failures"] >= HEALTH_FAILURES:
+                        restarts.append((worker, f"{worker['failures']} failed pings"))
+            
+            # Restart side by side so one slow start does not hold up the others
+            threads = [
+                threading.Thread(target=self._restart, args=restart, daemon=True)
+                for restart in restarts
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+_worker_pool = None
+_worker_pool_lock = threading.Lock()
+
+def get_worker_pool():
+    """Return the bridge's worker pool, starting it (in the background) on first use"""
+    global _worker_pool
+    with _worker_pool_lock:
+        if _worker_pool is None:
+            _worker_pool = PyMOLWorkerPool()
+            _worker_pool.start()
+            atexit.register(_worker_pool.stop)
+        return _worker_pool
+
+def run_command_in_worker(command, session=None, timeout=None, request_id=None):
+    """
+    Run a command in a pool worker and wait for its output
+    
+    Without a session any idle worker is used; with one, every command for
+    that session runs in the same worker.
+    """
+    pool = get_worker_pool()
+    try:
+        with pool.acquire(session) as lease:
+            if request_id:
+                with _inflight_lock:
+                    for key, (inflight_id, _) in list(_inflight.items()):
+                        if inflight_id == request_id:
+                            _inflight[key] = (request_id, lease["port"])
+            result = send_command_to_pymol(command, timeout, request_id, port=lease["port"])
+    except RuntimeError as e:
+        # No worker is available (still starting, or given up on)
+        return {"status": "error", "message": str(e), "data": None}
+    
+    result["worker"] = lease["worker"]
+    if lease["restarted"]:
+        result["message"] += f" (the session's worker was restarted or replaced by worker {lease['worker']}; earlier session state was lost)"
+    return result
+
+def send_job_request(request_type, **fields):
+    """
+    Send a batch job request (submit_job, job_status, list_jobs, cancel_job
+    or resume_job) to PyMOL
+    
+    Jobs live in PyMOL's state directory, so their ids stay valid across
+    bridge restarts and reconnects.
+    """
+    payload = {"type": request_type}
+    payload.update({key: value for key, value in fields.items() if value is not None})
+    response = send_request_to_pymol(payload, timeout=CONNECT_TIMEOUT * 6)
+    data = response.get("data")
+    if response.get("status") == "success" and isinstance(data, dict) and "error" in data:
+        return {"status": "error", "message": data["error"], "data": None}
+    return response
+
+def send_animation_request(arguments, request_id=None):
+    """
+    Ask PyMOL to animate the view through keyframes
+    
+    Playback and rendering run inside PyMOL and answer once, when the last
+    frame is done (or at once with a job id when background is set), so the
+    request carries the usual per-command deadline.
+    """
+    arguments = dict(arguments)
+    timeout = arguments.pop("timeout", None)
+    payload = {"type": "animate_view"}
+    payload.update(arguments)
+    response = send_request_with_deadline(payload, timeout, request_id)
+    data = response.get("data")
+    if response.get("status") == "success" and isinstance(data, dict) and "error" in data:
+        return {"status": "error", "message": data["error"], "data": None}
+    return response
+
+def send_sequence_search(arguments):
+    """
+    Search the sequence index of PyMOL's local structure files
+    
+    When a directory is given PyMOL first indexes the files in it that are
+    new or changed, which can take a while the first time.
+    """
+    payload = {"type": "search_sequence"}
+    payload.update(arguments)
+    response = send_request_to_pymol(payload, timeout=DEFAULT_TIMEOUT)
+    data = response.get("data")
+    if response.get("status") == "success" and isinstance(data, dict) and "error" in data:
+        return {"status": "error", "message": data["error"], "data": None}
+    return response
+
+def list_macro_tools():
+    """
+    Describe each macro defined in PyMOL as an MCP tool named macro_<name>
+    
+    Returns None when PyMOL cannot be reached, so tools/list still works
+    without it.
+    """
+    response = send_request_to_pymol({"type": "list_macros"}, timeout=CONNECT_TIMEOUT)
+    if response.get("status") != "success":
+        return None
+    macros = (response.get("data") or {}).get("macros", [])
+    
+    tools = []
+    for macro in macros:
+        tools.append({
+            "name": f"macro_{macro['name']}",
+            "description": macro.get("description") or f"Run the PyMOL macro {macro['name']}",
+            "inputSchema": {
+                "type": "object",
+                "properties": {
+                    param: {"type": "string", "description": f"Value for ${param}"}
+                    for param in macro["params"]
+                },
+                "required": [param for param in macro["params"] if param not in macro["defaults"]],
+                "additionalProperties": False
+            }
+        })
+    return tools
+
+def send_macro_request(request_type, request_id=None, **fields):
+    """
+    Send a macro request (define_macro, run_macro, list_macros, delete_macro) to PyMOL
+    
+    run_macro carries a request_id and the per-command deadline, like
+    send_command_to_pymol.
+    """
+    payload = {"type": request_type}
+    payload.update({key: value for key, value in fields.items() if value is not None})
+    if request_type == "run_macro":
+        response = send_request_with_deadline(payload, request_id=request_id)
+    else:
+        response = send_request_to_pymol(payload, timeout=CONNECT_TIMEOUT * 6)
+    data = response.get("data")
+    if response.get("status") == "success" and isinstance(data, dict) and "error" in data:
+        return {"status": "error", "message": data["error"], "data": None}
+    return response
+
+# Tools handled by the bridge itself; typed cmd tools and macro tools are
+# added in list_tools()
+BRIDGE_TOOLS = [
+    {
+        "name": "send_command",
+        "description": "Send a command to PyMOL",
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "command": {
+                    "type": "string",
+                    "description": "PyMOL command to execute"
+                },
+                "timeout": {
+                    "type": "number",
+                    "description": f"Seconds before the command is abandoned (default: {DEFAULT_TIMEOUT:g})"
+                }
+            },
+            "required": ["command"],
+            "additionalProperties": False
+        }
+    },
+    {
+        "name": "subscribe_events",
+        "description": "Receive PyMOL change notifications (notifications/pymol/events) instead of polling the state",
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "events": {
+                    "type": "array",
+                    "items": {"type": "string", "enum": list(EVENT_TYPES)},
+                    "description": "Event types to receive (default: all)"
+                },
+                "interval": {
+                    "type": "number",
+                    "description": "Minimum seconds between notification batches (default: 0.5)"
+                }
+            },
+            "additionalProperties": False
+        }
+    },
+    {
+        "name": "unsubscribe_events",
+        "description": "Stop PyMOL change notifications",
+        "inputSchema": {
+            "type": "object",
+            "properties": {},
+            "additionalProperties": False
+        }
+    },
+    {
+        "name": "define_macro",
+        "description": "Define (or replace) a named PyMOL command sequence with $parameters, stored in PyMOL and exposed as a macro_<name> tool",
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "name": {
+                    "type": "string",
+                    "description": "Macro name (letters, digits, _ and -)"
+                },
+                "commands": {
+                    "type": "array",
+                    "items": {"type": "string"},
+                    "description": "PyMOL commands; $param or ${param} marks a parameter"
+                },
+                "description": {
+                    "type": "string",
+                    "description": "What the macro does"
+                },
+                "defaults": {
+                    "type": "object",
+                    "description": "Default values for parameters"
+                }
+            },
+            "required": ["name", "commands"],
+            "additionalProperties": False
+        }
+    },
+    {
+        "name": "list_macros",
+        "description": "List the macros defined in PyMOL, or show one macro's commands",
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "name": {"type": "string", "description": "Macro to show"}
+            },
+            "additionalProperties": False
+        }
+    },
+    {
+        "name": "delete_macro",
+        "description": "Delete a macro",
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "name": {"type": "string", "description": "Macro name"}
+            },
+            "required": ["name"],
+            "additionalProperties": False
+        }
+    },
+    {
+        "name": "submit_job",
+        "description": "Queue a long-running batch job (a list of PyMOL commands or a script file) that runs in the background inside PyMOL and survives reconnects",
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "commands": {
+                    "type": "array",
+                    "items": {"type": "string"},
+                    "description": "PyMOL commands, one step each"
+                },
+                "script": {
+                    "type": "string",
+                    "description": "Path to a .pml or .py script (instead of commands)"
+                },
+                "name": {
+                    "type": "string",
+                    "description": "Label for the job"
+                },
+                "retries": {
+                    "type": "integer",
+                    "description": "Times a failed step is retried before the job fails (default: 0)"
+                }
+            },
+            "additionalProperties": False
+        }
+    },
+    {
+        "name": "job_status",
+        "description": "Show a batch job's progress and recent output, or list all jobs when no job_id is given",
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "job_id": {
+                    "type": "string",
+                    "description": "Job id returned by submit_job"
+                }
+            },
+            "additionalProperties": False
+        }
+    },
+    {
+        "name": "cancel_job",
+        "description": "Cancel a queued or running batch job",
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "job_id": {"type": "string", "description": "Job id"}
+            },
+            "required": ["job_id"],
+            "additionalProperties": False
+        }
+    },
+    {
+        "name": "resume_job",
+        "description": "Resume a failed or cancelled batch job from its first unfinished step",
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "job_id": {"type": "string", "description": "Job id"}
+            },
+            "required": ["job_id"],
+            "additionalProperties": False
+        }
+    },
+    {
+        "name": "search_sequence",
+        "description": "Find structure files whose chains contain a sequence motif, exactly or with a few substitutions, using a persistent k-mer index; returns file, chain and residue range",
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "sequence": {
+                    "type": "string",
+                    "description": "Motif in one-letter codes"
+                },
+                "max_mismatches": {
+                    "type": "integer",
+                    "description": "Substitutions allowed (default: 0)"
+                },
+                "directory": {
+                    "type": "string",
+                    "description": "Directory of structure files to index (new and changed files only) before searching"
+                },
+                "recursive": {
+                    "type": "boolean",
+                    "description": "Include subdirectories when indexing (default: true)"
+                },
+                "limit": {
+                    "type": "integer",
+                    "description": "Most hits to return (default: 100)"
+                }
+            },
+            "required": ["sequence"],
+            "additionalProperties": False
+        }
+    },
+    {
+        "name": "animate_view",
+        "description": "Move the PyMOL camera smoothly through keyframe views or named scenes, optionally rendering every frame to PNG files",
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "keyframes": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "view": {
+                                "type": "array",
+                                "items": {"type": "number"},
+                                "description": "18-value view from get_view"
+                            },
+                            "scene": {"type": "string", "description": "Named scene (instead of view)"},
+                            "duration": {"type": "number", "description": "Seconds to move here from the previous keyframe (default: 1)"}
+                        }
+                    },
+                    "minItems": 2,
+                    "description": "Views to pass through, in order"
+                },
+                "fps": {"type": "number", "description": "Frames per second (default: 30)"},
+                "ease": {"type": "boolean", "description": "Ease in and out of each keyframe (default: true)"},
+                "render": {
+                    "type": ["object", "boolean"],
+                    "properties": {
+                        "directory": {"type": "string", "description": "Directory for the frame PNGs"},
+                        "prefix": {"type": "string", "description": "File name prefix (default: frame)"},
+                        "width": {"type": "integer", "description": "Image width in pixels"},
+                        "height": {"type": "integer", "description": "Image height in pixels"},
+                        "ray": {"type": "boolean", "description": "Ray trace each frame (default: true)"}
+                    },
+                    "description": "Render every frame instead of playing it on screen (true for the default options)"
+                },
+                "background": {
+                    "type": "boolean",
+                    "description": "Queue the rendering as a batch job and return its id (requires render)"
+                }
+            },
+            "required": ["keyframes"],
+            "additionalProperties": False
+        }
+    },
+    {
+        "name": "trace",
+        "description": "Show where recent slow tool calls spent their time (bridge, socket, PyMOL queue and lock, cmd.do, serialization), optionally exporting a Chrome trace file",
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "trace_id": {
+                    "type": "string",
+                    "description": "Show only this trace"
+                },
+                "min_ms": {
+                    "type": "number",
+                    "description": "Only calls that took at least this many milliseconds (default: 100)"
+                },
+                "limit": {
+                    "type": "integer",
+                    "description": "Most traces to return (default: 20)"
+                },
+                "export": {
+                    "type": "string",
+                    "description": "Path of a trace file to write (open in chrome://tracing or Perfetto)"
+                }
+            },
+            "additionalProperties": False
+        }
+    },
+    {
+        "name": "run_in_worker",
+        "description": "Run a PyMOL command in a headless worker process, for batch work that should not block the interactive PyMOL",
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "command": {
+                    "type": "string",
+                    "description": "PyMOL command to execute"
+                },
+                "session": {
+                    "type": "string",
+                    "description": "Keep all commands with this name on the same worker (omit for stateless commands)"
+                },
+                "timeout": {
+                    "type": "number",
+                    "description": f"Seconds before the command is abandoned (default: {DEFAULT_TIMEOUT:g})"
+                }
+            },
+            "required": ["command"],
+            "additionalProperties": False
+        }
+    },
+    {
+        "name": "worker_status",
+        "description": "Show the headless PyMOL worker pool: health, load and sessions",
+        "inputSchema": {
+            "type": "object",
+            "properties": {},
+            "additionalProperties": False
+        }
+    },
+    {
+        "name": "release_worker_session",
+        "description": "Unbind a worker session so later commands with that name may run anywhere",
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "session": {
+                    "type": "string",
+                    "description": "Session name"
+                }
+            },
+            "required": ["session"],
+            "additionalProperties": False
+        }
+    }
+]
+
+# Typed tools calling cmd functions in PyMOL directly (tool name pymol_<function>):
+# (function, description, {argument: (JSON type, description)}, required arguments)
+_SELECTION = ("string", "Atom selection (default: all)")
+_STATE = ("integer", "State (default: 0, meaning current or all depending on the function)")
+CMD_TOOLS = [
+    ("load", "Load a structure or data file", {
+        "filename": ("string", "File path"),
+        "object": ("string", "Object name (default: from the file name)"),
+        "state": ("integer", "State to load into (default: append)"),
+        "format": ("string", "File format (default: from the extension)")
+    }, ["filename"]),
+    ("fetch", "Download a structure from the PDB", {
+        "code": ("string", "PDB id"),
+        "name": ("string", "Object name (default: the id)"),
+        "type": ("string", "cif, pdb, 2fofc, fofc, ... (default: cif)")
+    }, ["code"]),
+    ("delete", "Delete objects or selections", {
+        "name": ("string", "Name or pattern, e.g. 'all'")
+    }, ["name"]),
+    ("create", "Create an object from a selection", {
+        "name": ("string", "New object name"),
+        "selection": ("string", "Atoms to copy"),
+        "source_state": ("integer", "State to copy (default: all)"),
+        "target_state": ("integer", "State to create (default: same)")
+    }, ["name", "selection"]),
+    ("remove", "Remove atoms", {"selection": ("string", "Atoms to remove")}, ["selection"]),
+    ("select", "Create a named selection; returns the atom count", {
+        "name": ("string", "Selection name"),
+        "selection": ("string", "Selection expression"),
+        "enable": ("integer", "1 to show the selection indicator, 0 to hide it"),
+        "merge": ("integer", "1 to add to an existing selection")
+    }, ["name", "selection"]),
+    ("color", "Color atoms", {
+        "color": ("string", "Color name or 0xRRGGBB"),
+        "selection": _SELECTION
+    }, ["color"]),
+    ("show", "Show a representation", {
+        "representation": ("string", "lines, sticks, spheres, cartoon, surface, mesh, ..."),
+        "selection": _SELECTION
+    }, ["representation"]),
+    ("hide", "Hide a representation", {
+        "representation": ("string", "Representation or 'everything'"),
+        "selection": _SELECTION
+    }, ["representation"]),
+    ("cartoon", "Set the cartoon type", {
+        "type": ("string", "automatic, loop, rectangle, oval, tube, putty, ..."),
+        "selection": _SELECTION
+    }, ["type"]),
+    ("label", "Label atoms with an expression", {
+        "selection": ("string", "Atoms to label"),
+        "expression": ("string", "Python expression, e.g. 'resn+resi'")
+    }, ["selection", "expression"]),
+    ("set", "Change a setting", {
+        "name": ("string", "Setting name"),
+        "value": ("string", "New value"),
+        "selection": ("string", "Object or selection for per-object settings"),
+        "state": _STATE
+    }, ["name", "value"]),
+    ("get", "Read a setting", {
+        "name": ("string", "Setting name"),
+        "selection": ("string", "Object for per-object settings"),
+        "state": _STATE
+    }, ["name"]),
+    ("bg_color", "Set the background color", {"color": ("string", "Color name")}, ["color"]),
+    ("enable", "Show objects", {"name": ("string", "Object name or pattern")}, ["name"]),
+    ("disable", "Hide objects", {"name": ("string", "Object name or pattern")}, ["name"]),
+    ("get_view", "Return the 18-value view matrix", {}, []),
+    ("set_view", "Set the view from an 18-value view matrix", {
+        "view": ("array", "18 numbers as returned by pymol_get_view")
+    }, ["view"]),
+    ("zoom", "Zoom on a selection", {
+        "selection": _SELECTION,
+        "buffer": ("number", "Extra space in Angstroms"),
+        "complete": ("integer", "1 to include the whole of every atom")
+    }, []),
+    ("orient", "Orient the view along a selection's principal axes", {"selection": _SELECTION}, []),
+    ("center", "Center the view on a selection", {"selection": _SELECTION}, []),
+    ("turn", "Rotate the camera", {
+        "axis": ("string", "x, y or z"),
+        "angle": ("number", "Degrees")
+    }, ["axis", "angle"]),
+    ("count_atoms", "Count atoms in a selection", {"selection": _SELECTION, "state": _STATE}, []),
+    ("count_states", "Count states of a selection", {"selection": _SELECTION}, []),
+    ("get_names", "List object or selection names", {
+        "type": ("string", "objects, selections, all, public_objects, ..."),
+        "enabled_only": ("integer", "1 for enabled names only")
+    }, []),
+    ("get_object_list", "List the objects a selection touches", {"selection": _SELECTION}, []),
+    ("get_chains", "List the chains in a selection", {"selection": _SELECTION}, []),
+    ("get_extent", "Return the bounding box [[min], [max]] of a selection", {"selection": _SELECTION}, []),
+    ("get_fastastr", "Return the sequence of a selection as FASTA", {"selection": _SELECTION}, []),
+    ("align", "Sequence-align and superpose mobile onto target; returns RMSD and counts", {
+        "mobile": ("string", "Selection to move"),
+        "target": ("string", "Reference selection"),
+        "cycles": ("integer", "Outlier rejection cycles (default: 5)"),
+        "object": ("string", "Name for an alignment object")
+    }, ["mobile", "target"]),
+    ("super", "Structure-based superposition of mobile onto target", {
+        "mobile": ("string", "Selection to move"),
+        "target": ("string", "Reference selection"),
+        "cycles": ("integer", "Outlier rejection cycles (default: 5)"),
+        "object": ("string", "Name for an alignment object")
+    }, ["mobile", "target"]),
+    ("rms_cur", "RMSD between two selections without fitting", {
+        "mobile": ("string", "First selection"),
+        "target": ("string", "Second selection")
+    }, ["mobile", "target"]),
+    ("distance", "Create a distance object; returns the (average) distance", {
+        "name": ("string", "Distance object name"),
+        "selection1": ("string", "First selection"),
+        "selection2": ("string", "Second selection"),
+        "cutoff": ("number", "Longest distance shown"),
+        "mode": ("integer", "0 all pairs, 2 polar contacts, ...")
+    }, ["selection1", "selection2"]),
+    ("get_distance", "Distance between two single atoms", {
+        "atom1": ("string", "First atom"),
+        "atom2": ("string", "Second atom")
+    }, ["atom1", "atom2"]),
+    ("get_angle", "Angle between three single atoms", {
+        "atom1": ("string", "First atom"),
+        "atom2": ("string", "Vertex atom"),
+        "atom3": ("string", "Third atom")
+    }, ["atom1", "atom2", "atom3"]),
+    ("png", "Save an image", {
+        "filename": ("string", "Output path"),
+        "width": ("integer", "Pixels"),
+        "height": ("integer", "Pixels"),
+        "dpi": ("number", "Resolution stored in the file"),
+        "ray": ("integer", "1 to ray trace first")
+    }, ["filename"])
+]
+
+def _cmd_tool_schema(function, description, arguments, required):
+    properties = {}
+    for name, (json_type, text) in arguments.items():
+        properties[name] = {"type": json_type, "description": text}
+        if json_type == "array":
+            properties[name]["items"] = {"type": "number"}
+    return {
+        "name": f"pymol_{function}",
+        "description": f"{description} (cmd.{function})",
+        "inputSchema": {
+            "type": "object",
+            "properties": properties,
+            "required": required,
+            "additionalProperties": False
+        }
+    }
+
+# Built once at import from the static table above; only macro tools come from PyMOL
+CMD_TOOL_SCHEMAS = [_cmd_tool_schema(*spec) for spec in CMD_TOOLS]
+CMD_TOOL_FUNCTIONS = {spec[0] for spec in CMD_TOOLS}
+_tools_cache = {
+    "macro_tools": [],  # As last fetched from PyMOL
+    "fetched": False,
+    "attempted": 0.0,
+    "refreshing": False,
+    "listed": False  # Whether the client has seen a tool list to be told about changes
+}
+_tools_lock = threading.Lock()
+
+def list_tools():
+    """
+    Return the tool list without waiting for PyMOL
+    
+    Macro tools are fetched from PyMOL in the background (retried every
+    TOOLS_RETRY_INTERVAL seconds while it cannot be reached); until they
+    arrive the list has the bridge and typed cmd tools only, and the client
+    gets notifications/tools/list_changed once they do.
+    """
+    with _tools_lock:
+        _tools_cache["listed"] = True
+        macro_tools = _tools_cache["macro_tools"]
+    start_macro_tools_refresh()
+    return BRIDGE_TOOLS + CMD_TOOL_SCHEMAS + macro_tools
+
+def start_macro_tools_refresh():
+    """Fetch macro tools in the background unless they are cached or being fetched"""
+    with _tools_lock:
+        if (_tools_cache["fetched"] or _tools_cache["refreshing"]
+                or time.time() - _tools_cache["attempted"] < TOOLS_RETRY_INTERVAL):
+            return
+        _tools_cache["refreshing"] = True
+    threading.Thread(target=refresh_macro_tools, daemon=True).start()
+
+def refresh_macro_tools():
+    """
+    Fetch the macro tools from PyMOL into the cache
+    
+    Returns False when PyMOL cannot be reached (the cache is kept). The
+    client is notified if the list it has seen changed.
+    """
+    try:
+        macro_tools = list_macro_tools()
+    finally:
+        with _tools_lock:
+            _tools_cache["refreshing"] = False
+            _tools_cache["attempted"] = time.time()
+    if macro_tools is None:
+        return False
+    
+    with _tools_lock:
+        changed = macro_tools != _tools_cache["macro_tools"]
+        _tools_cache["macro_tools"] = macro_tools
+        _tools_cache["fetched"] = True
+        notify = changed and _tools_cache["listed"]
+    if notify:
+        write_message({"jsonrpc": "2.0", "method": "notifications/tools/list_changed"})
+    return True
+
+def invalidate_tools():
+    """Refetch the macro tools after macros were defined or deleted"""
+    refresh_macro_tools()
+
+def call_pymol_function(function, args, timeout=None, request_id=None):
+    """
+    Call a cmd function in PyMOL with keyword arguments
+    
+    Returns the structured result ({"function", "result"}) as data instead
+    of the text PyMOL would print for the equivalent command.
+    """
+    response = send_request_with_deadline(
+        {"type": "call", "function": function, "args": args or {}},
+        timeout,
+        request_id
+    )
+    data = response.get("data")
+    if response.get("status") == "success" and isinstance(data, dict) and "error" in data:
+        return {"status": "error", "message": data["error"], "data": None}
+    return response
+
+@contextlib.contextmanager
+def tracked_request(message):
+    """
+    Mint a plugin request id for a tool call and keep it in _inflight
+    
+    The id is derived from the JSON-RPC id so notifications/cancelled can
+    be forwarded to PyMOL while the call runs.
+    """
+    request_id = f"mcp-{message.get('id')}-{os.urandom(3).hex()}"
+    with _inflight_lock:
+        _inflight[message.get("id")] = (request_id, None)
+    try:
+        yield request_id
+    finally:
+        with _inflight_lock:
+            _inflight.pop(message.get("id"), None)
+
+def tracked_response(message, result):
+    """
+    Reply to a tracked tool call
+    
+    Cancelled calls get no response; timed-out ones get a TIMEOUT_ERROR.
+    """
+    if result.get("status") == "cancelled":
+        return None
+    if result.get("status") == "timeout":
         return {
-            "status": "error",
-            "message": f"Error sending command to PyMOL: {str(e)}",
-            "output": f"Error: {str(e)}"
+            "jsonrpc": "2.0",
+            "id": message.get("id"),
+            "error": {
+                "code": TIMEOUT_ERROR,
+                "message": f"Request timed out: {result['message']}",
+                "data": result
+            }
         }
+    return {
+        "jsonrpc": "2.0",
+        "id": message.get("id"),
+        "result": result
+    }
 
 # MCP Protocol Handler
 def process_message(message):
@@ -60,7 +1653,13 @@ def process_message(message):
                 "result": {
                     "protocolVersion": "2024-11-05",
                     "capabilities": {
-                        "tools": {}
+                        "tools": {"listChanged": True},
+                        "experimental": {
+                            "pymolEvents": {
+                                "notification": "notifications/pymol/events",
+                                "events": list(EVENT_TYPES)
+                            }
+                        }
                     },
                     "serverInfo": {
                         "name": "pymol-mcp-bridge",
@@ -70,7 +1669,17 @@ def process_message(message):
             }
         
         elif message.get("method") == "notifications/initialized":
-            # No response needed for notifications
+            # Have the macro tools ready by the time the client lists tools
+            start_macro_tools_refresh()
+            return None
+        
+        elif message.get("method") == "notifications/cancelled":
+            # Forward the cancellation to PyMOL; no response is sent
+            with _inflight_lock:
+                request_id, port = _inflight.get(message.get("params", {}).get("requestId"), (None, None))
+            if request_id:
+                cancel_pymol_request(request_id, port)
+                log(f"Cancelled PyMOL request {request_id}")
             return None
             
         elif message.get("method") == "tools/list":
@@ -79,23 +1688,7 @@ def process_message(message):
                 "jsonrpc": "2.0",
                 "id": message.get("id"),
                 "result": {
-                    "tools": [
-                        {
-                            "name": "send_command",
-                            "description": "Send a command to PyMOL",
-                            "inputSchema": {
-                                "type": "object",
-                                "properties": {
-                                    "command": {
-                                        "type": "string",
-                                        "description": "PyMOL command to execute"
-                                    }
-                                },
-                                "required": ["command"],
-                                "additionalProperties": False
-                            }
-                        }
-                    ]
+                    "tools": list_tools()
                 }
             }
         
@@ -107,7 +1700,7 @@ def process_message(message):
             if message.get("method") == "tools/call":
                 tool_name = params.get("name", "")
                 arguments = params.get("arguments", {})
-                sys.stderr.write(f"Received tools/call for {tool_name}\n")
+                log(f"Received tools/call for {tool_name}")
             else:  # tools/execute
                 tool_name = params.get("name", "")
                 arguments = params.get("arguments", {})
@@ -125,14 +1718,153 @@ def process_message(message):
                         }
                     }
                 
-                result = send_command_to_pymol(command)
-                sys.stderr.write(f"Sent command to PyMOL: {command}\n")
+                with tracked_request(message) as request_id:
+                    result = send_command_to_pymol(command, arguments.get("timeout"), request_id)
+                log(f"Sent command to PyMOL: {command}")
+                
+                return tracked_response(message, result)
+            elif tool_name == "run_in_worker":
+                command = arguments.get("command", "")
+                
+                if not command:
+                    return {
+                        "jsonrpc": "2.0",
+                        "id": message.get("id"),
+                        "error": {
+                            "code": -32602,
+                            "message": "Invalid params: command is required"
+                        }
+                    }
+                
+                with tracked_request(message) as request_id:
+                    result = run_command_in_worker(
+                        command,
+                        arguments.get("session"),
+                        arguments.get("timeout"),
+                        request_id
+                    )
+                log(f"Sent command to PyMOL worker {result.get('worker')}: {command}")
+                
+                return tracked_response(message, result)
+            
+            elif tool_name == "worker_status":
+                return {
+                    "jsonrpc": "2.0",
+                    "id": message.get("id"),
+                    "result": {
+                        "status": "success",
+                        "message": "PyMOL worker pool status",
+                        "data": {"workers": get_worker_pool().status()}
+                    }
+                }
+            
+            elif tool_name == "release_worker_session":
+                released = get_worker_pool().release_session(arguments.get("session"))
+                
+                return {
+                    "jsonrpc": "2.0",
+                    "id": message.get("id"),
+                    "result": {
+                        "status": "success",
+                        "message": "Session released" if released else "No such session",
+                        "data": None
+                    }
+                }
+            
+            elif tool_name in ("define_macro", "list_macros", "delete_macro"):
+                result = send_macro_request(tool_name, **arguments)
+                if tool_name != "list_macros" and result.get("status") == "success":
+                    invalidate_tools()
+                
+                return {
+                    "jsonrpc": "2.0",
+                    "id": message.get("id"),
+                    "result": result
+                }
+            
+            elif tool_name.startswith("pymol_") and tool_name[len("pymol_"):] in CMD_TOOL_FUNCTIONS:
+                with tracked_request(message) as request_id:
+                    result = call_pymol_function(tool_name[len("pymol_"):], arguments, request_id=request_id)
+                
+                return tracked_response(message, result)
+            
+            elif tool_name.startswith("macro_"):
+                with tracked_request(message) as request_id:
+                    result = send_macro_request(
+                        "run_macro",
+                        request_id,
+                        name=tool_name[len("macro_"):],
+                        args=arguments
+                    )
+                
+                return tracked_response(message, result)
+            
+            elif tool_name == "trace":
+                result = get_traces(
+                    arguments.get("trace_id"),
+                    arguments.get("min_ms"),
+                    arguments.get("limit", 20),
+                    arguments.get("export")
+                )
                 
                 return {
                     "jsonrpc": "2.0",
                     "id": message.get("id"),
                     "result": result
                 }
+            
+            elif tool_name == "search_sequence":
+                result = send_sequence_search(arguments)
+                
+                return {
+                    "jsonrpc": "2.0",
+                    "id": message.get("id"),
+                    "result": result
+                }
+            
+            elif tool_name == "animate_view":
+                with tracked_request(message) as request_id:
+                    result = send_animation_request(arguments, request_id)
+                
+                return tracked_response(message, result)
+            
+            elif tool_name in ("submit_job", "job_status", "cancel_job", "resume_job"):
+                if tool_name == "job_status" and not arguments.get("job_id"):
+                    result = send_job_request("list_jobs")
+                else:
+                    result = send_job_request(tool_name, **arguments)
+                
+                return {
+                    "jsonrpc": "2.0",
+                    "id": message.get("id"),
+                    "result": result
+                }
+            
+            elif tool_name == "subscribe_events":
+                result = subscribe_to_pymol_events(
+                    arguments.get("events"),
+                    arguments.get("interval", 0.5)
+                )
+                log("Subscribed to PyMOL events")
+                
+                return {
+                    "jsonrpc": "2.0",
+                    "id": message.get("id"),
+                    "result": result
+                }
+            
+            elif tool_name == "unsubscribe_events":
+                closed = unsubscribe_from_pymol_events()
+                
+                return {
+                    "jsonrpc": "2.0",
+                    "id": message.get("id"),
+                    "result": {
+                        "status": "success",
+                        "message": "Unsubscribed from PyMOL events" if closed else "No active subscription",
+                        "data": None
+                    }
+                }
             else:
                 return {
                     "jsonrpc": "2.0",
@@ -156,8 +1888,7 @@ def process_message(message):
     
     except Exception as e:
         # Internal error
-        sys.stderr.write(f"Error processing message: {str(e)}\n")
-        sys.stderr.flush()
+        log(f"Error processing message: {str(e)}")
         return {
             "jsonrpc": "2.0",
             "id": message.get("id"),
@@ -167,47 +1898,66 @@ def process_message(message):
             }
         }
 
+def _process_and_reply(message, received=None):
+    """Process a message and write its response, if any"""
+    trace = start_trace(message, received or time.time())
+    _trace_context.trace = trace
+    response = None
+    try:
+        response = process_message(message)
+    finally:
+        _trace_context.trace = None
+        # Kept before replying so the client's next call can already see it
+        if trace is not None:
+            finish_trace(trace, response)
+    
+    if response:  # Some notifications don't require responses
+        replying = time.time()
+        write_message(response)
+        if trace is not None:
+            trace["end"] = time.time()
+            record_span("reply", replying, trace["end"], trace)
+
 def main():
     """Main entry point"""
+    # Log lines are written to stderr in batches rather than one by one
+    threading.Thread(target=_flush_log_periodically, daemon=True).start()
+    atexit.register(flush_log)
+    
     # Read from stdin and write to stdout (MCP protocol)
-    sys.stderr.write("PyMOL MCP Bridge started\n")
-    sys.stderr.flush()
+    log("PyMOL MCP Bridge started")
     
-    buffer = ""
+    stdin = sys.stdin.buffer
     while True:
         try:
-            chunk = sys.stdin.read(1)
-            if not chunk:  # EOF
+            line = stdin.readline()
+            if not line:  # EOF
                 break
+            received = time.time()
             
-            buffer += chunk
-            
-            # Check for complete message (line break)
-            if buffer.endswith('\n'):
-                if buffer.strip():  # Skip empty lines
-                    try:
-                        message = json.loads(buffer)
-                        sys.stderr.write(f"Received message: {message.get('method')}\n")
-                        sys.stderr.flush()
-                        
-                        response = process_message(message)
-                        
-                        if response:  # Some notifications don't require responses
-                            sys.stdout.write(json.dumps(response) + '\n')
-                            sys.stdout.flush()
-                    
-                    except json.JSONDecodeError as e:
-                        # Invalid JSON
-                        sys.stderr.write(f"Error: Invalid JSON received: {e}\n")
-                        sys.stderr.flush()
-                
-                buffer = ""
+            if not line.strip():  # Skip empty lines
+                continue
+            try:
+                message = json.loads(line)
+            except json.JSONDecodeError as e:
+                # Invalid JSON
+                log(f"Error: Invalid JSON received: {e}")
+                continue
+            log(f"Received message: {message.get('method')}")
+            
+            if message.get("method") in ("tools/call", "tools/execute"):
+                # Tool calls may run for minutes; keep reading stdin
+                # so cancellations are seen while they run
+                worker = threading.Thread(target=_process_and_reply, args=(message, received))
+                worker.daemon = True
+                worker.start()
+            else:
+                _process_and_reply(message, received)
         
         except KeyboardInterrupt:
             break
         except Exception as e:
-            sys.stderr.write(f"Error in main loop: {str(e)}\n")
-            sys.stderr.flush()
+            log(f"Error in main loop: {str(e)}")
             break
 
 if __name__ == "__main__":
@@ -0,0 +1,54 @@
+import os
+import sys
+import threading
+
+import pytest
+
+# The plugin and the bridge are single-file modules next to this directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def plugin(tmp_path):
+    """A plugin with its own state directory and no socket server"""
+    import pymol_claude
+    plugin = pymol_claude.ClaudePlugin(state_dir=str(tmp_path / "state"))
+    plugin.running = True
+    yield plugin
+    plugin.running = False
+
+
+@pytest.fixture
+def lanes(plugin):
+    """The plugin with lane workers running, in a fresh PyMOL session"""
+    from pymol_claude import cmd
+    for name, lane in plugin.lanes.items():
+        for _ in range(lane["workers"]):
+            threading.Thread(target=plugin._run_lane_worker, args=(name,), daemon=True).start()
+    cmd.reinitialize()
+    yield plugin
+    cmd.reinitialize()
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    """A plugin serving on a free port, with the bridge pointed at it"""
+    import socket
+    import time
+    import pymol_claude
+    import pymol_mcp
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    plugin = pymol_claude.ClaudePlugin("127.0.0.1", port, state_dir=str(tmp_path / "state"))
+    plugin.checkpoint_interval = 0
+    pymol_claude.cmd.reinitialize()
+    plugin.start_mcp_server()
+    monkeypatch.setattr(pymol_mcp, "PYMOL_PORT", port)
+    deadline = time.time() + 5.0
+    while pymol_mcp.send_request_to_pymol({"type": "ping"}).get("status") != "success":
+        assert time.time() < deadline, "plugin server did not start"
+        time.sleep(0.05)
+    yield plugin
+    plugin.stop_mcp_server()
+    pymol_claude.cmd.reinitialize()
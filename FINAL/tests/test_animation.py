@@ -0,0 +1,136 @@
+import json
+import math
+import os
+
+import numpy as np
+import pytest
+
+import pymol_claude
+from pymol_claude import cmd
+
+
+def view_with_rotation(angle, distance=-50.0):
+    """A PyMOL view rotated by angle (radians) about z"""
+    c, s = math.cos(angle), math.sin(angle)
+    rotation = [c, -s, 0.0, s, c, 0.0, 0.0, 0.0, 1.0]
+    return rotation + [0.0, 0.0, distance, 1.0, 2.0, 3.0, 40.0, 60.0, 0.0]
+
+
+def rotation_angle(frame):
+    matrix = np.array(frame[:9]).reshape(3, 3)
+    return math.atan2(matrix[1, 0], matrix[0, 0])
+
+
+def test_frames_start_and_end_on_keyframes():
+    views = [view_with_rotation(0.0), view_with_rotation(math.pi / 2, -80.0), view_with_rotation(math.pi / 4)]
+    frames = pymol_claude.interpolate_views(views, [1.0, 0.5], fps=10)
+    assert len(frames) == 1 + 10 + 5
+    assert np.allclose(frames[0], views[0])
+    assert np.allclose(frames[10], views[1])
+    assert np.allclose(frames[-1], views[2])
+    for frame in frames:
+        matrix = np.array(frame[:9]).reshape(3, 3)
+        assert np.allclose(matrix @ matrix.T, np.eye(3), atol=1e-9)
+
+
+def test_linear_interpolation_without_ease():
+    views = [view_with_rotation(0.0, -40.0), view_with_rotation(math.pi / 2, -80.0)]
+    frames = pymol_claude.interpolate_views(views, [1.0], fps=4, ease=False)
+    assert [round(frame[11], 6) for frame in frames] == [-40.0, -50.0, -60.0, -70.0, -80.0]
+    assert [round(math.degrees(rotation_angle(frame)), 6) for frame in frames] == [0.0, 22.5, 45.0, 67.5, 90.0]
+
+
+def test_ease_slows_both_ends():
+    views = [view_with_rotation(0.0), view_with_rotation(math.pi / 2)]
+    frames = pymol_claude.interpolate_views(views, [1.0], fps=10, ease=True)
+    angles = [rotation_angle(frame) for frame in frames]
+    steps = np.diff(angles)
+    assert np.all(steps > 0)
+    assert steps[0] < steps[5] and steps[-1] < steps[5]
+    assert math.isclose(angles[5], math.pi / 4, abs_tol=1e-9)
+
+
+def test_short_segment_still_reaches_its_keyframe():
+    views = [view_with_rotation(0.0), view_with_rotation(1.0)]
+    frames = pymol_claude.interpolate_views(views, [0.0], fps=30)
+    assert len(frames) == 2
+    assert np.allclose(frames[-1], views[1])
+
+
+@pytest.mark.parametrize("render", [True, {}])
+def test_background_render_queues_call_steps(plugin, tmp_path, monkeypatch, render):
+    monkeypatch.chdir(tmp_path)
+    views = [view_with_rotation(0.0), view_with_rotation(0.5)]
+    result = plugin._animate_view({
+        "keyframes": [{"view": views[0]}, {"view": views[1], "duration": 0.1}],
+        "fps": 10,
+        "render": render,
+        "background": True
+    })
+    assert "error" not in result, result
+    with open(os.path.join(plugin.jobs_dir, f"{result['job_id']}.steps.json")) as f:
+        steps = json.load(f)
+    assert [step["function"] for step in steps[:4]] == ["set_view", "png", "set_view", "png"]
+    directory = result["directory"]
+    assert os.path.dirname(directory) == os.path.join(plugin.state_dir, "frames")
+    assert steps[1]["args"]["filename"] == os.path.join(directory, "frame0000.png")
+    
+    cmd.reinitialize()
+    cmd.fragment("ala")
+    plugin._run_batch_job(result["job_id"])
+    assert plugin._get_batch_job(result["job_id"])["state"] == "completed"
+    assert sorted(os.listdir(directory)) == ["frame0000.png", "frame0001.png"]
+    assert os.listdir(tmp_path) == ["state"]
+
+
+def test_render_must_be_true_or_options(plugin):
+    views = [view_with_rotation(0.0), view_with_rotation(0.5)]
+    result = plugin._animate_view({
+        "keyframes": [{"view": views[0]}, {"view": views[1]}],
+        "render": "yes"
+    })
+    assert "error" in result
+
+
+def test_render_into_a_given_directory(plugin, tmp_path):
+    cmd.reinitialize()
+    cmd.fragment("ala")
+    views = [view_with_rotation(0.0), view_with_rotation(0.5)]
+    result = plugin._animate_view({
+        "keyframes": [{"view": views[0]}, {"view": views[1], "duration": 0.1}],
+        "fps": 10,
+        "render": {"directory": str(tmp_path / "movie"), "prefix": "shot", "width": 40, "height": 30, "ray": False}
+    })
+    assert result["directory"] == str(tmp_path / "movie")
+    assert sorted(os.listdir(tmp_path / "movie")) == ["shot0000.png", "shot0001.png"]
+
+
+def test_scene_keyframes_leave_the_session_alone(plugin):
+    cmd.reinitialize()
+    cmd.fragment("ala")
+    cmd.orient()
+    cmd.scene("start", "store")
+    cmd.turn("x", 90)
+    cmd.color("red")
+    cmd.show_as("spheres")
+    cmd.scene("end", "store")
+    cmd.turn("y", 30)
+    view = cmd.get_view()
+    
+    result = plugin._animate_view({
+        "keyframes": [{"scene": "start"}, {"scene": "end", "duration": 0.1}],
+        "fps": 10,
+        "render": True,
+        "background": True
+    })
+    assert "error" not in result, result
+    assert np.allclose(cmd.get_view(), view)
+    assert cmd.get("scene_current_name") == "end"
+    colors = set()
+    cmd.iterate("ala", "colors.add(color)", space={"colors": colors})
+    assert colors == {cmd.get_color_index("red")}
+    assert cmd.count_atoms("rep spheres") == cmd.count_atoms("ala")
+    
+    with open(os.path.join(plugin.jobs_dir, f"{result['job_id']}.steps.json")) as f:
+        steps = json.load(f)
+    assert not np.allclose(steps[0]["args"]["view"], steps[-2]["args"]["view"])
@@ -0,0 +1,73 @@
+import pytest
+
+import pymol_claude
+from pymol_claude import cmd
+
+
+@pytest.fixture(autouse=True)
+def no_retry_delay(monkeypatch):
+    monkeypatch.setattr(pymol_claude, "JOB_RETRY_DELAY", 0.0)
+    cmd.reinitialize()
+    yield
+    cmd.reinitialize()
+
+
+def run_job(plugin, **request):
+    job = plugin._submit_batch_job(request)
+    assert "error" not in job, job
+    plugin._run_batch_job(job["id"])
+    return plugin._get_batch_job(job["id"])
+
+
+def test_split_command_steps():
+    lines = [
+        "# figure set",
+        "fragment ala",
+        "",
+        "python",
+        "for i in range(2):",
+        "    print(i)",
+        "python end",
+        "  color red, ala  ",
+    ]
+    assert pymol_claude.split_command_steps(lines) == [
+        "fragment ala",
+        "python\nfor i in range(2):\n    print(i)\npython end",
+        "color red, ala",
+    ]
+
+
+def test_split_command_steps_rejects_unterminated_block():
+    with pytest.raises(ValueError):
+        pymol_claude.split_command_steps(["python", "x = 1"])
+
+
+def test_inline_commands_keep_python_blocks_whole(plugin):
+    job = run_job(plugin, commands="fragment ala\npython\nfrom pymol import cmd\ncmd.set_name('ala', 'ala2')\npython end")
+    assert job["state"] == "completed"
+    assert job["total"] == 2
+    assert cmd.get_names("objects") == ["ala2"]
+
+
+def test_failed_step_is_retried_then_fails_the_job(plugin):
+    job = run_job(plugin, commands=["fragment ala", "bogus_cmd x", "fragment gly"], retries=2)
+    assert job["state"] == "failed"
+    assert job["completed"] == 1
+    assert [entry["attempt"] for entry in job["log"][1:]] == [1, 2, 3]
+    assert job["reason"]
+    assert cmd.get_names("objects") == ["ala"]
+
+
+def test_bad_selection_and_python_errors_fail(plugin):
+    assert run_job(plugin, commands="color red, nothing_here")["state"] == "failed"
+    assert run_job(plugin, commands="python\nraise ValueError('boom')\npython end")["state"] == "failed"
+
+
+def test_call_steps(plugin):
+    job = run_job(plugin, commands=[
+        "fragment ala",
+        {"function": "count_atoms", "args": {"selection": "ala"}},
+    ])
+    assert job["state"] == "completed"
+    assert job["log"][-1]["output"] == "10"
+    assert run_job(plugin, commands=[{"function": "no_such_function", "args": {}}])["state"] == "failed"
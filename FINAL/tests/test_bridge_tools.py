@@ -0,0 +1,121 @@
+import threading
+import time
+
+import pytest
+
+import pymol_mcp
+
+MACRO_TOOL = {"name": "macro_style", "description": "Style", "inputSchema": {"type": "object"}}
+
+
+@pytest.fixture
+def tools_cache(monkeypatch):
+    """A fresh tool cache, with notifications captured instead of written"""
+    monkeypatch.setattr(pymol_mcp, "_tools_cache", {
+        "macro_tools": [], "fetched": False, "attempted": 0.0, "refreshing": False, "listed": False
+    })
+    notifications = []
+    monkeypatch.setattr(pymol_mcp, "write_message", notifications.append)
+    return notifications
+
+
+def call_tool(name, arguments, request_id=7):
+    return pymol_mcp.process_message({
+        "jsonrpc": "2.0",
+        "id": request_id,
+        "method": "tools/call",
+        "params": {"name": name, "arguments": arguments}
+    })
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_typed_tool_schemas_come_from_the_static_table():
+    load = next(tool for tool in pymol_mcp.CMD_TOOL_SCHEMAS if tool["name"] == "pymol_load")
+    assert load["inputSchema"]["required"] == ["filename"]
+    assert load["inputSchema"]["additionalProperties"] is False
+    assert set(pymol_mcp.CMD_TOOL_FUNCTIONS) == {spec[0] for spec in pymol_mcp.CMD_TOOLS}
+
+
+def test_listing_tools_does_not_wait_for_pymol(tools_cache, monkeypatch):
+    unreachable = threading.Event()
+    monkeypatch.setattr(pymol_mcp, "list_macro_tools", lambda: unreachable.wait(1.0) and None)
+
+    started = time.time()
+    names = [tool["name"] for tool in pymol_mcp.list_tools()]
+    assert time.time() - started < 0.2
+    assert "pymol_load" in names and "send_command" in names
+
+    # A failed fetch is not retried on every listing
+    unreachable.set()
+    assert wait_for(lambda: not pymol_mcp._tools_cache["refreshing"])
+    attempted = pymol_mcp._tools_cache["attempted"]
+    pymol_mcp.list_tools()
+    assert pymol_mcp._tools_cache["attempted"] == attempted
+    assert tools_cache == []
+
+
+def test_macro_tools_arrive_with_a_list_changed_notification(tools_cache, monkeypatch):
+    monkeypatch.setattr(pymol_mcp, "list_macro_tools", lambda: [MACRO_TOOL])
+    assert MACRO_TOOL not in pymol_mcp.list_tools()
+    assert wait_for(lambda: tools_cache)
+    assert tools_cache == [{"jsonrpc": "2.0", "method": "notifications/tools/list_changed"}]
+    assert MACRO_TOOL in pymol_mcp.list_tools()
+
+    # Cached: the next listing does not go back to PyMOL
+    monkeypatch.setattr(pymol_mcp, "list_macro_tools", lambda: pytest.fail("listed macros again"))
+    assert MACRO_TOOL in pymol_mcp.list_tools()
+
+
+def test_defining_a_macro_refreshes_the_list(tools_cache, monkeypatch):
+    monkeypatch.setattr(pymol_mcp, "send_macro_request", lambda *args, **fields: {"status": "success"})
+    monkeypatch.setattr(pymol_mcp, "list_macro_tools", lambda: [MACRO_TOOL])
+    pymol_mcp._tools_cache["listed"] = True
+    call_tool("define_macro", {"name": "style", "commands": "show sticks"})
+    assert tools_cache == [{"jsonrpc": "2.0", "method": "notifications/tools/list_changed"}]
+    assert MACRO_TOOL in pymol_mcp.list_tools()
+
+
+def test_typed_tool_call_is_tracked_and_sent_as_a_call(monkeypatch):
+    sent = []
+
+    def fake_send(payload, timeout, request_id):
+        sent.append((payload, request_id, dict(pymol_mcp._inflight)))
+        return {"status": "success", "message": "ok", "data": {"function": "count_atoms", "result": 12}}
+
+    monkeypatch.setattr(pymol_mcp, "send_request_with_deadline", fake_send)
+    response = call_tool("pymol_count_atoms", {"selection": "ala"})
+
+    payload, request_id, inflight = sent[0]
+    assert payload == {"type": "call", "function": "count_atoms", "args": {"selection": "ala"}}
+    assert request_id.startswith("mcp-7-")
+    assert inflight[7] == (request_id, None)
+    assert 7 not in pymol_mcp._inflight
+    assert response["result"]["data"]["result"] == 12
+
+
+def test_typed_tool_errors_and_timeouts(monkeypatch):
+    responses = iter([
+        {"status": "success", "message": "ok", "data": {"error": "Unknown argument: bogus"}},
+        {"status": "timeout", "message": "No response from PyMOL within 1 seconds", "data": {}},
+        {"status": "cancelled", "message": "Request cancelled", "data": {}}
+    ])
+    monkeypatch.setattr(pymol_mcp, "send_request_with_deadline", lambda *args: next(responses))
+
+    assert call_tool("pymol_zoom", {"bogus": 1})["result"] == {
+        "status": "error", "message": "Unknown argument: bogus", "data": None
+    }
+    assert call_tool("pymol_zoom", {})["error"]["code"] == pymol_mcp.TIMEOUT_ERROR
+    assert call_tool("pymol_zoom", {}) is None
+
+
+def test_unlisted_cmd_functions_are_not_dispatched(monkeypatch):
+    monkeypatch.setattr(pymol_mcp, "send_request_with_deadline", lambda *args: pytest.fail("sent"))
+    assert call_tool("pymol_reinitialize", {})["error"]["message"] == "Tool not found: pymol_reinitialize"
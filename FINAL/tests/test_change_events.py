@@ -0,0 +1,101 @@
+import time
+
+import pytest
+
+import pymol_mcp
+from pymol_claude import cmd
+
+
+def snapshot(objects=(), selections=(), view=None, states=None):
+    return {
+        "objects": set(objects),
+        "selections": set(selections),
+        "view": view,
+        "states": states or {}
+    }
+
+
+def test_diff_reports_each_kind_of_change(plugin):
+    old = snapshot(["a", "b"], ["sel1"], (1.0,), {"a": 1, "b": 1})
+    new = snapshot(["b", "c"], ["sel2"], (2.0,), {"b": 5, "c": 1})
+    assert plugin._diff_snapshots(old, new) == [
+        {"event": "object_loaded", "name": "c"},
+        {"event": "object_deleted", "name": "a"},
+        {"event": "selection_created", "name": "sel2"},
+        {"event": "selection_deleted", "name": "sel1"},
+        {"event": "view_changed", "name": None, "view": [2.0]},
+        {"event": "state_count_changed", "name": "b", "states": 5, "previous": 1}
+    ]
+
+
+def test_diff_skips_categories_missing_from_either_snapshot(plugin):
+    assert plugin._diff_snapshots({"objects": {"a"}}, {"view": (1.0,)}) == []
+
+
+def test_snapshot_takes_only_what_is_needed(plugin):
+    cmd.reinitialize()
+    cmd.fragment("ala")
+    cmd.select("ca", "name CA")
+    assert plugin._snapshot_changes({"selection_created"}) == {"selections": {"ca"}}
+    assert plugin._snapshot_changes({"state_count_changed"}) == {"objects": {"ala"}, "states": {"ala": 1}}
+    cmd.reinitialize()
+
+
+def test_batches_coalesce_within_an_interval(plugin):
+    subscriber = {"pending": {}}
+    plugin._queue_event(subscriber, {"event": "object_loaded", "name": "tmp"})
+    plugin._queue_event(subscriber, {"event": "state_count_changed", "name": "tmp", "states": 2, "previous": 1})
+    plugin._queue_event(subscriber, {"event": "object_deleted", "name": "tmp"})
+    assert subscriber["pending"] == {}
+
+    plugin._queue_event(subscriber, {"event": "state_count_changed", "name": "md", "states": 2, "previous": 1})
+    plugin._queue_event(subscriber, {"event": "view_changed", "name": None, "view": [1.0]})
+    plugin._queue_event(subscriber, {"event": "state_count_changed", "name": "md", "states": 4, "previous": 2})
+    assert list(subscriber["pending"].values()) == [
+        {"event": "view_changed", "name": None, "view": [1.0]},
+        {"event": "state_count_changed", "name": "md", "states": 4, "previous": 1}
+    ]
+
+
+@pytest.fixture
+def notifications(server, monkeypatch):
+    written = []
+    monkeypatch.setattr(pymol_mcp, "write_message", written.append)
+    yield written
+    pymol_mcp.unsubscribe_from_pymol_events()
+
+
+def relayed_events(notifications, timeout=3.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline and not notifications:
+        time.sleep(0.05)
+    return [event for message in notifications for event in message["params"]["events"]]
+
+
+def test_subscription_relays_events_as_notifications(notifications):
+    response = pymol_mcp.subscribe_to_pymol_events(["object_loaded", "object_deleted"], interval=0.1)
+    assert response["status"] == "success"
+    time.sleep(0.3)
+
+    cmd.fragment("gly")
+    events = relayed_events(notifications)
+    assert events == [{"event": "object_loaded", "name": "gly"}]
+    assert notifications[0]["method"] == "notifications/pymol/events"
+
+
+def test_unknown_event_types_are_refused(server):
+    response = pymol_mcp.subscribe_to_pymol_events(["object_renamed"])
+    assert response["status"] == "error"
+    assert "object_renamed" in response["message"]
+    assert pymol_mcp._subscription["client"] is None
+
+
+def test_unsubscribing_stops_the_watcher(server, notifications):
+    pymol_mcp.subscribe_to_pymol_events(interval=0.1)
+    time.sleep(0.2)
+    assert pymol_mcp.unsubscribe_from_pymol_events()
+    deadline = time.time() + 3.0
+    while time.time() < deadline and server.watcher_thread is not None:
+        time.sleep(0.05)
+    assert server.watcher_thread is None
+    assert server.subscribers == {}
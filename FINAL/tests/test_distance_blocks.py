@@ -0,0 +1,54 @@
+import numpy as np
+
+from pymol_claude import iter_distance_blocks
+
+
+def random_groups(rng, n_groups, max_size):
+    sizes = rng.integers(1, max_size + 1, size=n_groups)
+    starts = np.concatenate([[0], np.cumsum(sizes)])
+    return rng.uniform(0, 30, size=(starts[-1], 3)), starts
+
+
+def brute_force(rows, row_starts, cols, col_starts):
+    distances = np.linalg.norm(rows[:, None, :] - cols[None, :, :], axis=2)
+    return np.array([
+        [distances[row_starts[i]:row_starts[i + 1], col_starts[j]:col_starts[j + 1]].min()
+         for j in range(len(col_starts) - 1)]
+        for i in range(len(row_starts) - 1)
+    ])
+
+
+def assemble(rows, row_starts, cols, col_starts, memory_limit):
+    matrix = np.full((len(row_starts) - 1, len(col_starts) - 1), np.nan)
+    for first, block in iter_distance_blocks(rows, row_starts, cols, col_starts, memory_limit):
+        matrix[first:first + len(block)] = block
+    return matrix
+
+
+def test_blocks_match_brute_force():
+    rng = np.random.default_rng(2)
+    rows, row_starts = random_groups(rng, 40, 12)
+    cols, col_starts = random_groups(rng, 30, 9)
+    expected = brute_force(rows, row_starts, cols, col_starts)
+    
+    # A large budget gives one block; tiny ones force row and column tiling
+    for memory_limit in (1 << 30, 24 * 200, 1):
+        matrix = assemble(rows, row_starts, cols, col_starts, memory_limit)
+        assert np.allclose(matrix, expected, atol=1e-4)
+
+
+def test_blocks_cover_every_row_group_once():
+    rng = np.random.default_rng(3)
+    rows, row_starts = random_groups(rng, 25, 5)
+    firsts = []
+    for first, block in iter_distance_blocks(rows, row_starts, rows, row_starts, 24 * 50):
+        firsts.extend(range(first, first + len(block)))
+    assert firsts == list(range(25))
+
+
+def test_self_distances_are_zero_on_the_diagonal():
+    rng = np.random.default_rng(4)
+    points, starts = random_groups(rng, 10, 6)
+    matrix = assemble(points, starts, points, starts, 1 << 20)
+    assert np.allclose(np.diag(matrix), 0.0, atol=1e-3)
+    assert np.allclose(matrix, matrix.T, atol=1e-4)
@@ -0,0 +1,53 @@
+import os
+import stat
+
+
+def write_versions(plugin, path, contents):
+    for content in contents:
+        result = plugin._edit_pdb_file(str(path), content)
+        assert "error" not in result, result
+
+
+def test_repeated_rollbacks_walk_back(plugin, tmp_path):
+    path = tmp_path / "model.pdb"
+    write_versions(plugin, path, ["A\n", "B\n", "C\n"])
+    
+    assert plugin._rollback_pdb_file(str(path))["hash"]
+    assert path.read_text() == "B\n"
+    plugin._rollback_pdb_file(str(path))
+    assert path.read_text() == "A\n"
+    assert "error" in plugin._rollback_pdb_file(str(path))
+    assert path.read_text() == "A\n"
+
+
+def test_rollback_to_a_version_then_edit(plugin, tmp_path):
+    path = tmp_path / "model.pdb"
+    write_versions(plugin, path, ["A\n", "B\n", "C\n"])
+    versions = plugin._pdb_history(str(path))["versions"]
+    
+    plugin._rollback_pdb_file(str(path), versions[0]["hash"][:12])
+    assert path.read_text() == "A\n"
+    write_versions(plugin, path, ["D\n"])
+    plugin._rollback_pdb_file(str(path))
+    assert path.read_text() == "C\n"
+
+
+def test_rollback_after_an_outside_change(plugin, tmp_path):
+    path = tmp_path / "model.pdb"
+    write_versions(plugin, path, ["A\n", "B\n"])
+    path.write_text("changed by hand\n")
+    os.utime(path, (1, 1))
+    
+    write_versions(plugin, path, ["C\n"])
+    plugin._rollback_pdb_file(str(path))
+    assert path.read_text() == "changed by hand\n"
+
+
+def test_atomic_write_keeps_mode_and_leaves_no_temp_files(plugin, tmp_path):
+    path = tmp_path / "model.pdb"
+    path.write_text("old\n")
+    os.chmod(path, 0o640)
+    plugin._write_file_atomic(str(path), b"new\n")
+    assert path.read_bytes() == b"new\n"
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o640
+    assert os.listdir(tmp_path) == ["model.pdb"]
@@ -0,0 +1,74 @@
+import gzip
+import random
+
+import pytest
+
+import pymol_claude
+
+
+@pytest.fixture(params=[1 << 16, 997])
+def read_chunk(request, monkeypatch):
+    monkeypatch.setattr(pymol_claude, "GZ_READ_CHUNK", request.param)
+
+
+def pdb_text(lines, seed):
+    rng = random.Random(seed)
+    return "".join(
+        f"ATOM  {i:5d}  CA  ALA A{i % 9999:4d}    {rng.uniform(-99, 99):8.3f}{rng.uniform(-99, 99):8.3f}{rng.uniform(-99, 99):8.3f}\n"
+        for i in range(lines)
+    ).encode()
+
+
+def check_random_reads(index, data, seed):
+    rng = random.Random(seed)
+    for _ in range(200):
+        offset = rng.randrange(len(data) + 10)
+        length = rng.randrange(1, 20000)
+        assert index.read(offset, length) == data[offset:offset + length]
+
+
+def test_random_reads_match_decompressed_data(tmp_path, read_chunk):
+    data = pdb_text(5000, seed=1)
+    path = tmp_path / "big.pdb.gz"
+    path.write_bytes(gzip.compress(data))
+    
+    index = pymol_claude.GzipSeekIndex(str(path), span=4096)
+    assert index.size == len(data)
+    assert len(index.offsets) > 10
+    check_random_reads(index, data, seed=2)
+
+
+def test_concatenated_members_and_padding(tmp_path, read_chunk):
+    parts = [pdb_text(n, seed=n) for n in (700, 1, 1500)]
+    path = tmp_path / "multi.pdb.gz"
+    path.write_bytes(b"".join(gzip.compress(part) for part in parts) + b"\0" * 64)
+    data = b"".join(parts)
+    
+    index = pymol_claude.GzipSeekIndex(str(path), span=2048)
+    assert index.size == len(data)
+    check_random_reads(index, data, seed=3)
+    # Reads across a member boundary
+    boundary = len(parts[0])
+    assert index.read(boundary - 50, 200) == data[boundary - 50:boundary + 150]
+
+
+def test_reads_outside_the_file(tmp_path):
+    path = tmp_path / "small.pdb.gz"
+    path.write_bytes(gzip.compress(b"HEADER\n"))
+    index = pymol_claude.GzipSeekIndex(str(path))
+    assert index.read(0, 100) == b"HEADER\n"
+    assert index.read(7, 10) == b""
+    assert index.read(-5, 3) == b"HEA"
+    assert index.read(2, 0) == b""
+
+
+def test_member_ending_on_a_read_boundary(tmp_path, monkeypatch):
+    first, second = pdb_text(300, seed=4), pdb_text(300, seed=5)
+    compressed = gzip.compress(first)
+    path = tmp_path / "boundary.pdb.gz"
+    path.write_bytes(compressed + gzip.compress(second))
+    monkeypatch.setattr(pymol_claude, "GZ_READ_CHUNK", len(compressed))
+    
+    index = pymol_claude.GzipSeekIndex(str(path), span=1024)
+    assert index.size == len(first) + len(second)
+    check_random_reads(index, first + second, seed=6)
@@ -0,0 +1,121 @@
+import queue
+import threading
+import time
+
+import pytest
+
+from pymol_claude import LANE_LIMITS, cmd
+
+
+def test_commands_have_run_when_the_response_arrives(lanes):
+    response = lanes._submit_request({"command": "fragment ala\ncolor red, ala", "timeout": 10})
+    assert response["status"] == "success"
+    assert response["data"]["result"] is True
+    assert cmd.get_names("objects") == ["ala"]
+
+
+def test_failed_line_stops_the_command(lanes):
+    response = lanes._submit_request({"command": "bogus_cmd x\nfragment ala", "timeout": 10})
+    assert response["data"]["result"] is False
+    assert cmd.get_names("objects") == []
+
+
+def test_slow_command_past_its_deadline_times_out(lanes):
+    started = time.time()
+    response = lanes._submit_request({"command": "/import time; time.sleep(1.5)", "timeout": 0.3})
+    assert response["status"] == "timeout"
+    assert response["data"]["state"] == "running"
+    assert time.time() - started < 1.0
+
+
+def test_deadline_is_checked_between_lines(lanes):
+    response = lanes._submit_request({
+        "command": "/import time; time.sleep(0.5)\nfragment ala",
+        "timeout": 0.2
+    })
+    assert response["status"] == "timeout"
+    time.sleep(0.6)
+    assert cmd.get_names("objects") == []
+
+
+@pytest.fixture
+def small_render_queue(plugin):
+    plugin.lanes["render"]["queue"] = queue.Queue(maxsize=1)
+
+
+def submit_in_background(plugin, request):
+    responses = []
+    thread = threading.Thread(target=lambda: responses.append(plugin._submit_request(request)))
+    thread.start()
+    return thread, responses
+
+
+def test_render_lane_admits_one_running_and_one_queued(small_render_queue, lanes):
+    slow = "/import time; time.sleep(0.6)\nray 10, 10"
+    running, first = submit_in_background(lanes, {"command": slow, "timeout": 10})
+    time.sleep(0.2)
+    queued, second = submit_in_background(lanes, {"command": slow, "timeout": 10})
+    time.sleep(0.1)
+    
+    refused = lanes._submit_request({"command": "png /tmp/never.png", "timeout": 10})
+    assert refused["status"] == "busy"
+    assert refused["data"]["lane"] == "render"
+    assert refused["data"]["retry_after"] > 0
+    # Other lanes are not affected
+    assert lanes._submit_request({"command": "fragment ala", "timeout": 10})["status"] == "success"
+    
+    running.join()
+    queued.join()
+    assert first[0]["status"] == second[0]["status"] == "success"
+
+
+def occupy_interactive_lane(plugin):
+    slow = {"command": "/import time; time.sleep(0.6)", "timeout": 10}
+    threads = [submit_in_background(plugin, dict(slow))[0] for _ in range(LANE_LIMITS["interactive"][0])]
+    time.sleep(0.1)
+    return threads
+
+
+def test_queued_request_expires_at_its_deadline(lanes):
+    running = occupy_interactive_lane(lanes)
+    response = lanes._submit_request({"command": "fragment ala", "timeout": 0.2})
+    assert response["status"] == "timeout"
+    assert response["data"]["state"] == "queued"
+    for thread in running:
+        thread.join()
+    time.sleep(0.1)
+    assert cmd.get_names("objects") == []
+
+
+def test_cancel_drops_a_queued_request(lanes):
+    running = occupy_interactive_lane(lanes)
+    queued, response = submit_in_background(lanes, {"command": "fragment ala", "request_id": "r1", "timeout": 10})
+    time.sleep(0.1)
+    assert lanes._cancel_request("r1")["data"]["state"] == "queued"
+    queued.join()
+    assert response[0]["status"] == "cancelled"
+    for thread in running:
+        thread.join()
+    time.sleep(0.1)
+    assert cmd.get_names("objects") == []
+
+
+def test_rate_limit_per_client(plugin, monkeypatch):
+    plugin.rate_limit, plugin.rate_burst = 1.0, 3
+    assert [plugin._take_rate_token("a") for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert plugin._take_rate_token("a") > 0
+    assert plugin._take_rate_token("b") == 0.0
+
+
+def test_idle_rate_buckets_are_dropped(plugin, monkeypatch):
+    plugin.rate_limit, plugin.rate_burst = 10.0, 5
+    now = [1000.0]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    plugin.rate_pruned = now[0]
+    for client in range(100):
+        plugin._take_rate_token(f"client-{client}")
+    assert len(plugin.rate_buckets) == 100
+    
+    now[0] += 0.6
+    plugin._take_rate_token("active")
+    assert set(plugin.rate_buckets) == {"active"}
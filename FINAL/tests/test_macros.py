@@ -0,0 +1,87 @@
+import time
+
+import pytest
+
+from pymol_claude import ClaudePlugin, cmd
+
+
+def define(plugin, name, commands, **fields):
+    return plugin._define_macro(dict(fields, name=name, commands=commands))
+
+
+@pytest.fixture
+def session():
+    cmd.reinitialize()
+    yield
+    cmd.reinitialize()
+
+
+def test_placeholders_become_parameters(plugin):
+    result = define(plugin, "show_res", "fragment $res\ncolor ${color}, $res", defaults={"color": "red"})
+    assert result["params"] == ["res", "color"]
+    assert result["defaults"] == {"color": "red"}
+    assert result["step_count"] == 2
+    assert not result["replaced"]
+    assert define(plugin, "show_res", "fragment $res")["replaced"]
+
+
+def test_definition_errors(plugin):
+    assert "Invalid macro name" in define(plugin, "1bad", "fragment ala")["error"]
+    assert "no commands" in define(plugin, "empty", "# nothing\n")["error"]
+    assert "Unknown PyMOL commands" in define(plugin, "typo", "fragmnet ala")["error"]
+    assert "not declared" in define(plugin, "params", "fragment $res", params=["other"])["error"]
+    assert "error" not in define(plugin, "later", "future_cmd x", validate=False)
+
+
+def test_macros_persist_in_the_state_directory(plugin):
+    define(plugin, "ala", "fragment ala")
+    reloaded = ClaudePlugin(state_dir=plugin.state_dir)
+    reloaded._load_macros()
+    assert reloaded._list_macros("ala")["steps"] == ["fragment ala"]
+
+
+def test_run_substitutes_arguments_and_defaults(plugin, session):
+    define(plugin, "show_res", "fragment $res\ncolor ${color}, $res", defaults={"color": "red"})
+    result = plugin._run_macro("show_res", {"res": "ala"})
+    assert result["result"] is True
+    assert cmd.get_names("objects") == ["ala"]
+    assert plugin._list_macros("show_res")["runs"] == 1
+
+
+def test_run_argument_errors(plugin, session):
+    define(plugin, "show_res", "fragment $res")
+    assert "No macro named" in plugin._run_macro("missing")["error"]
+    assert "Missing arguments: ['res']" in plugin._run_macro("show_res")["error"]
+    assert "unknown arguments: ['x']" in plugin._run_macro("show_res", {"res": "ala", "x": 1})["error"]
+    assert "span lines" in plugin._run_macro("show_res", {"res": "ala\ndelete all"})["error"]
+    assert cmd.get_names("objects") == []
+
+
+def test_failing_step_stops_the_macro(plugin, session):
+    define(plugin, "broken", "fragment ala\nfuture_cmd x\nfragment gly", validate=False)
+    result = plugin._run_macro("broken")
+    assert result["result"] is False
+    assert "future_cmd" in result["output"]
+    assert cmd.get_names("objects") == ["ala"]
+
+
+def test_python_block_steps_run_whole(plugin, session):
+    define(plugin, "block", "python\nfor name in ['ala', 'gly']:\n    cmd.fragment(name)\npython end")
+    assert plugin._run_macro("block")["result"] is True
+    assert cmd.get_names("objects") == ["ala", "gly"]
+
+
+def test_run_macro_request_honours_its_deadline(lanes):
+    define(lanes, "slow", "/import time; time.sleep(0.5)\nfragment ala")
+    started = time.time()
+    response = lanes._submit_request({"type": "run_macro", "name": "slow", "timeout": 0.2})
+    assert response["status"] == "timeout"
+    assert time.time() - started < 0.5
+    time.sleep(0.6)
+    assert cmd.get_names("objects") == []
+
+
+def test_render_macros_use_the_render_lane(plugin):
+    define(plugin, "figure", "png $path, ray=1")
+    assert plugin._list_macros("figure")["render"]
+    assert plugin._classify_request({"type": "run_macro", "name": "figure"}) == "render"
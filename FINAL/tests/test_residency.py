@@ -0,0 +1,80 @@
+import os
+
+import pytest
+
+import pymol_claude
+from pymol_claude import cmd
+
+
+@pytest.fixture(autouse=True)
+def fresh_session():
+    cmd.reinitialize()
+    yield
+    cmd.reinitialize()
+
+
+def evict(plugin, name):
+    plugin._enforce_residency()
+    plugin._evict_object(name)
+    assert name not in cmd.get_names("objects")
+
+
+def test_references_come_from_name_fields_only(plugin):
+    cmd.fragment("ala")
+    cmd.fragment("gly")
+    plugin._enforce_residency()
+    request = {"type": "edit_pdb", "content": "ATOM ala gly", "selection": "gly and name CA"}
+    assert plugin._referenced_objects(request) == {"gly"}
+    assert plugin._referenced_objects({"type": "call", "function": "count_atoms", "args": {"selection": "ala"}}) == {"ala"}
+    assert plugin._referenced_objects("color red, ala") == {"ala"}
+
+
+def test_footprints_are_measured_once_per_generation(plugin, monkeypatch):
+    cmd.fragment("ala")
+    plugin._enforce_residency()
+    calls = []
+    measure = plugin._measure_object
+    monkeypatch.setattr(plugin, "_measure_object", lambda name: calls.append(name) or measure(name))
+    plugin._enforce_residency({"ala"})
+    assert calls == []
+    plugin._bump_generations(["ala"])
+    plugin._enforce_residency({"ala"})
+    assert calls == ["ala"]
+
+
+def test_evictions_survive_a_restart(plugin, tmp_path):
+    cmd.fragment("ala")
+    evict(plugin, "ala")
+    
+    cmd.reinitialize()
+    restarted = pymol_claude.ClaudePlugin(state_dir=plugin.state_dir)
+    restarted._load_evictions()
+    assert set(restarted.evicted) == {"ala"}
+    restarted._page_in("color red, ala")
+    assert cmd.get_names("objects") == ["ala"]
+    assert cmd.count_atoms("ala") == 10
+    assert not restarted.evicted
+    assert os.listdir(restarted.evicted_dir) == ["index.json"]
+
+
+def test_orphaned_eviction_files_are_removed(plugin):
+    os.makedirs(plugin.evicted_dir)
+    orphan = os.path.join(plugin.evicted_dir, "old.1234.pse.z")
+    open(orphan, "wb").close()
+    plugin._load_evictions()
+    assert not os.path.exists(orphan)
+
+
+def test_checkpoints_include_evicted_objects(plugin):
+    cmd.fragment("ala")
+    cmd.fragment("gly")
+    plugin._write_checkpoint()
+    evict(plugin, "ala")
+    checkpoint = plugin._write_checkpoint()
+    assert checkpoint["objects"] == 2
+    
+    cmd.reinitialize()
+    restored = plugin._restore_checkpoint()
+    assert sorted(restored["restored"]) == ["ala", "gly"]
+    assert sorted(cmd.get_names("objects")) == ["ala", "gly"]
+    assert not plugin.evicted
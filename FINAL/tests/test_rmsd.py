@@ -0,0 +1,66 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+import pymol_claude
+
+
+def kabsch_rmsd(a, b):
+    """Reference RMSD of b superposed onto a, one pair at a time"""
+    a = a - a.mean(axis=0)
+    b = b - b.mean(axis=0)
+    u, _, vt = np.linalg.svd(b.T @ a)
+    d = np.sign(np.linalg.det(u @ vt))
+    rotation = u @ np.diag([1.0, 1.0, d]) @ vt
+    return np.sqrt(((b @ rotation - a) ** 2).sum(axis=1).mean())
+
+
+def random_rotation(rng):
+    q, r = np.linalg.qr(rng.normal(size=(3, 3)))
+    q *= np.sign(np.diag(r))
+    if np.linalg.det(q) < 0:
+        q[:, 0] *= -1
+    return q
+
+
+def test_rmsd_block_matches_pairwise_kabsch():
+    rng = np.random.default_rng(3)
+    coords = rng.normal(size=(7, 20, 3)) * 5
+    centered = coords - coords.mean(axis=1, keepdims=True)
+    block = pymol_claude.rmsd_block(centered[:3], centered[3:], fit=True)
+    expected = [[kabsch_rmsd(a, b) for b in coords[3:]] for a in coords[:3]]
+    assert np.allclose(block, expected, atol=1e-6)
+
+
+def test_rmsd_block_without_fit():
+    rng = np.random.default_rng(4)
+    coords = rng.normal(size=(5, 12, 3))
+    block = pymol_claude.rmsd_block(coords, coords, fit=False)
+    expected = np.sqrt(((coords[:, None] - coords[None, :]) ** 2).sum(axis=-1).mean(axis=-1))
+    assert np.allclose(block, expected, atol=1e-6)
+
+
+def test_rotated_copy_has_zero_rmsd():
+    rng = np.random.default_rng(5)
+    a = rng.normal(size=(30, 3))
+    a -= a.mean(axis=0)
+    b = a @ random_rotation(rng)
+    block = pymol_claude.rmsd_block(a[None], b[None], fit=True)
+    assert block[0, 0] < 1e-6
+
+
+def test_map_bounded_limits_work_in_flight():
+    running = []
+    peak = []
+    
+    def work(value):
+        running.append(value)
+        peak.append(len(running))
+        time.sleep(0.01)
+        running.remove(value)
+        return value * 2
+    
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pymol_claude.map_bounded(pool, work, [(i,) for i in range(20)], 3))
+    assert sorted(results) == [i * 2 for i in range(20)]
+    assert max(peak) <= 3
@@ -0,0 +1,102 @@
+import random
+
+import pytest
+
+import pymol_claude
+from pymol_claude import cmd
+
+AMINO_ACIDS = "ACDEFGHIKLMNPQRSTVWY"
+
+
+def random_chains(rng, count, alphabet=AMINO_ACIDS):
+    return [
+        ("ABCD"[i % 4], "".join(rng.choice(alphabet) for _ in range(rng.randrange(5, 120))))
+        for i in range(count)
+    ]
+
+
+def entries(chains_by_file):
+    return [
+        (path, 1.0, 1, [(chain, sequence, [str(i + 1) for i in range(len(sequence))]) for chain, sequence in chains])
+        for path, chains in chains_by_file.items()
+    ]
+
+
+def brute_force(chains_by_file, motif, max_mismatches):
+    hits = set()
+    for path, chains in chains_by_file.items():
+        for chain, sequence in chains:
+            for start in range(len(sequence) - len(motif) + 1):
+                mismatches = sum(a != b for a, b in zip(sequence[start:start + len(motif)], motif))
+                if mismatches <= max_mismatches:
+                    hits.add((path, chain, start, mismatches))
+    return hits
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    # A small alphabet makes approximate matches common
+    rng = random.Random(11)
+    chains_by_file = {f"/data/set{i % 2}/model{i}.pdb": random_chains(rng, 3, "ACDG") for i in range(12)}
+    index = pymol_claude.SequenceIndex(str(tmp_path / "index" / "sequences.db"), k=3)
+    index.update(entries(chains_by_file))
+    return index, chains_by_file, rng
+
+
+def search_set(index, motif, max_mismatches):
+    hits, total, _ = index.search(motif, max_mismatches, limit=10 ** 6)
+    assert total == len(hits)
+    return {(hit["file"], hit["chain"], hit["offset"], hit["mismatches"]) for hit in hits}
+
+
+@pytest.mark.parametrize("length,max_mismatches", [(2, 0), (3, 0), (6, 0), (6, 1), (9, 2), (7, 3), (2, 2)])
+def test_search_matches_brute_force(corpus, length, max_mismatches):
+    index, chains_by_file, rng = corpus
+    for _ in range(10):
+        # Take motifs from the data so exact hits exist, and mutate some
+        chain = rng.choice(rng.choice(list(chains_by_file.values())))[1]
+        start = rng.randrange(0, max(len(chain) - length, 0) + 1)
+        motif = list(chain[start:start + length].ljust(length, "A"))
+        motif[rng.randrange(length)] = rng.choice("ACDG")
+        motif = "".join(motif)
+        assert search_set(index, motif, max_mismatches) == brute_force(chains_by_file, motif, max_mismatches)
+
+
+def test_hits_are_ranked_and_labelled(corpus):
+    index, chains_by_file, _ = corpus
+    hits, total, scanned = index.search("acdg", 1, limit=5)
+    assert len(hits) == min(total, 5)
+    assert [hit["mismatches"] for hit in hits] == sorted(hit["mismatches"] for hit in hits)
+    for hit in hits:
+        assert hit["start"] == str(hit["offset"] + 1)
+        assert sum(a != b for a, b in zip(hit["match"], "ACDG")) == hit["mismatches"]
+
+
+def test_update_replaces_and_removes_files(corpus):
+    index, chains_by_file, _ = corpus
+    path = "/data/set0/model0.pdb"
+    chains_by_file[path] = [("A", "WWWWYYYY")]
+    index.update(entries({path: chains_by_file[path]}))
+    removed = "/data/set1/model1.pdb"
+    del chains_by_file[removed]
+    index.update([], [removed])
+    
+    assert index.stats() == {"files": 11, "chains": 31, "k": 3}
+    assert set(index.files_under("/data/set1")) == {p for p in chains_by_file if p.startswith("/data/set1/")}
+    assert search_set(index, "WWYY", 0) == {(path, "A", 2, 0)}
+    assert search_set(index, "ACDGA", 1) == brute_force(chains_by_file, "ACDGA", 1)
+
+
+def test_changing_k_rebuilds(corpus):
+    index, _, _ = corpus
+    reopened = pymol_claude.SequenceIndex(index.path, k=4)
+    assert reopened.stats() == {"files": 0, "chains": 0, "k": 4}
+
+
+def test_chain_sequences_from_coordinates(tmp_path):
+    cmd.reinitialize()
+    cmd.fab("ACDEFG", "peptide", chain="B")
+    path = str(tmp_path / "peptide.pdb")
+    cmd.save(path, "peptide")
+    cmd.reinitialize()
+    assert pymol_claude.chain_sequences(path) == [("B", "ACDEFG", ["1", "2", "3", "4", "5", "6"])]
@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+
+import pymol_mcp
+from pymol_claude import SHM_PREFIX, cmd
+
+
+def attachable(name):
+    try:
+        pymol_mcp._attach_shared_memory(name).close()
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def test_small_arrays_travel_inline(plugin):
+    array = np.arange(12, dtype=np.float32).reshape(4, 3)
+    descriptor = plugin._export_array(array)
+    assert descriptor["encoding"] == "base64"
+    assert "shm" not in descriptor
+    with plugin._import_array(descriptor) as imported:
+        assert np.array_equal(imported, array)
+
+
+def test_large_arrays_go_through_shared_memory(plugin):
+    plugin.shm_threshold = 64
+    array = np.random.default_rng(1).random((100, 3)).astype(np.float32)
+    descriptor = plugin._export_array(array)
+    assert descriptor["shm"].startswith(SHM_PREFIX)
+    assert descriptor["nbytes"] == array.nbytes
+    assert "data" not in descriptor
+
+    with pymol_mcp.shared_array(descriptor, release=False) as view:
+        assert np.array_equal(view, array)
+    assert plugin._release_shared_array(descriptor["shm"])
+    assert not attachable(descriptor["shm"])
+    assert not plugin._release_shared_array(descriptor["shm"])
+
+
+def test_expired_segments_are_cleaned_up(plugin):
+    kept = plugin._export_array(np.zeros(3), transport="shm", lifetime=60)
+    expired = plugin._export_array(np.zeros(3), transport="shm", lifetime=0)
+    plugin._cleanup_shared_arrays()
+    assert not attachable(expired["shm"])
+    assert attachable(kept["shm"])
+    plugin._cleanup_shared_arrays(release_all=True)
+    assert not attachable(kept["shm"])
+
+
+def test_client_segments_are_read_but_not_unlinked(plugin):
+    array = np.arange(30, dtype="<f4")
+    descriptor, segment = pymol_mcp.share_array(array, "<f4", (10, 3))
+    try:
+        with plugin._import_array(descriptor) as imported:
+            assert np.array_equal(imported.ravel(), array)
+        assert attachable(segment.name)
+    finally:
+        segment.close()
+        segment.unlink()
+
+
+def test_coordinates_round_trip_through_the_bridge(server):
+    cmd.fragment("trp")
+    server.shm_threshold = 0
+    response = pymol_mcp.send_request_to_pymol({"type": "get_coords", "selection": "trp"})
+    descriptor = response["data"]["coords"]
+    assert "shm" in descriptor
+
+    with pymol_mcp.shared_array(descriptor) as coords:
+        moved = np.array(coords) + 1.0
+    assert not attachable(descriptor["shm"])
+
+    outgoing, segment = pymol_mcp.share_array(moved.astype("<f4"), "<f4", moved.shape)
+    try:
+        response = pymol_mcp.send_request_to_pymol({"type": "set_coords", "selection": "trp", "coords": outgoing})
+        assert response["status"] == "success"
+        assert "error" not in response["data"], response
+    finally:
+        segment.close()
+        segment.unlink()
+    assert np.allclose(cmd.get_coords("trp"), moved, atol=1e-4)
+
+
+@pytest.mark.parametrize("transport", ["auto", "inline"])
+def test_inline_transport_keeps_small_coordinates_in_the_message(plugin, transport):
+    cmd.reinitialize()
+    cmd.fragment("ala")
+    result = plugin._get_coords("ala", transport=transport)
+    assert result["n_atoms"] == cmd.count_atoms("ala")
+    assert result["coords"]["encoding"] == "base64"
+    assert result["coords"]["shape"] == [result["n_atoms"], 3]
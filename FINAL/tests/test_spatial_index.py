@@ -0,0 +1,77 @@
+import numpy as np
+
+import pymol_claude
+from pymol_claude import SpatialGrid
+
+
+def brute_force_pairs(points, queries, radius):
+    distances = np.linalg.norm(queries[:, None, :] - points[None, :, :], axis=2)
+    query_index, point_index = np.nonzero(distances <= radius)
+    return set(zip(query_index.tolist(), point_index.tolist())), distances
+
+
+def test_pairs_within_matches_brute_force():
+    rng = np.random.default_rng(0)
+    points = rng.uniform(0, 40, size=(500, 3))
+    queries = rng.uniform(-5, 45, size=(120, 3))
+    for radius, cell_size in ((3.0, 5.0), (7.5, 5.0), (4.0, 2.0)):
+        grid = SpatialGrid(points, cell_size)
+        query_index, point_index, distance = grid.pairs_within(queries, radius)
+        expected, distances = brute_force_pairs(points, queries, radius)
+        assert set(zip(query_index.tolist(), point_index.tolist())) == expected
+        assert np.allclose(distance, distances[query_index, point_index])
+
+
+def test_nearest_matches_brute_force():
+    rng = np.random.default_rng(1)
+    points = rng.uniform(0, 30, size=(300, 3))
+    queries = rng.uniform(-10, 40, size=(50, 3))
+    grid = SpatialGrid(points, 4.0)
+    indices, distances = grid.nearest(queries, 5)
+    
+    expected = np.sort(np.linalg.norm(queries[:, None, :] - points[None, :, :], axis=2), axis=1)[:, :5]
+    assert np.allclose(distances, expected)
+    assert np.allclose(np.linalg.norm(queries[:, None, :] - points[indices], axis=2), expected)
+
+
+def test_nearest_pads_when_fewer_points_than_k():
+    grid = SpatialGrid([[0, 0, 0], [1, 0, 0]])
+    indices, distances = grid.nearest([[0.2, 0, 0]], 4)
+    assert indices[0].tolist() == [0, 1, -1, -1]
+    assert np.isinf(distances[0, 2:]).all()
+
+
+def test_empty_grid():
+    grid = SpatialGrid(np.zeros((0, 3)))
+    query_index, point_index, distance = grid.pairs_within([[0, 0, 0]], 5.0)
+    assert len(query_index) == len(point_index) == len(distance) == 0
+
+
+def test_selection_positions_with_unsorted_atom_ids(plugin, monkeypatch):
+    atom_ids = np.array([7, 3, 9, 1, 5], dtype=np.int64)
+    index = {"atom_ids": atom_ids, "id_order": np.argsort(atom_ids, kind="stable")}
+    monkeypatch.setattr(pymol_claude.cmd, "index", lambda selection: [("obj", 9), ("obj", 1), ("obj", 4)])
+    positions = plugin._selection_positions(index, "obj")
+    assert atom_ids[positions].tolist() == [9, 1]
+
+
+def test_commands_bump_only_the_objects_they_name(plugin):
+    cmd = pymol_claude.cmd
+    cmd.delete("all")
+    cmd.fragment("ala", "obj1")
+    cmd.fragment("gly", "obj2")
+    plugin._bump_generations()
+    
+    def changed(line):
+        before = dict(plugin.object_generations)
+        plugin._note_command_changes([line])
+        return {name for name in ("obj1", "obj2") if plugin.object_generations[name] != before[name]}
+    
+    try:
+        assert changed("color red, obj1 and name CA") == {"obj1"}
+        assert changed("zoom obj2") == set()
+        assert changed("color blue, obj1 or chain A") == {"obj1", "obj2"}
+        assert changed("remove resn HOH") == {"obj1", "obj2"}
+        assert changed("color green, obj*") == {"obj1", "obj2"}
+    finally:
+        cmd.delete("all")
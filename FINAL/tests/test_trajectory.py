@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+import pymol_mcp
+from pymol_claude import cmd
+
+
+def frames(count, n_atoms):
+    """Frames shifted along x by their number"""
+    base = np.zeros((n_atoms, 3), dtype=np.float32)
+    for number in range(count):
+        frame = base.copy()
+        frame[:, 0] = number + 1
+        yield frame
+
+
+@pytest.fixture
+def ala(server):
+    cmd.fragment("ala")
+    return cmd.count_atoms("ala")
+
+
+def test_frames_are_appended_as_states(ala):
+    with pymol_mcp.TrajectoryStream("ala", window=2) as stream:
+        assert stream.session["n_atoms"] == ala
+        for frame in frames(5, ala):
+            stream.push(frame)
+    assert stream.summary["status"] == "success"
+    assert stream.summary["data"]["applied"] == 5
+    assert cmd.count_states("ala") == 6
+    assert cmd.get_state() == 6
+    assert np.allclose(cmd.get_coords("ala", state=6)[:, 0], 5.0)
+
+
+def test_stride_and_max_states(ala):
+    with pymol_mcp.TrajectoryStream("ala", stride=2, max_states=3, follow=False) as stream:
+        for frame in frames(9, ala):
+            stream.push(frame)
+    data = stream.summary["data"]
+    assert (data["received"], data["applied"], data["skipped"]) == (9, 5, 4)
+    assert data["evicted"] == 3
+    assert cmd.count_states("ala") == 3
+    assert cmd.get_state() == 1
+    # Frames 1, 3, 5, 7 and 9 were kept; the three newest states remain
+    assert [cmd.get_coords("ala", state=state)[0, 0] for state in (1, 2, 3)] == [5.0, 7.0, 9.0]
+
+
+def test_large_frames_use_shared_memory(ala, monkeypatch):
+    monkeypatch.setattr(pymol_mcp, "SHM_THRESHOLD", 0)
+    with pymol_mcp.TrajectoryStream("ala", window=1) as stream:
+        for frame in frames(3, ala):
+            stream.push(frame)
+            assert all(segment is not None for segment in stream.in_flight.values())
+    assert stream.in_flight == {}
+    assert stream.summary["data"]["applied"] == 3
+
+
+def test_wrong_atom_count_ends_the_session(ala):
+    stream = pymol_mcp.TrajectoryStream("ala", window=1)
+    stream.open()
+    stream.push(np.zeros((ala + 1, 3), dtype=np.float32))
+    with pytest.raises(RuntimeError):
+        stream.push(np.zeros((ala, 3), dtype=np.float32))
+    stream.client.close()
+    assert cmd.count_states("ala") == 1
+
+
+def test_unknown_object_is_refused(server):
+    with pytest.raises(RuntimeError, match="Object not found: nothing"):
+        pymol_mcp.TrajectoryStream("nothing").open()
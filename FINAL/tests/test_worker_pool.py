@@ -0,0 +1,132 @@
+import socket
+import textwrap
+import time
+
+import pytest
+
+import pymol_mcp
+
+# Stands in for a headless PyMOL: answers every request with success and
+# exits with an error when its port is taken, like the plugin's main()
+FAKE_WORKER = textwrap.dedent("""
+    import argparse, json, socket, sys
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--port", type=int)
+    arg_parser.add_argument("--state-dir")
+    args = arg_parser.parse_args()
+    server = socket.socket()
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    try:
+        server.bind(("127.0.0.1", args.port))
+    except OSError:
+        sys.exit(1)
+    server.listen(5)
+    while True:
+        client, _ = server.accept()
+        data = b""
+        while not data.endswith(b"\\n\\n"):
+            data += client.recv(65536)
+        client.sendall(json.dumps({"status": "success", "message": "pong", "data": None}).encode())
+        client.close()
+""")
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+@pytest.fixture
+def fake_workers(tmp_path, monkeypatch):
+    script = tmp_path / "fake_worker.py"
+    script.write_text(FAKE_WORKER)
+    monkeypatch.setattr(pymol_mcp, "WORKER_SCRIPT", str(script))
+    monkeypatch.setattr(pymol_mcp, "WORKER_START_TIMEOUT", 5.0)
+    monkeypatch.setattr(pymol_mcp, "HEALTH_INTERVAL", 0.1)
+    monkeypatch.setattr(pymol_mcp, "CONNECT_TIMEOUT", 0.5)
+    pools = []
+
+    def make(size=1, base_port=None):
+        pool = pymol_mcp.PyMOLWorkerPool(size, base_port or free_port(), str(tmp_path / "workers"))
+        pools.append(pool)
+        return pool
+
+    yield make
+    for pool in pools:
+        pool.stop()
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def test_start_does_not_wait_for_workers(fake_workers):
+    pool = fake_workers()
+    started = time.time()
+    pool.start()
+    assert time.time() - started < 0.5
+
+    with pool.acquire() as lease:
+        assert lease["worker"] == 0
+        assert not lease["restarted"]
+    assert pool.status()[0]["healthy"]
+
+
+def test_dead_worker_is_restarted_and_session_told(fake_workers):
+    pool = fake_workers()
+    pool.start()
+    with pool.acquire(session="poses"):
+        pass
+
+    pool.workers[0]["process"].kill()
+    assert wait_for(lambda: pool.status()[0]["restarts"] == 1 and pool.status()[0]["healthy"])
+    with pool.acquire(session="poses") as lease:
+        assert lease["restarted"]
+    with pool.acquire(session="poses") as lease:
+        assert not lease["restarted"]
+
+
+def test_worker_on_a_taken_port_is_given_up_on(fake_workers):
+    with socket.socket() as taken:
+        taken.bind(("127.0.0.1", 0))
+        taken.listen(1)
+        pool = fake_workers(base_port=taken.getsockname()[1])
+        pool.start()
+
+        with pytest.raises(RuntimeError, match="No PyMOL worker could be started"):
+            with pool.acquire(wait=15.0):
+                pass
+        status = pool.status()[0]
+        assert status["given_up"]
+        assert status["restarts"] == pymol_mcp.WORKER_START_ATTEMPTS - 1
+
+        # The monitor leaves it alone from then on
+        time.sleep(0.5)
+        assert pool.status()[0]["restarts"] == pymol_mcp.WORKER_START_ATTEMPTS - 1
+
+
+def test_acquire_wait_is_bounded(fake_workers, monkeypatch):
+    pool = fake_workers()
+    monkeypatch.setattr(pool, "_launch", lambda worker: None)
+    pool.start()
+    started = time.time()
+    with pytest.raises(RuntimeError, match="No healthy PyMOL workers"):
+        with pool.acquire(wait=0.3):
+            pass
+    assert time.time() - started < 1.0
+
+
+def test_run_in_worker_reports_an_unavailable_pool(fake_workers, monkeypatch):
+    pool = fake_workers()
+    for worker in pool.workers:
+        worker["given_up"] = True
+    monkeypatch.setattr(pymol_mcp, "get_worker_pool", lambda: pool)
+    result = pymol_mcp.run_command_in_worker("fragment ala")
+    assert result["status"] == "error"
+    assert "No PyMOL worker could be started" in result["message"]